@@ -0,0 +1,45 @@
+"""
+Latency of RandomForestTransformer.predict vs. its CompiledForest, for small batches.
+
+    python benchmarks/compiled_forest_latency.py
+"""
+import time
+
+import numpy as np
+
+from sklearn_helpers import RandomForestTransformer
+
+
+def latencies(predict, X, batch_size, n_calls):
+    times = np.empty(n_calls)
+    for i in range(n_calls):
+        start = np.random.randint(len(X) - batch_size + 1)
+        batch = X[start:start + batch_size]
+
+        started = time.perf_counter()
+        predict(batch)
+        times[i] = time.perf_counter() - started
+
+    return times
+
+
+def main(n_estimators=100, n_features=20, n_rows=20000, n_calls=200):
+    rng = np.random.RandomState(0)
+    X = rng.rand(n_rows, n_features)
+    y = X[:, 0] + X[:, 1] ** 2 + .1 * rng.randn(n_rows)
+
+    forest = RandomForestTransformer(n_estimators=n_estimators, min_samples_leaf=5, random_state=0).fit(X, y)
+    compiled = forest.export_compiled()
+
+    print('{} trees, max depth {}'.format(n_estimators, compiled.max_depth))
+    print('{:>10} {:>10} {:>12} {:>12}'.format('batch', 'engine', 'p50 (ms)', 'p99 (ms)'))
+
+    for batch_size in [1, 10, 1000]:
+        for name, predict in [('predict', forest.predict), ('compiled', compiled.predict)]:
+            times = latencies(predict, X, batch_size, n_calls) * 1000
+            print('{:>10} {:>10} {:>12.3f} {:>12.3f}'.format(
+                batch_size, name, np.percentile(times, 50), np.percentile(times, 99)))
+
+
+if __name__ == '__main__':
+    main()
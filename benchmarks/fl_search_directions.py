@@ -0,0 +1,73 @@
+"""
+Evaluations-to-optimum of fl_search with direction='exhaustive', 'coordinate' and 'random', on synthetic convex and
+noisy objectives with k parameters of 20 values each.
+
+    python benchmarks/fl_search_directions.py
+"""
+import random
+
+import numpy as np
+
+from sklearn_helpers.search_param import fl_search
+
+
+def objectives(k, rng):
+    """
+    :return: A tuple (optimum, dictionary of objectives). optimum is the dictionary of parameters minimizing them all.
+    """
+    keys = ['p{}'.format(i) for i in range(k)]
+    center = rng.randint(-8, 8, size=k)
+    coupling = np.eye(k) + .4 * (np.ones((k, k)) - np.eye(k)) / k
+
+    def vector(param):
+        return np.array([param[key] for key in keys]) - center
+
+    def separable(param):
+        return float(np.sum(vector(param) ** 2))
+
+    def coupled(param):
+        x = vector(param)
+        return float(x @ coupling @ x)
+
+    def noisy(param):
+        return separable(param) + rng.normal(scale=.5)
+
+    return dict(zip(keys, center)), {'separable': separable, 'coupled': coupled, 'noisy': noisy}
+
+
+def evaluations_to_optimum(trace, optimum):
+    for i, (param, _) in enumerate(trace):
+        if param == optimum:
+            return i + 1
+    return None
+
+
+def main(ks=(2, 4, 6, 8, 10), n_seeds=10, n_iter=60):
+    print('{:>4} {:>10} {:>12} {:>10} {:>16} {:>12}'.format(
+        'k', 'objective', 'direction', 'found', 'evals to opt', 'total evals'))
+
+    for k in ks:
+        for name in ['separable', 'coupled', 'noisy']:
+            for direction in ['exhaustive', 'coordinate', 'random']:
+                found, to_optimum, totals = 0, [], []
+
+                for seed in range(n_seeds):
+                    rng = np.random.RandomState(seed)
+                    optimum, funs = objectives(k, rng)
+                    params = {key: list(range(-10, 10)) for key in optimum}
+
+                    random.seed(seed)
+                    _, _, trace = fl_search(funs[name], params, n_iter=n_iter, direction=direction, return_trace=True)
+
+                    evaluations = evaluations_to_optimum(trace, optimum)
+                    found += evaluations is not None
+                    to_optimum += [] if evaluations is None else [evaluations]
+                    totals.append(len(trace))
+
+                print('{:>4} {:>10} {:>12} {:>10} {:>16} {:>12}'.format(
+                    k, name, direction, '{}/{}'.format(found, n_seeds),
+                    '{:.0f}'.format(np.median(to_optimum)) if to_optimum else '-', '{:.0f}'.format(np.median(totals))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Load time of a pickled RandomForestTransformer vs. its memory mapped save() file, for growing forests.
+
+    python benchmarks/forest_artifact_load.py
+"""
+import os
+import pickle
+import tempfile
+import time
+
+import numpy as np
+
+from sklearn_helpers import RandomForestTransformer
+
+
+def main(n_features=20, n_rows=20000, sizes=(10, 50, 200)):
+    rng = np.random.RandomState(0)
+    X = rng.rand(n_rows, n_features)
+    y = X[:, 0] + X[:, 1] ** 2 + .1 * rng.randn(n_rows)
+
+    print('{:>8} {:>12} {:>12} {:>12} {:>12}'.format('trees', 'pickle MB', 'pickle ms', 'mmap MB', 'mmap ms'))
+
+    with tempfile.TemporaryDirectory() as directory:
+        pickle_path = os.path.join(directory, 'forest.pkl')
+        mmap_path = os.path.join(directory, 'forest.bin')
+
+        for n_estimators in sizes:
+            forest = RandomForestTransformer(n_estimators=n_estimators, random_state=0).fit(X, y)
+
+            with open(pickle_path, 'wb') as f:
+                pickle.dump(forest, f)
+            forest.save(mmap_path)
+
+            started = time.perf_counter()
+            with open(pickle_path, 'rb') as f:
+                pickle.load(f)
+            pickle_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            RandomForestTransformer.load(mmap_path)
+            mmap_time = time.perf_counter() - started
+
+            print('{:>8} {:>12.1f} {:>12.2f} {:>12.1f} {:>12.2f}'.format(
+                n_estimators, os.path.getsize(pickle_path) / 2 ** 20, pickle_time * 1000,
+                os.path.getsize(mmap_path) / 2 ** 20, mmap_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -12,6 +12,7 @@ setup(name='sklearn_helpers',
           'scikit-learn',
           'pandas',
           'numpy',
-          'scipy'
+          'scipy',
+          'joblib'
       ],
       zip_safe=False)
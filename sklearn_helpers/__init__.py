@@ -1,21 +1,42 @@
-from .quantile_calibrator import QuantileCalibrator
-from .random_forest_transformer import RandomForestTransformer
-from .search_oob import GridSearchOOB, RandomizedSearchOOB
-from .sparse_column_remover import SparseColumnRemover
-from .bootstrap_score import bootstrap_scores, BootstrapScorer
-from .categorical_cross_terms import categorical_cross_term_transform, CategoricalCrossTermTransformer
-from .quantile_scaler import QuantileScaler
-
-
-__all__ = [
-    'QuantileCalibrator',
-    'QuantileScaler',
-    'RandomForestTransformer',
-    'GridSearchOOB',
-    'RandomizedSearchOOB',
-    'SparseColumnRemover',
-    'bootstrap_scores',
-    'BootstrapScorer',
-    'categorical_cross_term_transform',
-    'CategoricalCrossTermTransformer'
-]
+import importlib
+
+
+# The classes are imported from their modules when they are first used, so that a module which only needs numpy
+# (compiled_calibrator, compiled_forest) can be imported, and scored with, on machines without pandas, scipy or
+# sklearn.
+_MODULES = {
+    'QuantileCalibrator': 'quantile_calibrator',
+    'CompiledQuantileCalibrator': 'compiled_calibrator',
+    'GroupedQuantileCalibrator': 'grouped_quantile_calibrator',
+    'QuantileScaler': 'quantile_scaler',
+    'QuantileSketch': 'quantile_sketch',
+    'RandomForestTransformer': 'random_forest_transformer',
+    'CompiledForest': 'compiled_forest',
+    'GridSearchOOB': 'search_oob',
+    'RandomizedSearchOOB': 'search_oob',
+    'HalvingRandomSearchOOB': 'search_oob',
+    'SearchResultCache': 'search_oob',
+    'SparseColumnRemover': 'sparse_column_remover',
+    'bootstrap_scores': 'bootstrap_score',
+    'BootstrapScorer': 'bootstrap_score',
+    'categorical_cross_term_transform': 'categorical_cross_terms',
+    'CategoricalCrossTermTransformer': 'categorical_cross_terms',
+    'HashedCrossTermTransformer': 'categorical_cross_terms'
+}
+
+
+__all__ = list(_MODULES)
+
+
+def __getattr__(name):
+    if name not in _MODULES:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+    value = getattr(importlib.import_module('.' + _MODULES[name], __name__), name)
+    globals()[name] = value
+
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
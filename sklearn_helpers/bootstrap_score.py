@@ -1,53 +1,454 @@
 import numpy as np
 import pandas as pd
-from sklearn.utils.validation import _num_samples
-from sklearn.metrics import r2_score
+from joblib import Parallel, delayed, effective_n_jobs
 
+from .quantile_sketch import QuantileSketch
+from sklearn.metrics import r2_score, mean_squared_error, mean_absolute_error, log_loss, roc_auc_score
 
-__all__ = ['bootstrap_scores', 'BootstrapScorer']
 
+__all__ = ['bootstrap_scores', 'gini_score', 'BootstrapScorer']
 
-def bootstrap_scores(y_true, y_pred, score_fun, n_samples, sample_weight=None):
+
+def gini_score(y_true, y_pred, sample_weight=None):
+    """
+    The (normalized) Gini coefficient, 2 * AUC - 1.
+    :param y_true: Array-like of binary ground truth y-values.
+    :param y_pred: Array-like of scores - the same length as y_true
+    :param sample_weight: Optional argument. Array-like the same length as y_true. Default None
+    :return: The Gini coefficient, a real number between -1 and 1.
+    """
+    return 2 * roc_auc_score(y_true, y_pred, sample_weight=sample_weight) - 1
+
+
+# The batched metrics take y_true and a 2D y_pred (one column per model), precompute what doesn't depend on the
+# resample, and return a function which scores a (n_resamples, n) matrix of row weights for every model.
+
+def _batched_r2(y_true, y_pred):
+    squared_errors = (y_true[:, None] - y_pred) ** 2
+
+    # Center first, so the total sum of squares doesn't lose precision.
+    centered = y_true - y_true.mean()
+    centered_squares = centered ** 2
+
+    def score(weights):
+        total = weights @ centered_squares - (weights @ centered) ** 2 / weights.sum(axis=1)
+        return 1 - weights @ squared_errors / total[:, None]
+
+    return score
+
+
+def _batched_mean(losses):
+    def score(weights):
+        return weights @ losses / weights.sum(axis=1)[:, None]
+
+    return score
+
+
+def _batched_mse(y_true, y_pred):
+    return _batched_mean((y_true[:, None] - y_pred) ** 2)
+
+
+def _batched_mae(y_true, y_pred):
+    return _batched_mean(np.abs(y_true[:, None] - y_pred))
+
+
+def _batched_log_loss(y_true, y_pred):
+    y_pred = np.clip(y_pred, 1e-15, 1 - 1e-15)
+
+    return _batched_mean(-(y_true[:, None] * np.log(y_pred) + (1 - y_true[:, None]) * np.log(1 - y_pred)))
+
+
+def _weighted_auc(weights, y_true, order, starts):
+    """
+    The AUC of one model for every resample. Works in place as far as possible, since every array here is as large
+    as weights.
+    """
+    # Weighted Mann-Whitney statistic: for every negative, the weight of the positives with a higher score, plus
+    # half the weight of those with the same score.
+    sorted_weights = weights[:, order]
+    negatives = np.add.reduceat(sorted_weights, starts, axis=1)
+    sorted_weights *= y_true[order]
+    positives = np.add.reduceat(sorted_weights, starts, axis=1)
+    del sorted_weights
+    negatives -= positives
+
+    total_positives = positives.sum(axis=1)
+    above = np.cumsum(positives, axis=1)
+    np.subtract(total_positives[:, None], above, out=above)
+    positives *= .5
+    above += positives
+    above *= negatives
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return above.sum(axis=1) / (total_positives * negatives.sum(axis=1))
+
+
+def _batched_auc(y_true, y_pred):
+    orders = [np.argsort(y_pred[:, j], kind='mergesort') for j in range(y_pred.shape[1])]
+    tie_starts = [np.flatnonzero(np.concatenate([[True], np.diff(y_pred[order, j]) != 0]))
+                  for j, order in enumerate(orders)]
+
+    def score(weights):
+        result = np.empty((len(weights), len(orders)))
+
+        for j, (order, starts) in enumerate(zip(orders, tie_starts)):
+            result[:, j] = _weighted_auc(weights, y_true, order, starts)
+
+        return result
+
+    return score
+
+
+def _batched_gini(y_true, y_pred):
+    auc = _batched_auc(y_true, y_pred)
+
+    def score(weights):
+        return 2 * auc(weights) - 1
+
+    return score
+
+
+# Score functions which can be computed for a whole batch of resamples at once, as matrix operations.
+BATCHED_METRICS = {
+    r2_score: _batched_r2,
+    mean_squared_error: _batched_mse,
+    mean_absolute_error: _batched_mae,
+    log_loss: _batched_log_loss,
+    roc_auc_score: _batched_auc,
+    gini_score: _batched_gini
+}
+
+_BINARY_METRICS = [log_loss, roc_auc_score, gini_score]
+
+# Bytes of memory per row and resample used by a batch of the batched metrics. All of them hold the weights next to
+# either the indices or the counts they are drawn from (16 bytes). The AUC, for one model at a time, also holds a
+# copy of the weights in the order of the model's predictions, and the sums of the weights per tie (32 bytes).
+_BYTES_PER_ELEMENT = {score_fun: 32 if score_fun in [roc_auc_score, gini_score] else 16
+                      for score_fun in BATCHED_METRICS}
+
+# Bytes of memory per row and model used by the batched metrics for all batches, e.g. the losses or sort orders.
+_BYTES_PER_MODEL_ELEMENT = 16
+
+
+def _is_batched(score_fun, y_true):
+    if score_fun not in BATCHED_METRICS:
+        return False
+
+    # The batched classification metrics take 0/1 labels only.
+    return score_fun not in _BINARY_METRICS or np.isin(y_true, [0, 1]).all()
+
+
+def _seed_sequence(random_state):
+    """
+    :param random_state: None, an int or a numpy.random.SeedSequence. None draws the seed from the global numpy
+           random state, so np.random.seed still makes results reproducible.
+    :return: A numpy.random.SeedSequence.
+    """
+    if isinstance(random_state, np.random.SeedSequence):
+        return random_state
+
+    if random_state is None:
+        random_state = np.random.randint(np.iinfo(np.int64).max)
+
+    return np.random.SeedSequence(random_state)
+
+
+def _seed_sequences(random_state, n_samples):
+    """
+    :return: One independent numpy.random.SeedSequence per resample, spawned from random_state.
+    """
+    return _seed_sequence(random_state).spawn(n_samples)
+
+
+def _resample_indices(n, seed):
+    return np.random.default_rng(seed).integers(n, size=n)
+
+
+def _resample_counts(n, seeds):
+    """
+    Draw bootstrap resamples as counts: how often every row is drawn (with replacement) in each resample.
+    :param n: Number of rows.
+    :param seeds: One numpy.random.SeedSequence per resample.
+    :return: Numpy array of shape (len(seeds), n).
+    """
+    indices = np.empty((len(seeds), n), dtype=np.int64)
+    for i, seed in enumerate(seeds):
+        indices[i] = _resample_indices(n, seed)
+        indices[i] += i * n
+
+    return np.bincount(indices.ravel(), minlength=len(seeds) * n).reshape(len(seeds), n)
+
+
+def _resample_weights(n, seeds, sample_weight):
+    """
+    :return: The row weights of resamples, the counts times sample_weight. Numpy array of shape (len(seeds), n).
+    """
+    weights = _resample_counts(n, seeds).astype(float)
+    if sample_weight is not None:
+        weights *= sample_weight
+
+    return weights
+
+
+def _batch_size(score_fun, n, n_models, batch_memory):
+    """
+    :return: The number of resamples of a batched metric to score at once, to use about batch_memory bytes.
+    """
+    available = batch_memory - _BYTES_PER_MODEL_ELEMENT * n * n_models
+
+    return max(1, available // (_BYTES_PER_ELEMENT[score_fun] * n))
+
+
+def _score_batches(batched_metric, y_true, y_pred, sample_weight, batches):
+    metric = batched_metric(y_true, y_pred)
+
+    # The weights of a batch are dropped before those of the next one are drawn.
+    return np.concatenate([metric(_resample_weights(len(y_true), seeds, sample_weight)) for seeds in batches])
+
+
+def _score_resamples(score_fun, y_true, y_pred, sample_weight, seeds):
+    scores = np.empty((len(seeds), y_pred.shape[1]))
+
+    for i, seed in enumerate(seeds):
+        # Gather once, and score every model on the same resample.
+        indices = _resample_indices(len(y_true), seed)
+        resampled_true, resampled_pred = y_true[indices], y_pred[indices]
+        weights = None if sample_weight is None else sample_weight[indices]
+
+        for j in range(y_pred.shape[1]):
+            scores[i, j] = score_fun(resampled_true, resampled_pred[:, j], sample_weight=weights)
+
+    return scores
+
+
+def _batched_scores(score_fun, y_true, y_pred, sample_weight, seeds, batch_memory, n_jobs):
+    """
+    Bootstrap a built-in score function, for batches of resamples at once.
+    :return: Numpy array of shape (len(seeds), n_models).
+    """
+    # The batches only depend on batch_memory, not on n_jobs, so every resample is scored the same way whichever
+    # worker it lands on.
+    batch_size = _batch_size(score_fun, len(y_true), y_pred.shape[1], batch_memory)
+    batches = [seeds[start:start + batch_size] for start in range(0, len(seeds), batch_size)]
+
+    # Large arrays are memory mapped by joblib (anything above max_nbytes), rather than pickled for every worker.
+    # Convert them once, so every task gets the same arrays rather than fresh copies to hash and dump.
+    y_true = np.asarray(y_true, dtype=float)
+    y_pred = np.asarray(y_pred, dtype=float)
+
+    chunks = np.array_split(np.arange(len(batches)), min(effective_n_jobs(n_jobs), len(batches)))
+    results = Parallel(n_jobs=n_jobs, max_nbytes='1M')(
+        delayed(_score_batches)(BATCHED_METRICS[score_fun], y_true, y_pred, sample_weight,
+                                [batches[i] for i in chunk])
+        for chunk in chunks)
+
+    return np.concatenate(results)
+
+
+def _generic_scores(score_fun, y_true, y_pred, sample_weight, seeds, n_jobs):
+    """
+    Bootstrap any score function, calling it once per resample and model.
+    :return: Numpy array of shape (len(seeds), n_models).
+    """
+    chunks = np.array_split(np.arange(len(seeds)), min(effective_n_jobs(n_jobs), len(seeds)))
+    results = Parallel(n_jobs=n_jobs, max_nbytes='1M')(
+        delayed(_score_resamples)(score_fun, y_true, y_pred, sample_weight, [seeds[i] for i in chunk])
+        for chunk in chunks)
+
+    return np.concatenate(results)
+
+
+def bootstrap_scores(y_true, y_pred, score_fun, n_samples, sample_weight=None, batch_memory=2 ** 28, n_jobs=1,
+                     random_state=None, multiple_models=False):
     """
     Create Bootstrapped scores
+
+    If score_fun is one of the built-in metrics (see BATCHED_METRICS: r2_score, mean_squared_error,
+    mean_absolute_error, log_loss, roc_auc_score and gini_score) the resamples are drawn as counts of every row, and
+    scored in batches as matrix operations. That is much faster than calling score_fun once per resample.
+
+    Every resample draws from its own random stream, spawned from random_state, so the scores only depend on
+    random_state and not on n_jobs.
+
+    With multiple_models, y_pred holds the predictions of several models, as columns. All models are scored on the
+    same resamples, so their scores are paired. Otherwise a 2D y_pred is passed to score_fun as a whole, e.g. the
+    output of predict_proba for log_loss.
+
     :param y_true: Array-like of ground truth y-values.
-    :param y_pred: Array-like of predicted y-values - the same length as y_true
+    :param y_pred: Array-like of predicted y-values - the same length as y_true. With multiple_models, a 2D
+           array-like with the predictions of a model in every column.
     :param score_fun: A function which accepts y_true, y_pred, an optional sample_weights, and returns a real number.
     :param n_samples: The number of times the score function is called.
     :param sample_weight: Optional argument. Array-like the same length as y_true. Default None
-    :return: An array of bootstrapped scores.
+    :param batch_memory: Bytes of memory to use for a batch of resamples of the built-in metrics. Default: 2 ** 28.
+    :param n_jobs: Number of processes to split the resamples over. Default: 1.
+    :param random_state: None, an int or a numpy.random.SeedSequence. If None, the seed is drawn from the global numpy
+           random state. Default: None.
+    :param multiple_models: If true, score every column of y_pred as a separate model. Default: False.
+    :return: An array of bootstrapped scores. With multiple_models, of shape (n_samples, n_models).
     """
 
-    def indices_generator():
-        n = _num_samples(y_true)
-        for i in range(n_samples):
-            yield np.random.choice(n, n, replace=True)
-
     # In case we were passed a pandas Series instead of an np.array or list.
-    if hasattr(y_true, 'values'):
-        y_true = y_true.values
-    if hasattr(y_pred, 'values'):
-        y_pred = y_pred.values
+    y_true = np.asarray(y_true)
+    y_pred = np.asarray(y_pred)
+    if multiple_models:
+        if y_pred.ndim != 2:
+            raise ValueError('With multiple_models, y_pred must be 2D, with the predictions of a model in every '
+                             'column. Got {} dimension(s).'.format(y_pred.ndim))
+    else:
+        # A single model, whatever the shape of its predictions.
+        y_pred = y_pred[:, None]
+    if sample_weight is not None:
+        sample_weight = np.asarray(sample_weight, dtype=float)
+
+    seeds = _seed_sequences(random_state, n_samples)
+
+    # The batched metrics take one column of predictions per model.
+    if y_pred.ndim == 2 and _is_batched(score_fun, y_true):
+        scores = _batched_scores(score_fun, y_true, y_pred, sample_weight, seeds, batch_memory, n_jobs)
+    else:
+        scores = _generic_scores(score_fun, y_true, y_pred, sample_weight, seeds, n_jobs)
 
-    return np.array([
-        score_fun(y_true[indices], y_pred[indices], sample_weight=sample_weight) for indices in indices_generator()
-    ])
+    return scores if multiple_models else scores[:, 0]
 
 
 class BootstrapScorer:
+    """
+    Bootstrap a score, and describe its distribution.
+
+    With tol set, resamples are run in batches of batch_size until the interval (a pair of percentiles) of the scores
+    changes less than tol between batches, or n_samples resamples have been run. The interval is tracked with a
+    streaming summary (a QuantileSketch), so a check doesn't grow with the number of resamples run so far.
+
+    To compare models, set multiple_models and pass the predictions of all of them as the columns of a 2D y_pred. They
+    are scored on the same resamples, and differences_ holds the paired differences of every model's score to the one
+    of the reference model.
+    """
 
-    def __init__(self, score_fun=r2_score, n_samples=100):
+    def __init__(self, score_fun=r2_score, n_samples=100, batch_memory=2 ** 28, n_jobs=1, random_state=None,
+                 tol=None, batch_size=100, interval=(2.5, 97.5), compression=1000, multiple_models=False,
+                 reference=0):
         """
         Construct a bootstrap scorer object
-        :param score_fun: A function which accepts y_true and y_pred and returns a real number.
-        :param n_samples: The number of times the score function is called.
+        :param score_fun: A function which accepts y_true and y_pred and returns a real number. The built-in metrics
+               (see bootstrap_scores) are computed in batches.
+        :param n_samples: The number of times the score function is called. With tol set, the maximum number.
+        :param batch_memory: Bytes of memory to use for a batch of resamples of the built-in metrics. Default: 2 ** 28.
+        :param n_jobs: Number of processes to split the resamples over. Default: 1.
+        :param random_state: None, an int or a numpy.random.SeedSequence. See bootstrap_scores. Default: None.
+        :param tol: If set, stop once both ends of interval change less than this between batches. Default: None.
+        :param batch_size: Number of resamples between checks of tol. Default: 100.
+        :param interval: Percentiles (between 0 and 100) of the scores which have to converge. Default: (2.5, 97.5).
+        :param compression: Size of the summary of the scores with tol set. See QuantileSketch. Default: 1000.
+        :param multiple_models: If true, score every column of y_pred as a separate model. Default: False.
+        :param reference: With multiple_models, the model to compare the others to: a column position, or a column name
+               if y_pred is a DataFrame. Default: 0.
         """
         self.score_fun = score_fun
         self.n_samples = n_samples
+        self.batch_memory = batch_memory
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.tol = tol
+        self.batch_size = batch_size
+        self.interval = interval
+        self.compression = compression
+        self.multiple_models = multiple_models
+        self.reference = reference
 
     def scores(self, y_true, y_pred, sample_weight=None):
+        """
+        Bootstrap the score, and describe it in description_.
+        :param y_true: Array-like of ground truth y-values.
+        :param y_pred: Array-like of predicted y-values - the same length as y_true. With multiple_models, a 2D
+               array-like or DataFrame with the predictions of a model in every column.
+        :param sample_weight: Optional argument. Array-like the same length as y_true. Default None
+        :return: An array of bootstrapped scores, of shape (n_samples, n_models) with multiple_models. With tol set,
+                 only the n_samples_used_ scores run before stopping.
+        """
+        if self.tol is not None:
+            if self.multiple_models:
+                raise ValueError('Early stopping with tol is only supported for a single model.')
+
+            return self._adaptive_scores(y_true, y_pred, sample_weight)
+
+        self.scores_ = bootstrap_scores(y_true, y_pred, self.score_fun, self.n_samples, sample_weight,
+                                        self.batch_memory, self.n_jobs, self.random_state, self.multiple_models)
+        self.n_samples_used_ = len(self.scores_)
+
+        percentiles = np.arange(0.5, 1.0, 0.05)
+
+        if not self.multiple_models:
+            self.description_ = pd.Series(self.scores_).describe(percentiles=percentiles)
+            return self.scores_
+
+        models = y_pred.columns if isinstance(y_pred, pd.DataFrame) else pd.RangeIndex(self.scores_.shape[1])
+        reference = models.get_loc(self.reference) if isinstance(y_pred, pd.DataFrame) else self.reference
+
+        self.differences_ = self.scores_ - self.scores_[:, [reference]]
+        self.description_ = pd.DataFrame(self.scores_, columns=models).describe(percentiles=percentiles)
+        self.difference_description_ = pd.DataFrame(self.differences_, columns=models).describe(
+            percentiles=percentiles)
 
-        self.scores_ = bootstrap_scores(y_true, y_pred, self.score_fun, self.n_samples, sample_weight)
-        self.description_ = pd.Series(self.scores_).describe(percentiles=np.arange(0.5, 1.0, 0.05))
+        return self.scores_
+
+    def _adaptive_scores(self, y_true, y_pred, sample_weight):
+        # Spawning from one seed sequence batch after batch gives the same resamples as one run of the same size.
+        seed = _seed_sequence(self.random_state)
+
+        scores = []
+        self.summary_ = QuantileSketch(self.compression)
+        self.interval_ = None
+        count, mean, squares = 0, 0., 0.
+        n_samples_used = 0
+
+        while n_samples_used < self.n_samples:
+            n_resamples = min(self.batch_size, self.n_samples - n_samples_used)
+            batch = bootstrap_scores(y_true, y_pred, self.score_fun, n_resamples, sample_weight, self.batch_memory,
+                                     self.n_jobs, seed)
+            n_samples_used += n_resamples
+            scores.append(batch)
+
+            # Like describe, ignore NaN scores (e.g. an AUC of a resample without positives).
+            batch = batch[~np.isnan(batch)]
+            self.summary_.update(batch)
+
+            # Merge the batch into the running mean and sum of squared deviations.
+            if len(batch):
+                delta = batch.mean() - mean
+                squares += ((batch - batch.mean()) ** 2).sum() + delta ** 2 * count * len(batch) / (count + len(batch))
+                mean += delta * len(batch) / (count + len(batch))
+                count += len(batch)
+
+            if count == 0:
+                continue
+
+            previous, self.interval_ = self.interval_, self.summary_.quantile(np.asarray(self.interval) / 100.)
+            if previous is not None and np.abs(self.interval_ - previous).max() < self.tol:
+                break
+
+        self.scores_ = np.concatenate(scores)
+        self.n_samples_used_ = n_samples_used
+        self.description_ = self._describe_summary(count, mean, squares)
 
         return self.scores_
+
+    def _describe_summary(self, count, mean, squares):
+        """
+        :return: The same description as pandas.Series.describe, from the streaming summary.
+        """
+        percentiles = np.arange(0.5, 1.0, 0.05)
+        empty = count == 0
+
+        description = pd.Series({'count': float(count),
+                                 'mean': np.nan if empty else mean,
+                                 'std': squares / (count - 1) if count > 1 else np.nan,
+                                 'min': np.nan if empty else self.summary_.min})
+        description['std'] = np.sqrt(description['std'])
+
+        for percentile in percentiles:
+            description['{:g}%'.format(100 * percentile)] = np.nan if empty else self.summary_.quantile(percentile)
+
+        description['max'] = np.nan if empty else self.summary_.max
+
+        return description
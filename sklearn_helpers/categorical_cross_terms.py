@@ -1,13 +1,21 @@
 from sklearn.base import BaseEstimator, TransformerMixin
+from joblib import Parallel, delayed, effective_n_jobs
+from itertools import combinations
 
+import scipy.sparse as sp
 import numpy as np
 import pandas as pd
 
 
 __all__ = ['CategoricalCrossTermTransformer',
+           'HashedCrossTermTransformer',
            'categorical_cross_term_transform']
 
 
+# Marks that a column had no missing values in fit.
+_NOT_MISSING = object()
+
+
 class CategoricalCrossTermTransformer(BaseEstimator, TransformerMixin):
     """
     Class which handles creation of compound categorical variables from simpler ones.
@@ -15,16 +23,24 @@ class CategoricalCrossTermTransformer(BaseEstimator, TransformerMixin):
 
     Note: This class will likely no longer be needed once CategoricalTransformer is added to scikit-learn in
     version 0.20.0. But that's not out yet, so we will keep it here until then.
+
+    With encoding='categorical' the new column is a pandas.Categorical instead of an array of strings. Each input
+    column is factorized and the codes are combined arithmetically, so no string is built per row. The combinations
+    seen in fit are the vocabulary: they keep the same codes in every transform, and combinations which were not seen
+    get code -1 (NaN). fit only stores the vocabulary as integer keys. The feature names of the combinations, the
+    categories_, are built from the keys when they are first needed.
     """
 
     VALID_BEHAVIORS = ['append', 'replace', 'series']
+    VALID_ENCODINGS = ['string', 'categorical']
 
     def __init__(self,
                  columns=None,
                  new_column_name=None,
                  column_name_joiner='_',
                  feature_name_joiner='_',
-                 behavior='append'):
+                 behavior='append',
+                 encoding='string'):
         """
         Take several categorical variables and create a new one by combining them.
         :param columns: Names of the columns which contain the categorical variables.
@@ -39,13 +55,22 @@ class CategoricalCrossTermTransformer(BaseEstimator, TransformerMixin):
                removed. If 'series', the only the new column is returned as a pandas.Series. Note that
                append and replace both involve making a copy of the input data frame, which may not be desired
                if it is very large.
+        :param encoding: One of 'string' or 'categorical'. Default: 'string'.
+               If 'string', the new column holds the joined feature names as strings.
+               If 'categorical', it is a pandas.Categorical with the joined feature names as categories, whose codes
+               are fit on the combinations seen in fit. This is much faster and smaller.
         """
 
         if behavior not in self.VALID_BEHAVIORS:
             raise ValueError('Invalid behavior. Must be one of: {}. Passed: {}'.format(
                 self.VALID_BEHAVIORS, behavior))
 
+        if encoding not in self.VALID_ENCODINGS:
+            raise ValueError('Invalid encoding. Must be one of: {}. Passed: {}'.format(
+                self.VALID_ENCODINGS, encoding))
+
         self.behavior = behavior
+        self.encoding = encoding
         self.columns = columns
         self.column_name_joiner = column_name_joiner
 
@@ -56,10 +81,78 @@ class CategoricalCrossTermTransformer(BaseEstimator, TransformerMixin):
 
         self.feature_name_joiner = feature_name_joiner
 
-    # For compatibility with Pipelines
+    def _columns(self, X):
+        return X.columns if self.columns is None else self.columns
+
     def fit(self, X=None, y=None):
+        """
+        With encoding='categorical', learn the vocabulary of combinations. Otherwise there is nothing to fit, this is
+        for compatibility with Pipelines.
+        :param X: Input data frame.
+        :param y: Not used, but included for compatibility with sklearn.
+        :return: self
+        """
+        if self.encoding != 'categorical':
+            return self
+
+        columns = self._columns(X)
+
+        codes, self.column_categories_, self.missing_values_ = zip(*[_column_categories(X[name]) for name in columns])
+
+        keys, self.key_indexes_ = _combine_codes(codes, self._radices())
+        self.vocabulary_ = pd.Index(np.unique(keys))
+        self._categories = None
+
         return self
 
+    def _category_codes(self):
+        """
+        Build the categories on first use.
+        :return: A tuple (category_codes, categories). category_codes holds the position in categories of every
+                 combination of vocabulary_.
+        """
+        if self._categories is not None:
+            return self._categories
+
+        # Build the feature names once per combination rather than once per row. Different combinations can give the
+        # same name (e.g. 'a_b' + 'c' and 'a' + 'b_c'), and share a category if so.
+        names = []
+        for categories, missing_value, column_codes in zip(self.column_categories_, self.missing_values_,
+                                                           _split_keys(self.vocabulary_.values, self._radices(),
+                                                                       self.key_indexes_)):
+            column_names = np.array([str(value) for value in categories] + [str(missing_value)], dtype=object)
+            names.append(column_names[column_codes])
+
+        category_codes, categories = pd.factorize(
+            np.array([self.feature_name_joiner.join(name) for name in zip(*names)], dtype=object))
+
+        self._categories = category_codes, pd.Index(categories)
+
+        return self._categories
+
+    @property
+    def categories_(self):
+        """
+        The feature names of the combinations seen in fit, as a pandas.Index.
+        """
+        return self._category_codes()[1]
+
+    def _column_codes(self, X):
+        return [_column_codes(X[name], categories, missing_value) for name, categories, missing_value
+                in zip(self._columns(X), self.column_categories_, self.missing_values_)]
+
+    def _radices(self):
+        return [len(categories) + (missing_value is not _NOT_MISSING)
+                for categories, missing_value in zip(self.column_categories_, self.missing_values_)]
+
+    def _categorical_transform(self, X):
+        keys, _ = _combine_codes(self._column_codes(X), self._radices(), self.key_indexes_)
+        positions = self.vocabulary_.get_indexer(keys)
+        combination_codes, categories = self._category_codes()
+        category_codes = np.where(positions < 0, -1, combination_codes[positions])
+
+        return pd.Categorical.from_codes(category_codes, categories=categories)
+
     def transform(self, X, y=None):
         """
         Apply the transform.
@@ -68,7 +161,10 @@ class CategoricalCrossTermTransformer(BaseEstimator, TransformerMixin):
         :return: The transformed data.
         """
 
-        new_column = categorical_cross_term_transform(X, self.columns, self.feature_name_joiner)
+        if self.encoding == 'categorical':
+            new_column = self._categorical_transform(X)
+        else:
+            new_column = categorical_cross_term_transform(X, self.columns, self.feature_name_joiner)
 
         if self.behavior == 'series':
             result = pd.Series(data=new_column, index=X.index, name=self.new_column_name)
@@ -83,6 +179,194 @@ class CategoricalCrossTermTransformer(BaseEstimator, TransformerMixin):
         return result
 
 
+class HashedCrossTermTransformer(BaseEstimator, TransformerMixin):
+    """
+    Create many categorical cross terms at once and feature hash them into a sparse matrix.
+    E.g. with columns 'age', 'gender' and 'state' and degree 2, this creates the crosses 'age_gender', 'age_state'
+    and 'gender_state', all in one fixed width scipy.sparse.csr_matrix.
+
+    Every row has a one in the column hash(cross, values) % n_features of every cross (summed if two crosses of a row
+    collide). Each input column is hashed once, and the crosses combine those hashes arithmetically, so memory is
+    bounded by the number of rows and crosses regardless of the cardinality of the columns. Nothing is fit.
+    """
+
+    def __init__(self, columns=None, degree=2, crosses=None, n_features=2 ** 20, n_jobs=1):
+        """
+        :param columns: Names of the columns to cross. If None then all columns are used. Default: None.
+        :param degree: Number of columns in each cross. All combinations of this many columns are created.
+               Default: 2.
+        :param crosses: Explicit list of crosses, each a tuple of column names, e.g. to mix pairwise and three-way
+               crosses. If given, columns and degree are ignored. Default: None.
+        :param n_features: Number of columns of the output. Default: 2 ** 20.
+        :param n_jobs: Number of threads used to compute the crosses, each working on a group of them. Default: 1.
+        """
+        self.columns = columns
+        self.degree = degree
+        self.crosses = crosses
+        self.n_features = n_features
+        self.n_jobs = n_jobs
+
+    def _crosses(self, X):
+        if self.crosses is not None:
+            return [tuple(cross) for cross in self.crosses]
+
+        columns = X.columns if self.columns is None else self.columns
+
+        return list(combinations(columns, self.degree))
+
+    # For compatibility with Pipelines
+    def fit(self, X=None, y=None):
+        return self
+
+    def transform(self, X, y=None):
+        """
+        Apply the transform.
+        :param X: Input data frame.
+        :param y: Not used, but included for compatibility with sklearn.
+        :return: scipy.sparse.csr_matrix of shape (len(X), n_features).
+        """
+        crosses = self._crosses(X)
+        column_hashes = {name: pd.util.hash_array(np.asarray(X[name]))
+                         for name in sorted(set(name for cross in crosses for name in cross), key=str)}
+
+        indices = np.empty((len(X), len(crosses)), dtype=np.int64 if self.n_features > 2 ** 31 else np.int32)
+
+        chunks = [chunk for chunk in np.array_split(np.arange(len(crosses)), effective_n_jobs(self.n_jobs))
+                  if len(chunk)]
+        parallel = Parallel(n_jobs=self.n_jobs, prefer='threads')
+        parallel(delayed(_hash_crosses)(column_hashes, crosses, chunk, self.n_features, indices) for chunk in chunks)
+
+        # Sorting the rows with numpy is much faster than letting scipy do it.
+        row_chunks = np.array_split(np.arange(len(X)), effective_n_jobs(self.n_jobs))
+        parallel(delayed(indices[rows[0]:rows[-1] + 1].sort)(axis=1) for rows in row_chunks if len(rows))
+
+        result = sp.csr_matrix((np.ones(indices.size), indices.ravel(), np.arange(0, indices.size + 1, len(crosses))),
+                               shape=(len(X), self.n_features))
+        result.has_sorted_indices = True
+        result.sum_duplicates()
+
+        return result
+
+
+def _mix(h):
+    """
+    The splitmix64 finalizer, which scrambles the bits of a numpy array of uint64 hashes.
+    """
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+
+    return h ^ (h >> np.uint64(31))
+
+
+def _hash_crosses(column_hashes, crosses, chunk, n_features, out):
+    """
+    Hash the crosses crosses[chunk] into the columns chunk of out.
+    :param column_hashes: Dictionary with the uint64 hash of every value of every column.
+    :param crosses: List of tuples of column names.
+    :param chunk: Positions of the crosses to compute.
+    :param n_features: Number of hash buckets.
+    :param out: Numpy array of shape (n_rows, len(crosses)) to write the buckets to.
+    """
+    for i in chunk:
+        # Seed with the names of the columns, so different crosses of the same values land in different buckets. The
+        # repr of the tuple keeps the names apart, where joining them would seed ('a_b', 'c') like ('a', 'b_c').
+        cross = crosses[i]
+        h = pd.util.hash_array(np.array([repr(tuple(cross))], dtype=object))
+
+        for name in cross:
+            h = _mix(h ^ column_hashes[name])
+
+        out[:, i] = h % np.uint64(n_features)
+
+
+def _column_categories(column):
+    """
+    :param column: A pandas.Series.
+    :return: A tuple (codes, categories, missing_value), see _column_codes. categories is a pandas.Index of the
+             distinct values of the column which are not missing. missing_value is the first missing value (e.g. None
+             or NaN) of the column, all of which are treated as one more category, or _NOT_MISSING if there are none.
+    """
+    codes, uniques = pd.factorize(column)
+
+    missing = codes < 0
+    if missing.any():
+        codes[missing] = len(uniques)
+        return codes, pd.Index(uniques), np.asarray(column)[missing][0]
+
+    return codes, pd.Index(uniques), _NOT_MISSING
+
+
+def _column_codes(column, categories, missing_value):
+    """
+    :return: Numpy array of the positions of the values of column in categories, len(categories) for missing values
+             if there were any in fit, and -1 for values which are not in the vocabulary.
+    """
+    codes = categories.get_indexer(column)
+
+    if missing_value is not _NOT_MISSING:
+        codes[pd.isnull(np.asarray(column))] = len(categories)
+
+    return codes
+
+
+def _combine_codes(codes, radices, key_indexes=None):
+    """
+    Combine the codes of several columns into one integer key per row, as the digits of a mixed radix number.
+    Whenever the keys could overflow int64 they are re-factorized into the range of the distinct keys so far.
+    :param codes: List of numpy arrays of codes, one per column. -1 marks values which are not in the vocabulary.
+    :param radices: Number of possible codes of every column.
+    :param key_indexes: The key indexes returned when fitting, to reproduce the same keys. If None, fit them.
+    :return: A tuple (keys, key_indexes). keys is a numpy array with -1 for rows which contain a value or a
+             combination which is not in the vocabulary. key_indexes holds, for every column, the pandas.Index the
+             keys were re-factorized with before adding that column, or None.
+    """
+    fitting = key_indexes is None
+    if fitting:
+        key_indexes = [None] * len(codes)
+
+    keys = np.zeros(len(codes[0]), dtype=np.int64)
+    unseen = np.zeros(len(codes[0]), dtype=bool)
+    n_keys = 1
+
+    for i, (column_codes, radix) in enumerate(zip(codes, radices)):
+        if (fitting and n_keys * radix > np.iinfo(np.int64).max) or key_indexes[i] is not None:
+            if fitting:
+                key_indexes[i] = pd.Index(np.unique(keys))
+
+            keys = key_indexes[i].get_indexer(keys)
+            unseen |= keys < 0
+            n_keys = len(key_indexes[i])
+
+        unseen |= column_codes < 0
+        keys = keys * radix + np.maximum(column_codes, 0)
+        n_keys *= radix
+
+    keys[unseen] = -1
+
+    return keys, key_indexes
+
+
+def _split_keys(keys, radices, key_indexes):
+    """
+    The inverse of _combine_codes: split keys back into the codes of every column.
+    :param keys: Numpy array of keys, none of them -1.
+    :param radices: Number of possible codes of every column.
+    :param key_indexes: The key indexes returned by _combine_codes.
+    :return: List of numpy arrays of codes, one per column.
+    """
+    codes = [None] * len(radices)
+
+    for i in reversed(range(len(radices))):
+        codes[i] = keys % radices[i]
+        keys = keys // radices[i]
+
+        # The keys before column i were replaced by their positions in key_indexes[i].
+        if key_indexes[i] is not None:
+            keys = key_indexes[i].values[keys]
+
+    return codes
+
+
 def categorical_cross_term_transform(X, columns=None, feature_name_joiner='_'):
     """
     Create categorical cross term array.
@@ -96,6 +380,6 @@ def categorical_cross_term_transform(X, columns=None, feature_name_joiner='_'):
     if columns is None:
         columns = X.columns
 
-    zip_obj = zip(*[X[name].astype(str) for name in columns])
+    zip_obj = zip(*[X[name].map(str) for name in columns])
 
     return np.array([feature_name_joiner.join(ll) for ll in zip_obj])
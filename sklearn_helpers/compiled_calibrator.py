@@ -0,0 +1,82 @@
+import numpy as np
+
+
+__all__ = ['CompiledQuantileCalibrator']
+
+
+def compiled_lookup(bin_edges, bin_values, X):
+    """
+    Look up values in a compiled calibration table.
+
+    Bins are closed on the right, matching pandas.qcut. Values below the first edge map to the first bin and values
+    above the last edge map to the last bin. NaN maps to NaN.
+
+    :param bin_edges: Sorted array of the interior (right) bin edges. One shorter than bin_values.
+    :param bin_values: Array of calibrated values, one per bin.
+    :param X: Array like of values to look up.
+    :return: Numpy array of calibrated values.
+    """
+    X = np.asarray(X, dtype=float)
+    result = bin_values[np.searchsorted(bin_edges, X, side='left')]
+
+    nans = np.isnan(X)
+    if nans.any():
+        result = np.where(nans, np.nan, result)
+
+    return result
+
+
+class CompiledQuantileCalibrator:
+    """
+    The array form of a fit QuantileCalibrator.
+
+    This class only depends on numpy, so it can be used to score on machines that do not have pandas, scipy or
+    sklearn installed. Create one with QuantileCalibrator.export_compiled(), then save() it and load() it wherever
+    the scoring happens.
+    """
+
+    def __init__(self, bin_edges, bin_values):
+        """
+        :param bin_edges: Sorted array of the interior (right) bin edges. One shorter than bin_values.
+        :param bin_values: Array of calibrated values, one per bin.
+        """
+        self.bin_edges = np.asarray(bin_edges, dtype=float)
+        self.bin_values = np.asarray(bin_values, dtype=float)
+
+        if len(self.bin_edges) + 1 != len(self.bin_values):
+            raise ValueError('There should be exactly one more bin value than bin edges. Passed {} edges and {} '
+                             'values.'.format(len(self.bin_edges), len(self.bin_values)))
+
+    def transform(self, X, y=None):
+        """
+        Transform a vector via the compiled lookup table.
+        :param X: Vector to transform
+        :param y: Ignored.
+        :return: Numpy array of calibrated values.
+        """
+        return compiled_lookup(self.bin_edges, self.bin_values, X)
+
+    def predict(self, X):
+        """
+        Wrapper around transform.
+        :param X: Vector to transform
+        :return: Numpy array of calibrated values.
+        """
+        return self.transform(X)
+
+    def save(self, path):
+        """
+        Save the compiled calibrator as an .npz file.
+        :param path: File name or file object.
+        """
+        np.savez(path, bin_edges=self.bin_edges, bin_values=self.bin_values)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a compiled calibrator written by save().
+        :param path: File name or file object.
+        :return: A CompiledQuantileCalibrator.
+        """
+        with np.load(path) as data:
+            return cls(data['bin_edges'], data['bin_values'])
@@ -0,0 +1,222 @@
+from sklearn.base import BaseEstimator, TransformerMixin, RegressorMixin
+from joblib import Parallel, delayed, effective_n_jobs
+import pandas as pd
+import numpy as np
+
+from .quantile_calibrator import QuantileCalibrator
+
+
+__all__ = ['GroupedQuantileCalibrator']
+
+
+def _group_index(groups):
+    """
+    Turn group keys into an index. Several key columns (e.g. a DataFrame) become a MultiIndex.
+    """
+    if isinstance(groups, pd.DataFrame):
+        return pd.MultiIndex.from_frame(groups)
+
+    if np.ndim(groups) == 2:
+        return pd.MultiIndex.from_frame(pd.DataFrame(groups))
+
+    return pd.Index(groups)
+
+
+def _grouped_searchsorted(edges, edge_offsets, codes, X):
+    """
+    For every row count the edges of its group which are less than X, i.e. np.searchsorted(side='left') within the
+    group. This is a binary search on all rows at once.
+    :param edges: Sorted edges of all groups, stacked.
+    :param edge_offsets: The edges of group g are edges[edge_offsets[g]:edge_offsets[g + 1]].
+    :param codes: Group of every row.
+    :param X: Value of every row.
+    :return: Numpy array of positions within the groups.
+    """
+    lo = edge_offsets[codes]
+    hi = edge_offsets[codes + 1]
+    start = lo.copy()
+
+    if len(edges) == 0:
+        return lo - start
+
+    while True:
+        searching = lo < hi
+        if not searching.any():
+            break
+
+        mid = (lo + hi) // 2
+        go_right = searching & (edges[np.minimum(mid, len(edges) - 1)] < X)
+        go_left = searching & ~go_right
+
+        lo = np.where(go_right, mid + 1, lo)
+        hi = np.where(go_left, mid, hi)
+
+    return lo - start
+
+
+def _isotonic_fit_tables(calibrator, tables):
+    return [calibrator._isotonic_fit(table) for table in tables]
+
+
+class GroupedQuantileCalibrator(BaseEstimator, TransformerMixin, RegressorMixin):
+    """
+    Fit a separate QuantileCalibrator for each group (e.g. each market segment), all at once.
+
+    Quantile bins and bin means of all groups are computed in one sort of the data, and all lookup tables are stored
+    stacked in flat arrays with offsets, so transform looks up every row without looping over groups. Only the
+    isotonic/smoothing step is done per group, optionally in parallel.
+
+    Unlike QuantileCalibrator the bin edges are the exact quantiles rather than pandas' rounded interval labels.
+    Duplicate edges are dropped, so groups with few distinct values get fewer bins.
+    """
+
+    def __init__(self,
+                 quantiles=10,
+                 isotonic_fit=True,
+                 do_smoothing=True,
+                 isotonic_lambda=1,
+                 solver='active_set',
+                 n_jobs=1):
+        """
+        Create a grouped quantile calibrator.
+        :param quantiles: An integer. The number of bins (quantiles) per group.
+        :param isotonic_fit: If true, regularize with an isotonic fit.
+        :param do_smoothing: If true, do lambda smoothing, default True
+        :param isotonic_lambda: Lambda parameter for 3rd derivative regularization.
+        :param solver: How to solve the smoothed isotonic fit. See QuantileCalibrator.
+        :param n_jobs: Number of processes used for the isotonic/smoothing step. Default: 1.
+        """
+
+        self.quantiles = quantiles
+        self.isotonic_fit = isotonic_fit
+        self.do_smoothing = do_smoothing
+        self.isotonic_lambda = isotonic_lambda
+        self.solver = solver
+        self.n_jobs = n_jobs
+
+    def _group_codes(self, groups):
+        codes = self.groups_.get_indexer(_group_index(groups))
+
+        if (codes < 0).any():
+            raise ValueError('Groups which were not seen in fit: {}'.format(
+                list(pd.unique(_group_index(groups)[codes < 0]))))
+
+        return codes
+
+    def _isotonic_fit_values(self, values, value_offsets):
+        tables = np.split(values, value_offsets[1:-1])
+
+        calibrator = QuantileCalibrator(do_smoothing=self.do_smoothing,
+                                        isotonic_lambda=self.isotonic_lambda,
+                                        solver=self.solver)
+
+        if self.n_jobs == 1:
+            fit_tables = _isotonic_fit_tables(calibrator, tables)
+        else:
+            chunks = np.array_split(np.arange(len(tables)), effective_n_jobs(self.n_jobs))
+            results = Parallel(n_jobs=self.n_jobs)(
+                delayed(_isotonic_fit_tables)(calibrator, [tables[i] for i in chunk]) for chunk in chunks)
+            fit_tables = [table for result in results for table in result]
+
+        return np.concatenate(fit_tables)
+
+    def fit(self, X, y, groups):
+        """
+        Fit one quantile calibration per group.
+        :param X: Array like which contains the predicted values. Rows where it is NaN are ignored.
+        :param y: Array like which contains the ground truth values.
+        :param groups: Array like with the group key of every row. Pass a DataFrame or 2D array to use the
+               combination of several key columns. Rows with a missing key are ignored.
+        :return: self
+        """
+
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
+
+        # Like QuantileCalibrator, ignore rows without a prediction. A NaN would sort last and become the top edge.
+        # Also ignore rows with a missing key, in any of the key columns.
+        keep = ~np.isnan(X) & ~pd.DataFrame(groups).isna().any(axis=1).values
+        X, y = X[keep], y[keep]
+        codes, self.groups_ = _group_index(groups)[keep].factorize()
+
+        n_groups = len(self.groups_)
+
+        order = np.lexsort((X, codes))
+        X_sorted = X[order]
+
+        counts = np.bincount(codes, minlength=n_groups)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+        # Quantiles of every group, interpolated linearly like pd.qcut does. One row per group.
+        positions = (counts[:, None] - 1) * np.linspace(0, 1, self.quantiles + 1)[None, :]
+        lower = np.floor(positions).astype(np.int64)
+        upper = np.minimum(lower + 1, counts[:, None] - 1)
+        lower_values = X_sorted[starts[:, None] + lower]
+        edges = lower_values + (X_sorted[starts[:, None] + upper] - lower_values) * (positions - lower)
+
+        # The interior edges are the distinct ones strictly between the minimum and the maximum of the group.
+        interior = np.zeros(edges.shape, dtype=bool)
+        interior[:, 1:] = (np.diff(edges, axis=1) > 0) & (edges[:, 1:] < edges[:, -1:])
+
+        bin_edges = edges[interior]
+        edge_offsets = np.concatenate([[0], np.cumsum(interior.sum(axis=1))])
+
+        bins = _grouped_searchsorted(bin_edges, edge_offsets, codes, X) + edge_offsets[codes] + codes
+        n_bins = len(bin_edges) + n_groups
+        bin_counts = np.bincount(bins, minlength=n_bins)
+
+        # A bin between two interpolated quantiles can be empty. The last bin of a group never is, as it holds the
+        # maximum, so merge empty bins into the next one by dropping their right edge.
+        if (bin_counts == 0).any():
+            keep_edge = np.delete(bin_counts > 0, edge_offsets[1:] + np.arange(n_groups))
+            edge_groups = np.repeat(np.arange(n_groups), np.diff(edge_offsets))
+            bin_edges = bin_edges[keep_edge]
+            edge_offsets = np.concatenate([[0], np.cumsum(np.bincount(edge_groups[keep_edge], minlength=n_groups))])
+            bins = _grouped_searchsorted(bin_edges, edge_offsets, codes, X) + edge_offsets[codes] + codes
+            n_bins = len(bin_edges) + n_groups
+            bin_counts = np.bincount(bins, minlength=n_bins)
+
+        self.bin_edges_ = bin_edges
+        self.edge_offsets_ = edge_offsets
+        self.value_offsets_ = edge_offsets + np.arange(n_groups + 1)
+        self.bin_values_ = np.bincount(bins, weights=y, minlength=n_bins) / bin_counts
+
+        if self.isotonic_fit:
+            self.bin_values_ = self._isotonic_fit_values(self.bin_values_, self.value_offsets_)
+
+        return self
+
+    def fit_transform(self, X, y, groups):
+        """
+        Fit, then transform X.
+        :param X: Array like which contains the predicted values.
+        :param y: Array like which contains the ground truth values.
+        :param groups: Array like with the group key of every row.
+        :return: Numpy array of calibrated values.
+        """
+        return self.fit(X, y, groups).transform(X, groups)
+
+    def transform(self, X, groups):
+        """
+        Transform a vector via the lookup table of each row's group.
+        :param X: Vector to transform
+        :param groups: Array like with the group key of every row, like in fit.
+        :return: Numpy array of calibrated values.
+        """
+
+        X = np.asarray(X, dtype=float)
+        codes = self._group_codes(groups)
+
+        bins = _grouped_searchsorted(self.bin_edges_, self.edge_offsets_, codes, X)
+        result = self.bin_values_[self.value_offsets_[codes] + bins]
+
+        return np.where(np.isnan(X), np.nan, result)
+
+    def predict(self, X, groups):
+        """
+        Wrapper around transform.
+        :param X: Vector to transform
+        :param groups: Array like with the group key of every row, like in fit.
+        :return: Numpy array of calibrated values.
+        """
+        return self.transform(X, groups)
@@ -1,11 +1,188 @@
 from sklearn.base import BaseEstimator, TransformerMixin, RegressorMixin
+from sklearn.exceptions import ConvergenceWarning
 from sklearn.isotonic import isotonic_regression
 import pandas as pd
 import numpy as np
+from scipy.linalg import solveh_banded
 from scipy.optimize import minimize
+import warnings
 
+from .compiled_calibrator import CompiledQuantileCalibrator, compiled_lookup
+from .quantile_sketch import QuantileSketch
 
-__all__ = ['QuantileCalibrator']
+
+__all__ = ['QuantileCalibrator', 'smoothed_isotonic_regression']
+
+
+_D3_BANDWIDTH = 3
+
+
+def _d3_penalty_bands(n, lamb):
+    """
+    The upper diagonals of H = I + lamb * D3^T D3, where D3 is the (n - 3) x n third difference matrix.
+    :return: Array of shape (4, n). Row k holds H[i, i + k] in its first n - k entries.
+    """
+    coefficients = np.array([-1., 3., -3., 1.])
+    bands = np.zeros((_D3_BANDWIDTH + 1, n))
+
+    # Row r of D3 has coefficients[t] in column r + t, so it adds coefficients[t] * coefficients[t + k] to
+    # (D3^T D3)[r + t, r + t + k].
+    for k in range(_D3_BANDWIDTH + 1):
+        for t in range(_D3_BANDWIDTH + 1 - k):
+            bands[k, t:n - _D3_BANDWIDTH + t] += lamb * coefficients[t] * coefficients[t + k]
+
+    bands[0] += 1
+
+    return bands
+
+
+def _banded_matvec(bands, f):
+    result = bands[0] * f
+    for k in range(1, _D3_BANDWIDTH + 1):
+        result[:-k] += bands[k, :-k] * f[k:]
+        result[k:] += bands[k, :-k] * f[:-k]
+
+    return result
+
+
+def _block_bands(bands, blocks, n_blocks):
+    """
+    The upper diagonals of P^T H P, where P maps each entry to its block. Blocks are runs of consecutive entries,
+    so P^T H P has the same bandwidth as H.
+    :return: Array of shape (4, n_blocks). Row d holds (P^T H P)[a, a + d] at position a.
+    """
+    n = len(blocks)
+    block_bands = np.bincount(blocks, weights=bands[0], minlength=n_blocks)
+    block_bands = np.concatenate([block_bands, np.zeros(_D3_BANDWIDTH * n_blocks)])
+
+    for k in range(1, _D3_BANDWIDTH + 1):
+        a = blocks[:n - k]
+        d = blocks[k:] - a
+        # H[i, j] and H[j, i] both land on the diagonal when i and j are in the same block.
+        weights = np.where(d == 0, 2, 1) * bands[k, :n - k]
+        block_bands += np.bincount(d * n_blocks + a, weights=weights, minlength=(_D3_BANDWIDTH + 1) * n_blocks)
+
+    return block_bands.reshape(_D3_BANDWIDTH + 1, n_blocks)
+
+
+def _solve_blocks(bands, y, active):
+    """
+    Solve min ||y - f||^2 + lamb * ||D3 f||^2 subject to f[i] == f[i + 1] wherever active[i].
+    :param bands: The upper diagonals of H = I + lamb * D3^T D3, from _d3_penalty_bands.
+    :return: Numpy array, the fit values.
+    """
+    blocks = np.concatenate([[0], np.cumsum(~active)])
+    n_blocks = blocks[-1] + 1
+
+    block_bands = _block_bands(bands, blocks, n_blocks)
+
+    # solveh_banded wants the upper diagonals right aligned, i.e. (P^T H P)[a, a + d] at ab[3 - d, a + d].
+    ab = np.zeros((_D3_BANDWIDTH + 1, n_blocks))
+    for d in range(min(_D3_BANDWIDTH + 1, n_blocks)):
+        ab[_D3_BANDWIDTH - d, d:] = block_bands[d, :n_blocks - d]
+
+    return solveh_banded(ab, np.bincount(blocks, weights=y, minlength=n_blocks))[blocks]
+
+
+def _multipliers(bands, y, f):
+    # The gradient is D1^T mu for the multipliers mu of the constraints, so mu is minus its running sum.
+    return -np.cumsum(_banded_matvec(bands, f) - y)[:-1]
+
+
+def _primal_active_set(bands, y, f, max_iter):
+    """
+    The primal active set method: starting from a non-decreasing f, only ever move to non-decreasing points which
+    lower the objective, changing one constraint per iteration. That can't cycle (up to degenerate ties), but takes
+    about one iteration per constraint which changes.
+    :param f: A non-decreasing starting point.
+    :return: A tuple (f, converged).
+    """
+    active = np.diff(f) == 0
+
+    for _ in range(max_iter):
+        step = _solve_blocks(bands, y, active) - f
+
+        # Go as far towards the solution for this active set as the inactive constraints allow, and hold the first
+        # one which blocks.
+        differences, step_differences = np.diff(f), np.diff(step)
+        blocking = ~active & (step_differences < 0)
+        ratios = np.full(len(differences), np.inf)
+        ratios[blocking] = np.maximum(differences[blocking], 0) / -step_differences[blocking]
+
+        if ratios.min() < 1:
+            f = f + ratios.min() * step
+            active[np.argmin(ratios)] = True
+            continue
+
+        f = f + step
+
+        # At the solution for this active set. Release the held constraint which pulls hardest the wrong way.
+        mu = np.where(active, _multipliers(bands, y, f), np.inf)
+        if mu.min() >= 0:
+            return f, True
+
+        active[np.argmin(mu)] = False
+
+    return f, False
+
+
+def smoothed_isotonic_regression(y, lamb=1, max_iter=100):
+    """
+    Solve min ||y - f||^2 + lamb * ||D3 f||^2 subject to f being non-decreasing, where D3 is the third difference.
+
+    This is a primal-dual active set method. The active set is a set of equality constraints f[i] == f[i + 1],
+    which merges neighbouring entries of f into blocks. With the blocks fixed the problem is an unconstrained
+    least squares problem in one value per block, and since D3 only couples entries at most 3 apart its normal
+    equations are banded. Each iteration solves that banded system in O(n), then updates the active set from the
+    sign of the constraint multipliers and of the differences of f. It starts from the isotonic regression of y,
+    which is the exact answer for lamb == 0, and usually stops after a handful of iterations. When it stops the
+    solution is exact (up to floating point) and exactly monotone.
+
+    For large lamb the primal-dual updates can cycle between active sets. Then it switches to the slower primal
+    active set method, which changes one constraint at a time and can't cycle.
+
+    :param y: Array like of values to fit.
+    :param lamb: Lambda parameter for 3rd derivative regularization.
+    :param max_iter: Maximum number of primal-dual active set updates. The primal active set method gets up to
+           max(max_iter, 10 * len(y)) updates.
+    :return: Numpy array, the fit values.
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+
+    f = isotonic_regression(y)
+
+    if n <= _D3_BANDWIDTH or lamb == 0:
+        return f
+
+    bands = _d3_penalty_bands(n, lamb)
+
+    # active[i] means the constraint f[i] <= f[i + 1] is held with equality.
+    active = np.diff(f) == 0
+    seen = set()
+
+    for _ in range(max_iter):
+        seen.add(active.tobytes())
+        f = _solve_blocks(bands, y, active)
+
+        mu = _multipliers(bands, y, f)
+        new_active = np.where(active, mu > 0, np.diff(f) < 0)
+
+        if np.array_equal(new_active, active):
+            return f
+
+        # Coming back to an active set means the updates cycle.
+        if new_active.tobytes() in seen:
+            break
+
+        active = new_active
+
+    f, converged = _primal_active_set(bands, y, isotonic_regression(y), max(max_iter, 10 * n))
+    if not converged:
+        warnings.warn('smoothed_isotonic_regression did not converge.', ConvergenceWarning)
+
+    # Clean up rounding, so the result is exactly non-decreasing.
+    return np.maximum.accumulate(f)
 
 
 class QuantileCalibrator(BaseEstimator, TransformerMixin, RegressorMixin):
@@ -13,7 +190,19 @@ class QuantileCalibrator(BaseEstimator, TransformerMixin, RegressorMixin):
     An estimator which will calibrate with respect to quantiles.
     """
 
-    def __init__(self, quantiles=10, isotonic_fit=True, do_smoothing=True, isotonic_lambda=1, method='quantile'):
+    VALID_SOLVERS = ['active_set', 'cobyla']
+
+    # Built from the sketch when first used after partial_fit or merge, see __getattr__.
+    _LOOKUP_ATTRIBUTES = ('lookup_table_', 'bin_edges_', 'bin_values_')
+
+    def __init__(self,
+                 quantiles=10,
+                 isotonic_fit=True,
+                 do_smoothing=True,
+                 isotonic_lambda=1,
+                 method='quantile',
+                 solver='active_set',
+                 compression=1000):
         """
         Create a quantile transformer class.
         :param quantile: And integer. The number of bins (quantiles).
@@ -21,6 +210,11 @@ class QuantileCalibrator(BaseEstimator, TransformerMixin, RegressorMixin):
         :param do_smoothing: If true, do lambda smoothing, default True
         :param isotonic_lambda: Lambda parameter for 3rd derivative regularization.
         :param method: Set to "equal" to split into equal sized bins instead of quantiles.
+        :param solver: How to solve the smoothed isotonic fit. One of 'active_set' or 'cobyla'. Default: 'active_set'.
+               'active_set' uses smoothed_isotonic_regression, which is exact and scales to thousands of bins.
+               'cobyla' uses scipy.optimize.minimize, which is only practical for a few dozen bins.
+        :param compression: Size of the quantile sketch used by partial_fit. See QuantileSketch for the error bound.
+               Default: 1000.
         """
 
         self.quantiles = quantiles
@@ -28,18 +222,8 @@ class QuantileCalibrator(BaseEstimator, TransformerMixin, RegressorMixin):
         self.do_smoothing = do_smoothing
         self.isotonic_lambda = isotonic_lambda
         self.method=method
-
-    # TODO: Can this be one line? If I can figure out how to add in extra rows it could be...
-    #       In particular, if I could add rows with indices [-np.inf, lookup_table_.index[0].left)
-    #       and [lookup_table_.index[-1].right, np.inf) I could to the lookup table I could remove
-    #       these bounds checks.
-    def _lookup(self, val):
-        if val >= self.lookup_table_.index[-1].right:
-            return self.lookup_table_.iloc[-1]
-        elif val <= self.lookup_table_.index[0].left:
-            return self.lookup_table_.iloc[0]
-        else:
-            return self.lookup_table_[val]
+        self.solver = solver
+        self.compression = compression
 
     @staticmethod
     def _ls_min_func(y_fit, y, lamb):
@@ -50,18 +234,25 @@ class QuantileCalibrator(BaseEstimator, TransformerMixin, RegressorMixin):
     def _isotonic_fit(self, X):
         cons = ({'type': 'ineq', 'fun': lambda x: np.diff(x)})
 
-        # Kyle's idea: use as a first guess the non-regularized isotonic regression.
-        # This implementation is O(n) complexity, so the cost is minimal.
-        x0 = isotonic_regression(X)
+        if not self.do_smoothing:
+            return isotonic_regression(X)
+
+        if self.solver == 'active_set':
+            return smoothed_isotonic_regression(X, self.isotonic_lambda)
+
+        elif self.solver == 'cobyla':
+            # Kyle's idea: use as a first guess the non-regularized isotonic regression.
+            # This implementation is O(n) complexity, so the cost is minimal.
+            x0 = isotonic_regression(X)
 
-        if self.do_smoothing:
             return minimize(self._ls_min_func,
                             x0=x0,
                             args=(X, self.isotonic_lambda),
                             method='COBYLA',
                             constraints=cons).x
+
         else:
-            return x0
+            raise ValueError('Invalid solver. Must be one of: {}. Passed: {}'.format(self.VALID_SOLVERS, self.solver))
 
     def _make_lookup_table(self, X, y):
 
@@ -76,6 +267,62 @@ class QuantileCalibrator(BaseEstimator, TransformerMixin, RegressorMixin):
         else:
             raise ValueError('method should be either "quantile" or "equal". Passed method=' + self.method + '.')
 
+    def _make_lookup_table_from_sketch(self, sketch):
+        means, counts, y_sums = sketch.centroids()
+
+        # Bin the centroids the same way pd.qcut and pd.cut bin the raw values, so the intervals (and their labels)
+        # come out the same as in _make_lookup_table.
+        if self.method == 'quantile':
+            bins = pd.cut(means, sketch.quantile(np.linspace(0, 1, self.quantiles + 1)), include_lowest=True)
+
+        elif self.method == 'equal':
+            edges = np.linspace(sketch.min, sketch.max, self.quantiles + 1)
+            edges[0] -= (sketch.max - sketch.min) * 0.001
+            bins = pd.cut(means, edges)
+
+        else:
+            raise ValueError('method should be either "quantile" or "equal". Passed method=' + self.method + '.')
+
+        lookup_table = (pd.Series(y_sums).groupby(bins, observed=False).sum() /
+                        pd.Series(counts).groupby(bins, observed=False).sum())
+
+        if self.method == 'equal':
+            # Unlike the raw data, the centroids need not reach into the first and last bins.
+            lookup_table = lookup_table.interpolate(limit_direction='both')
+
+        return lookup_table
+
+    def _fit_lookup_table(self, lookup_table):
+        self.lookup_table_ = lookup_table
+
+        if self.isotonic_fit:
+            self.lookup_table_[:] = self._isotonic_fit(self.lookup_table_.values)
+
+        self._compile_lookup_table()
+
+        return self
+
+    def _drop_lookup_table(self):
+        for name in self._LOOKUP_ATTRIBUTES:
+            self.__dict__.pop(name, None)
+
+    def __getattr__(self, name):
+        # Only called for attributes which are missing, i.e. the lookup table after the sketch changed. Building it
+        # here rather than in partial_fit keeps a stream of chunks at the cost of the sketch per chunk.
+        if name in self._LOOKUP_ATTRIBUTES and 'sketch_' in self.__dict__:
+            self._fit_lookup_table(self._make_lookup_table_from_sketch(self.__dict__['sketch_']))
+            return self.__dict__[name]
+
+        raise AttributeError('{!r} object has no attribute {!r}'.format(type(self).__name__, name))
+
+    def _compile_lookup_table(self):
+        # Intervals are right closed and contiguous, so the right edges of all but the last bin are enough to
+        # find a value's bin with searchsorted. Anything outside the table ends up in the first or last bin.
+        intervals = pd.IntervalIndex(self.lookup_table_.index)
+
+        self.bin_edges_ = np.asarray(intervals.right[:-1], dtype=float)
+        self.bin_values_ = np.asarray(self.lookup_table_.values, dtype=float)
+
     def fit(self, X, y):
         """
         Fit the quantile calibration transformer.
@@ -84,10 +331,64 @@ class QuantileCalibrator(BaseEstimator, TransformerMixin, RegressorMixin):
         :return: self
         """
 
-        self.lookup_table_ = self._make_lookup_table(X, y)
+        # Fitting from scratch starts a new partial_fit stream as well.
+        if hasattr(self, 'sketch_'):
+            del self.sketch_
 
-        if self.isotonic_fit:
-            self.lookup_table_[:] = self._isotonic_fit(self.lookup_table_.values)
+        return self._fit_lookup_table(self._make_lookup_table(X, y))
+
+    def partial_fit(self, X, y):
+        """
+        Fit the quantile calibration transformer on one chunk of the data at a time.
+
+        Only a QuantileSketch of X (with the sums of y) is kept between calls, so memory is bounded by compression
+        rather than by the size of the data. The lookup table is built from the sketch when it is first used after
+        a call (by transform, export_compiled or reading lookup_table_), so a call only costs the sketch update. Its
+        bin edges are within about 1 / compression (in rank) of the ones fit would find on all of the data, and at most
+        that share of the rows is counted in a neighbouring bin at each edge. Up to compression rows the result is
+        the same as fit. Note that the bound is in rows, so bins holding very few rows (e.g. the tails with
+        method='equal') can be a lot less accurate. Like fit, rows where y is NaN are ignored.
+
+        :param X: Array like which contains the predicted values.
+        :param y: Array like which contains the ground truth values.
+        :return: self
+        """
+
+        if not hasattr(self, 'sketch_'):
+            self.sketch_ = QuantileSketch(self.compression)
+
+        X = np.asarray(X, dtype=float).ravel()
+        y = np.asarray(y, dtype=float).ravel()
+
+        if len(X) != len(y):
+            raise ValueError('X and y should have the same length. Passed {} and {}.'.format(len(X), len(y)))
+
+        keep = ~np.isnan(y)
+        self.sketch_.update(X[keep], y[keep])
+        self._drop_lookup_table()
+
+        return self
+
+    def merge(self, other):
+        """
+        Merge in a calibrator which was fit with partial_fit on other data, e.g. in another process.
+        The result is as if all data had been passed to partial_fit of this calibrator.
+        This calibrator has to be either unfit or fit with partial_fit as well, since fit keeps no sketch of its data.
+        :param other: A QuantileCalibrator fit with partial_fit.
+        :return: self
+        """
+
+        if 'sketch_' not in other.__dict__:
+            raise ValueError('Only calibrators fit with partial_fit can be merged.')
+
+        if 'sketch_' not in self.__dict__:
+            if 'lookup_table_' in self.__dict__:
+                raise ValueError('Only calibrators fit with partial_fit can be merged into. This one was fit with fit.')
+
+            self.sketch_ = QuantileSketch(self.compression)
+
+        self.sketch_.merge(other.sketch_)
+        self._drop_lookup_table()
 
         return self
 
@@ -96,9 +397,9 @@ class QuantileCalibrator(BaseEstimator, TransformerMixin, RegressorMixin):
         Transform a vector via the lookup table.
         :param X: Vector to transform
         :param y: Ignored. Only included to be compatible w/ sklearn requirements for Transformers
-        :return:
+        :return: Numpy array of calibrated values.
         """
-        return np.array([self._lookup(a) for a in X])
+        return compiled_lookup(self.bin_edges_, self.bin_values_, X)
 
     def predict(self, X):
         """
@@ -107,3 +408,11 @@ class QuantileCalibrator(BaseEstimator, TransformerMixin, RegressorMixin):
         :return:
         """
         return self.transform(X)
+
+    def export_compiled(self):
+        """
+        Export the fit lookup table in its array form. The result can be saved and loaded
+        with only numpy installed, see CompiledQuantileCalibrator.
+        :return: A CompiledQuantileCalibrator.
+        """
+        return CompiledQuantileCalibrator(self.bin_edges_, self.bin_values_)
@@ -2,6 +2,9 @@ import pandas as pd
 import numpy as np
 
 from sklearn.base import BaseEstimator, TransformerMixin
+from joblib import Parallel, delayed, effective_n_jobs
+
+from .quantile_sketch import QuantileSketch
 
 __all__ = [
     'create_quantile_lookup_table',
@@ -11,60 +14,292 @@ __all__ = [
 
 def round_to_n(x, n=8):
     """
-    Round a number to n significant digits.
+    Round a number, or every number in an array, to n significant digits.
 
     e.g.
 
     round_to_n(12345, 2) -> 12000
     round_to_n(-.00897, 1) -> -.009
 
-    :param x: Number to round
+    :param x: Number or array like of numbers to round
     :param n: number of significant digits
-    :return: The rounded number
+    :return: The rounded number(s)
     """
-    n = 1 + n - int(np.floor(np.log10(abs(x) + .1)))
+    x = np.asarray(x, dtype=float)
 
-    return round(x, n)
+    with np.errstate(invalid='ignore'):
+        digits = 1 + n - np.floor(np.log10(np.abs(x) + .1))
 
+    # Same as np.round(x, digits), but digits can differ per element.
+    digits = np.nan_to_num(digits).astype(np.int64)
+    scale = 10. ** np.abs(digits)
+    with np.errstate(invalid='ignore'):
+        rounded = np.where(digits >= 0, np.rint(x * scale) / scale, np.rint(x / scale) * scale)
+    rounded = np.where(np.isinf(x), x, rounded)
 
-def create_quantile_lookup_table(x, n_quantiles=100):
-    x = x.apply(round_to_n)
+    return rounded[()] if rounded.ndim == 0 else rounded
+
+
+def _quantile_bins(x, n_quantiles):
+    """
+    Find the bins of the quantile lookup table.
+    :param x: Sorted numpy array without NaNs.
+    :param n_quantiles: Number of quantiles.
+    :return: A tuple of numpy arrays (edges, codes). The bins are (edges[i], edges[i + 1]], the first edge is -inf
+             and the last one inf. Bin i is labelled with quantile number codes[i] (of n_quantiles), i.e. the
+             quantile of its left edge.
+    """
+    return _bins_from_quantiles(np.quantile(round_to_n(x), np.linspace(0, 1, n_quantiles + 1)))
+
+
+def _bins_from_quantiles(q):
+    """
+    :param q: Numpy array with the n_quantiles + 1 quantiles 0, 1 / n_quantiles, ..., 1 of the data.
+    :return: A tuple of numpy arrays (edges, codes), see _quantile_bins.
+    """
+    # The quantiles are sorted, so duplicates are next to each other.
+    codes = np.flatnonzero(np.concatenate([[True], np.diff(q) != 0]))
+    edges = q[codes]
 
-    q = pd.Series(x).quantile(q=np.linspace(0, 1, n_quantiles + 1))
+    if len(edges) == 1:
+        return np.array([-np.inf, np.inf]), codes
 
-    q = q.drop_duplicates()
+    edges[0] = -np.inf
+    edges[-1] = np.inf
 
-    q[0] = -np.inf
-    q[-1] = np.inf
+    return edges, codes[:-1]
+
+
+def _n_unique_sorted(x):
+    """
+    :param x: Sorted numpy array. NaNs (which np.sort puts at the end) count as one value.
+    :return: The number of unique values of x
+    """
+    if len(x) == 0:
+        return 0
+
+    nans = np.isnan(x[-1])
+    if nans:
+        x = x[~np.isnan(x)]
+
+    return np.count_nonzero(np.diff(x)) + (len(x) > 0) + nans
+
+
+def _fit_column(x, n_quantiles):
+    """
+    :param x: Numpy array, one column of the data.
+    :param n_quantiles: Maximum number of quantiles.
+    :return: A tuple (edges, codes, n_quantiles), see _quantile_bins. n_quantiles is capped at the number of unique
+             values.
+    """
+    # Rounding is monotone, so one sort gives both the number of unique values and sorted data for the quantiles.
+    x = np.sort(x)
+    n_quantiles = min(n_quantiles, _n_unique_sorted(x))
 
-    intervals = [pd.Interval(left=a, right=b, closed='right') for a, b in zip(q.iloc[:-1], q.iloc[1:])]
+    edges, codes = _quantile_bins(x[~np.isnan(x)], n_quantiles)
 
-    return pd.Series(data=q.index[:-1], index=pd.IntervalIndex(intervals))
+    return edges, codes, n_quantiles
+
+
+def create_quantile_lookup_table(x, n_quantiles=100):
+    x = np.sort(np.asarray(x, dtype=float))
+
+    edges, codes = _quantile_bins(x[~np.isnan(x)], n_quantiles)
+
+    return pd.Series(data=np.linspace(0, 1, n_quantiles + 1)[codes],
+                     index=pd.IntervalIndex.from_breaks(edges, closed='right'))
 
 
 class QuantileScaler(BaseEstimator, TransformerMixin):
     """
-    Perform a monotone transformation on a feature to map into buckets of equal size.
+    Perform a monotone transformation on each feature to map into buckets of equal size.
+
+    X can be a single feature (1D) or a matrix of features (2D). The bucket edges of all features are stored in
+    one padded array, bin_edges_, where row j holds the n_bin_edges_[j] interior edges of feature j.
     """
 
-    def __init__(self, n_quantiles=10):
+    VALID_ENCODINGS = ['quantile', 'ordinal']
+
+    def __init__(self, n_quantiles=10, encode='quantile', n_jobs=1, compression=1000):
         """
         Initialize the transformer.
         :param n_quantiles: Number of quantiles to map to
+        :param encode: One of 'quantile' or 'ordinal'. Default: 'quantile'.
+               If 'quantile', map each value to the quantile of its bucket, a float between 0 and 1.
+               If 'ordinal', map it to the number of that quantile (the quantile times n_quantiles_), as the smallest
+               unsigned integer type which fits n_quantiles.
+        :param n_jobs: Number of threads used to fit and transform the features. Default: 1.
+        :param compression: Size of the quantile sketches used by partial_fit. See QuantileSketch for the error
+               bound. Default: 1000.
         """
         self.n_quantiles = n_quantiles
+        self.encode = encode
+        self.n_jobs = n_jobs
+        self.compression = compression
 
-    def fit(self, X, y=None):
-        n_unique_values = len(np.unique(X))
+    @staticmethod
+    def _as_2d(X):
+        X = np.asarray(X, dtype=float)
 
-        if self.n_quantiles > n_unique_values:
-            self.n_quantiles = n_unique_values
+        return X[:, None] if X.ndim == 1 else X
 
-        self.lookup_table_ = create_quantile_lookup_table(X, self.n_quantiles)
+    def _column_chunks(self, n_columns):
+        return [chunk for chunk in np.array_split(np.arange(n_columns), effective_n_jobs(self.n_jobs)) if len(chunk)]
+
+    def _check_encode(self):
+        if self.encode not in self.VALID_ENCODINGS:
+            raise ValueError('Invalid encode. Must be one of: {}. Passed: {}'.format(self.VALID_ENCODINGS, self.encode))
+
+    def _store_bins(self, columns):
+        """
+        :param columns: List with a tuple (edges, codes, n_quantiles) for every feature, see _fit_column.
+        """
+        n_columns = len(columns)
+
+        self.n_quantiles_ = np.array([n_quantiles for _, _, n_quantiles in columns])
+        self.n_bin_edges_ = np.array([len(edges) - 2 for edges, _, _ in columns])
+
+        max_edges = self.n_bin_edges_.max()
+        self.bin_edges_ = np.full((n_columns, max_edges), np.inf)
+        self.bin_codes_ = np.zeros((n_columns, max_edges + 1), dtype=np.min_scalar_type(self.n_quantiles))
+        self.bin_labels_ = np.full((n_columns, max_edges + 1), np.nan)
+
+        for j, (edges, codes, n_quantiles) in enumerate(columns):
+            self.bin_edges_[j, :len(edges) - 2] = edges[1:-1]
+            self.bin_codes_[j, :len(codes)] = codes
+            self.bin_labels_[j, :len(codes)] = np.linspace(0, 1, n_quantiles + 1)[codes]
 
         return self
 
+    def fit(self, X, y=None):
+        """
+        Find the quantiles of every feature.
+        :param X: Array like or data frame of shape (n_samples,) or (n_samples, n_features).
+        :param y: Not used, included as a parameter for compatibility w/ sklearn
+        :return: self
+        """
+        self._check_encode()
+
+        # Fitting from scratch starts a new partial_fit stream as well.
+        for attribute in ['sketches_', 'has_nans_']:
+            if hasattr(self, attribute):
+                delattr(self, attribute)
+
+        X = np.asfortranarray(self._as_2d(X))
+
+        return self._store_bins(Parallel(n_jobs=self.n_jobs, prefer='threads')(
+            delayed(_fit_column)(X[:, j], self.n_quantiles) for j in range(X.shape[1])))
+
+    def _store_sketch_bins(self):
+        columns = []
+
+        for sketch, has_nans in zip(self.sketches_, self.has_nans_):
+            # Like in fit, NaN counts as a value when capping n_quantiles by the number of unique values.
+            n_unique = sketch.n_distinct()
+            n_quantiles = self.n_quantiles if n_unique is None else min(self.n_quantiles, n_unique + has_nans)
+
+            edges, codes = _bins_from_quantiles(sketch.quantile(np.linspace(0, 1, n_quantiles + 1)))
+            columns.append((edges, codes, n_quantiles))
+
+        return self._store_bins(columns)
+
+    def _start_stream(self, n_columns):
+        if not hasattr(self, 'sketches_'):
+            self.sketches_ = [QuantileSketch(self.compression) for _ in range(n_columns)]
+            self.has_nans_ = np.zeros(n_columns, dtype=bool)
+
+        if n_columns != len(self.sketches_):
+            raise ValueError('X has {} features, but the scaler was fit on {}.'.format(n_columns, len(self.sketches_)))
+
+    def partial_fit(self, X, y=None):
+        """
+        Find the quantiles of every feature, one chunk of the data at a time.
+
+        Only a QuantileSketch per feature is kept between calls, so memory is bounded by compression rather than by
+        the size of the data. The quantiles are within 2 / compression (in rank) of the ones fit would find on all of
+        the data, and exactly the same for features with up to compression distinct values. They still go through the
+        same duplicate dropping and -inf/inf end buckets.
+
+        :param X: Array like or data frame of shape (n_samples,) or (n_samples, n_features).
+        :param y: Not used, included as a parameter for compatibility w/ sklearn
+        :return: self
+        """
+        self._check_encode()
+
+        X = self._as_2d(X)
+        self._start_stream(X.shape[1])
+
+        for j, sketch in enumerate(self.sketches_):
+            sketch.update(round_to_n(X[:, j]))
+
+        self.has_nans_ |= np.isnan(X).any(axis=0)
+
+        return self._store_sketch_bins()
+
+    def merge(self, other):
+        """
+        Merge in a scaler which was fit with partial_fit on other data, e.g. in another process.
+        The result is as if all data had been passed to partial_fit of this scaler.
+        :param other: A QuantileScaler fit with partial_fit on the same features.
+        :return: self
+        """
+        if not hasattr(other, 'sketches_'):
+            raise ValueError('Only scalers fit with partial_fit can be merged.')
+
+        self._start_stream(len(other.sketches_))
+
+        for sketch, other_sketch in zip(self.sketches_, other.sketches_):
+            sketch.merge(other_sketch)
+
+        self.has_nans_ |= other.has_nans_
+
+        return self._store_sketch_bins()
+
+    def _transform_columns(self, X, out, columns):
+        for j in columns:
+            edges = self.bin_edges_[j, :self.n_bin_edges_[j]]
+            bins = np.searchsorted(edges, X[:, j], side='left')
+
+            if self.encode == 'ordinal':
+                np.take(self.bin_codes_[j], bins, out=out[:, j])
+            else:
+                out[:, j] = self.bin_labels_[j, bins]
+                out[np.isnan(X[:, j]), j] = np.nan
+
     def transform(self, X):
-        # Note: this is kinda slow.
-        # TODO: There are some speedups available for this but it's not imperative.
-        return pd.Series(X).apply(lambda a: self.lookup_table_[a]).values
\ No newline at end of file
+        """
+        Map every value to (the number of) the quantile of its bucket.
+        :param X: Array like or data frame with the same number of features as in fit.
+        :return: Numpy array of the same shape as X.
+        """
+        one_dimensional = np.ndim(X) == 1
+        X = self._as_2d(X)
+
+        if X.shape[1] != self.bin_edges_.shape[0]:
+            raise ValueError('X has {} features, but the scaler was fit on {}.'.format(
+                X.shape[1], self.bin_edges_.shape[0]))
+
+        if self.encode == 'ordinal':
+            if np.isnan(X).any():
+                raise ValueError("X contains NaN, which can't be encoded with encode='ordinal'.")
+            out = np.empty(X.shape, dtype=self.bin_codes_.dtype)
+        else:
+            out = np.empty(X.shape)
+
+        Parallel(n_jobs=self.n_jobs, prefer='threads')(
+            delayed(self._transform_columns)(X, out, columns) for columns in self._column_chunks(X.shape[1]))
+
+        return out[:, 0] if one_dimensional else out
+
+    @property
+    def lookup_table_(self):
+        """
+        The lookup table of a scaler fit on a single feature, as a pandas.Series indexed by the buckets.
+        """
+        if self.bin_edges_.shape[0] != 1:
+            raise AttributeError('lookup_table_ is only available for a scaler fit on a single feature.')
+
+        edges = np.concatenate([[-np.inf], self.bin_edges_[0, :self.n_bin_edges_[0]], [np.inf]])
+
+        return pd.Series(data=self.bin_labels_[0, :len(edges) - 1],
+                         index=pd.IntervalIndex.from_breaks(edges, closed='right'))
@@ -0,0 +1,180 @@
+import numpy as np
+
+
+__all__ = ['QuantileSketch']
+
+
+class QuantileSketch:
+    """
+    A bounded memory, mergeable summary of a stream of numbers, which can be used to estimate quantiles.
+
+    The sketch keeps a sorted list of centroids, each of which is the mean, minimum, maximum and count of a run of
+    neighbouring values. Every centroid also keeps the sum of an optional second value (e.g. the target y) of the rows
+    it absorbed, so the sketch can also estimate sums of y over ranges of x.
+
+    Error bound: equal values are always merged exactly. Beyond that, every centroid holds at most
+    2 * count / compression rows and there are at most compression + 1 centroids. So quantiles are off by at most
+    2 / compression in rank (typically much less), and when binning by the centroid means at most that share of the
+    rows lands in a neighbouring bin at each bin edge. As long as there are no more than compression distinct values
+    the sketch is exact.
+    """
+
+    def __init__(self, compression=1000, buffer_size=None):
+        """
+        :param compression: Accuracy/size tradeoff. The sketch holds at most compression + 1 centroids.
+               Default: 1000.
+        :param buffer_size: Number of new rows to buffer before compressing. If None, 4 * compression.
+               Default: None.
+        """
+        self.compression = compression
+        self.buffer_size = 4 * compression if buffer_size is None else buffer_size
+
+        self.means = np.empty(0)
+        self.mins = np.empty(0)
+        self.maxs = np.empty(0)
+        self.counts = np.empty(0)
+        self.y_sums = np.empty(0)
+
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+        self._buffer = []
+        self._buffer_count = 0
+
+    def update(self, x, y=None):
+        """
+        Add values to the sketch. NaN values of x are ignored.
+        :param x: Array like of values.
+        :param y: Optional array like the same length as x, to be summed alongside x. Default: None.
+        :return: self
+        """
+        x = np.asarray(x, dtype=float).ravel()
+        y = np.zeros(len(x)) if y is None else np.asarray(y, dtype=float).ravel()
+
+        if len(x) != len(y):
+            raise ValueError('x and y should have the same length. Passed {} and {}.'.format(len(x), len(y)))
+
+        keep = ~np.isnan(x)
+        if not keep.all():
+            x, y = x[keep], y[keep]
+
+        if len(x) == 0:
+            return self
+
+        self.count += len(x)
+        self.min = min(self.min, x.min())
+        self.max = max(self.max, x.max())
+
+        self._buffer.append((x, x, x, np.ones(len(x)), y))
+        self._buffer_count += len(x)
+
+        if self._buffer_count >= self.buffer_size:
+            self.compress()
+
+        return self
+
+    def merge(self, other):
+        """
+        Merge another sketch into this one. The result summarizes the values of both.
+        :param other: A QuantileSketch.
+        :return: self
+        """
+        other.compress()
+
+        if other.count == 0:
+            return self
+
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        self._buffer.append((other.means, other.mins, other.maxs, other.counts, other.y_sums))
+        self.compress()
+
+        return self
+
+    def compress(self):
+        """
+        Fold the buffered values into the centroids, merging neighbouring centroids to keep the size bounded.
+        :return: self
+        """
+        if not self._buffer:
+            return self
+
+        columns = [np.concatenate([column] + [b[i] for b in self._buffer])
+                   for i, column in enumerate([self.means, self.mins, self.maxs, self.counts, self.y_sums])]
+
+        self._buffer = []
+        self._buffer_count = 0
+
+        order = np.argsort(columns[0], kind='mergesort')
+        means, mins, maxs, counts, y_sums = [column[order] for column in columns]
+
+        # Centroids with the same mean can be merged without losing anything. If that is not enough, group them by
+        # the mid point of their rank range. Each group covers count / compression ranks, so a group of two or more
+        # centroids holds at most 2 * count / compression rows.
+        groups = np.concatenate([[0], np.cumsum(np.diff(means) != 0)])
+
+        if groups[-1] >= self.compression:
+            mid_ranks = np.cumsum(counts) - counts / 2
+            groups = np.floor(mid_ranks * (self.compression / self.count)).astype(np.int64)
+
+        starts = np.flatnonzero(np.concatenate([[True], np.diff(groups) != 0]))
+
+        if len(starts) < len(means):
+            new_counts = np.add.reduceat(counts, starts)
+            mins = np.minimum.reduceat(mins, starts)
+            maxs = np.maximum.reduceat(maxs, starts)
+            means = np.where(mins == maxs, mins, np.add.reduceat(counts * means, starts) / new_counts)
+            y_sums = np.add.reduceat(y_sums, starts)
+            counts = new_counts
+
+        self.means, self.mins, self.maxs, self.counts, self.y_sums = means, mins, maxs, counts, y_sums
+
+        return self
+
+    def centroids(self):
+        """
+        :return: A tuple of numpy arrays (means, counts, y_sums), sorted by mean.
+        """
+        self.compress()
+
+        return self.means, self.counts, self.y_sums
+
+    def n_distinct(self):
+        """
+        :return: The number of distinct values seen, or None if there are too many to keep track of (more than
+                 about compression).
+        """
+        means, _, _ = self.centroids()
+
+        return len(means) if np.array_equal(self.mins, self.maxs) else None
+
+    def quantile(self, q):
+        """
+        Estimate quantiles, interpolating linearly between ranks like pandas.Series.quantile and numpy.quantile.
+        :param q: A number or array like of numbers between 0 and 1.
+        :return: The estimated quantiles.
+        """
+        if self.count == 0:
+            raise ValueError('Cannot compute quantiles of an empty sketch.')
+
+        self.compress()
+
+        # A centroid holds the ranks first to last. If all its values are equal (in particular if it is a single
+        # value) it is known exactly over that whole range, otherwise only its mean is, at the middle rank. Between
+        # those points interpolate linearly, anchored at the minimum and maximum, so an exact sketch gives the same
+        # answers as numpy.quantile.
+        last = np.cumsum(self.counts) - 1
+        first = last - (self.counts - 1)
+        middle = (first + last) / 2
+
+        pure = self.mins == self.maxs
+        ranks = np.column_stack([np.where(pure, first, middle), np.where(pure, last, middle)]).ravel()
+        values = np.repeat(np.where(pure, self.mins, self.means), 2)
+
+        ranks = np.concatenate([[0], ranks, [self.count - 1]])
+        values = np.concatenate([[self.min], values, [self.max]])
+
+        return np.interp(np.asarray(q, dtype=float) * (self.count - 1), ranks, values)
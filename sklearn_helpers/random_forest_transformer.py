@@ -1,25 +1,222 @@
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.base import TransformerMixin
+import numpy as np
+import inspect
+import json
+
+try:
+    from sklearn.ensemble._forest import _generate_unsampled_indices, _get_n_samples_bootstrap
+except ImportError:  # scikit-learn < 0.22
+    from sklearn.ensemble.forest import _generate_unsampled_indices
+    _get_n_samples_bootstrap = None
+
+from .compiled_forest import CompiledForest
 
 
 __all__ = ['RandomForestTransformer']
 
 
+# Defaults of RandomForestRegressor which differ between versions of sklearn.
+_DEFAULTS = {name: parameter.default for name, parameter in
+             inspect.signature(RandomForestRegressor.__init__).parameters.items()}
+
+
+def _out_of_bag_counts(forest, n_samples):
+    """
+    Count how many trees of a fit forest every training row was out of bag for.
+
+    This uses the same (private) helper sklearn uses to compute oob_prediction_, whose arguments differ between
+    versions of sklearn.
+    """
+    n_parameters = len(inspect.signature(_generate_unsampled_indices).parameters)
+    arguments = []
+
+    if n_parameters > 2:
+        n_samples_bootstrap = getattr(forest, '_n_samples_bootstrap', None)
+        if n_samples_bootstrap is None:
+            n_samples_bootstrap = _get_n_samples_bootstrap(n_samples, forest.max_samples)
+        arguments = [n_samples_bootstrap, getattr(forest, '_sample_weight', None)][:n_parameters - 2]
+
+    counts = np.zeros(n_samples, dtype=np.int64)
+    for tree in forest.estimators_:
+        counts[_generate_unsampled_indices(tree.random_state, n_samples, *arguments)] += 1
+
+    return counts
+
+
 class RandomForestTransformer(RandomForestRegressor, TransformerMixin):
     """
     Wrapper to allow the use of RandomForestRegressors as a transformer.
 
     If sklearn ever adds the ability to apply post-processing to predictors (regressors/classifiers)
     in a pipeline then this hacky nonsense will not be needed.
+
+    With oob_transform=True (which needs oob_score=True), fit_transform returns the out-of-bag predictions instead of
+    predicting the training data again. That skips a pass of the whole training set through every tree, and the next
+    step of a pipeline is fit on honest predictions rather than in-sample ones. Rows which were in the bootstrap
+    sample of every tree have no out-of-bag prediction (sklearn warns about this and sets it to 0); they fall back to
+    the prediction of the whole forest.
+
+    After compile(), transform predicts with a CompiledForest, which is much faster for small batches (e.g. scoring
+    single rows online). predict is not affected.
+
+    save() writes the compiled forest to a single file. load() memory maps it into a RandomForestTransformer without
+    estimators_, which predicts and transforms with the compiled forest. Every process which loads the same file
+    shares one copy of the trees, and loading takes about the same time for any size of forest.
     """
 
+    def __init__(self,
+                 n_estimators=100,
+                 *,
+                 criterion=_DEFAULTS['criterion'],
+                 max_depth=None,
+                 min_samples_split=2,
+                 min_samples_leaf=1,
+                 min_weight_fraction_leaf=0.,
+                 max_features=_DEFAULTS['max_features'],
+                 max_leaf_nodes=None,
+                 min_impurity_decrease=0.,
+                 bootstrap=True,
+                 oob_score=False,
+                 n_jobs=None,
+                 random_state=None,
+                 verbose=0,
+                 warm_start=False,
+                 ccp_alpha=0.,
+                 max_samples=None,
+                 monotonic_cst=None,
+                 oob_transform=False):
+        """
+        Takes the parameters of RandomForestRegressor, and:
+        :param oob_transform: If true, fit_transform returns the out-of-bag predictions. Default: False.
+        """
+        super().__init__(n_estimators=n_estimators,
+                         criterion=criterion,
+                         max_depth=max_depth,
+                         min_samples_split=min_samples_split,
+                         min_samples_leaf=min_samples_leaf,
+                         min_weight_fraction_leaf=min_weight_fraction_leaf,
+                         max_features=max_features,
+                         max_leaf_nodes=max_leaf_nodes,
+                         min_impurity_decrease=min_impurity_decrease,
+                         bootstrap=bootstrap,
+                         oob_score=oob_score,
+                         n_jobs=n_jobs,
+                         random_state=random_state,
+                         verbose=verbose,
+                         warm_start=warm_start)
+
+        # Older versions of sklearn don't take these, and ignore them.
+        self.ccp_alpha = ccp_alpha
+        self.max_samples = max_samples
+        self.monotonic_cst = monotonic_cst
+
+        self.oob_transform = oob_transform
+
+    def fit(self, X, y, sample_weight=None):
+        """
+        Fit the random forest. See RandomForestRegressor.fit. Drops a compiled forest of an earlier fit.
+        """
+        if hasattr(self, 'compiled_forest_'):
+            del self.compiled_forest_
+
+        return super().fit(X, y, sample_weight=sample_weight)
+
+    def export_compiled(self):
+        """
+        :return: The fit forest as a CompiledForest, which only needs numpy to predict.
+        """
+        return CompiledForest.from_estimators(self.estimators_)
+
+    def compile(self):
+        """
+        Compile the fit forest, so that transform uses the flat-array CompiledForest.
+        :return: self
+        """
+        self.compiled_forest_ = self.export_compiled()
+
+        return self
+
+    def save(self, path):
+        """
+        Save the fit forest, compiled, as a single file which load() memory maps.
+        Parameters which can't be stored as JSON (e.g. a RandomState as random_state) are not saved.
+        :param path: File name.
+        """
+        compiled = getattr(self, 'compiled_forest_', None) or self.export_compiled()
+
+        params = {}
+        for name, value in self.get_params(deep=False).items():
+            try:
+                params[name] = json.loads(json.dumps(value))
+            except (TypeError, ValueError):
+                continue
+
+        compiled.save(path, metadata={'params': params})
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load a forest written by save(). It has no estimators_, so it can't be refit in place, but transform and
+        predict work as before, e.g. as a step of a fit Pipeline.
+        :param path: File name.
+        :param mmap_mode: Memory map mode, see CompiledForest.load. Default: 'r'.
+        :return: A RandomForestTransformer.
+        """
+        forest = cls(**CompiledForest.load_metadata(path)['params'])
+        forest.compiled_forest_ = CompiledForest.load(path, mmap_mode=mmap_mode)
+        forest.n_features_in_ = forest.compiled_forest_.n_features
+
+        return forest
+
+    def predict(self, X):
+        """
+        Predict with the fit forest. See RandomForestRegressor.predict. A forest from load() predicts with its
+        compiled forest.
+        """
+        if not hasattr(self, 'estimators_') and hasattr(self, 'compiled_forest_'):
+            return self.compiled_forest_.predict(X)
+
+        return super().predict(X)
+
+    def fit_transform(self, X, y=None, **fit_params):
+        """
+        Fit the random forest, and transform X.
+        :param X: Input array
+        :param y: Target values.
+        :param fit_params: Passed to fit, e.g. sample_weight.
+        :return: The predictions, out-of-bag ones if oob_transform is true.
+        """
+        if not self.oob_transform:
+            return self.fit(X, y, **fit_params).transform(X)
+
+        if not self.oob_score:
+            raise ValueError('oob_transform requires oob_score=True.')
+
+        self.fit(X, y, **fit_params)
+        predictions = self.oob_prediction_.copy()
+
+        never_out_of_bag = np.flatnonzero(_out_of_bag_counts(self, len(predictions)) == 0)
+        if len(never_out_of_bag):
+            predictions[never_out_of_bag] = self.predict(_take_rows(X, never_out_of_bag))
+
+        return predictions
+
     def transform(self, X, y=None):
         """
         Apply the fit random forest to transform an input array into an array of predictions.
-        This is a wrapper for RandomForestRegressor.predict()
+        This is a wrapper for RandomForestRegressor.predict(), or CompiledForest.predict() after compile().
 
         :param X: Input array
         :param y: Not used, but required for compatability with sklearn's TransformerMixin API.
         :return: The predictions.
         """
+        if hasattr(self, 'compiled_forest_'):
+            return self.compiled_forest_.predict(X)
+
         return self.predict(X)
+
+
+def _take_rows(X, rows):
+    return X.iloc[rows] if hasattr(X, 'iloc') else X[rows]
+
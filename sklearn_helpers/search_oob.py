@@ -1,10 +1,32 @@
+import json
+import math
+import numbers
+import os
+import tempfile
+import time
+import warnings
+
 import numpy as np
 
-from sklearn.utils.validation import _num_samples
-from sklearn.model_selection import RandomizedSearchCV, GridSearchCV
+from joblib import Parallel, delayed, hash as joblib_hash
+from sklearn.base import clone, is_classifier
+from sklearn.exceptions import FitFailedWarning
+from sklearn.metrics import accuracy_score, log_loss, mean_absolute_error, mean_squared_error, r2_score
+from sklearn.utils import check_array, check_random_state
+from sklearn.utils.validation import _num_samples, indexable
+from sklearn.model_selection import RandomizedSearchCV, GridSearchCV, ParameterGrid, ParameterSampler
+
+try:
+    from sklearn.utils import _safe_indexing
+    from sklearn.ensemble._forest import BaseForest
+except ImportError:  # scikit-learn < 0.22
+    from sklearn.utils import safe_indexing as _safe_indexing
+    from sklearn.ensemble.forest import BaseForest
+
+from .random_forest_transformer import _out_of_bag_counts
 
 
-__all__ = ['RandomizedSearchOOB']
+__all__ = ['RandomizedSearchOOB', 'HalvingRandomSearchOOB', 'make_oob_scorer', 'SearchResultCache']
 
 
 class _OneFold:
@@ -12,26 +34,521 @@ class _OneFold:
     A cross validation generator that generates a single fold containing all examples in both train and test.
     """
     def split(self, X=None, y=None, groups=None):
-        return [(np.array(np.arange(_num_samples(X))),
-                 np.array(np.arange(_num_samples(X))))]
+        rows = np.arange(_num_samples(X))
+        return [(rows, rows)]
 
     def get_n_splits(self, X=None, y=None, groups=None):
         return 1
 
 
-class GridSearchOOB(GridSearchCV):
+class _OOBScorer:
+    """
+    A scorer which scores the out-of-bag predictions of a fit forest, without predicting anything.
+    Called like any sklearn scorer, with the data the estimator was fit on.
+
+    Rows which were in the bootstrap sample of every tree have no out-of-bag prediction, and are left out. Unlike
+    oob_score_ of a regressor, which scores them with a prediction of 0, so the scores differ for small forests.
+    """
+
+    def __init__(self, name, metric, sign, proba):
+        self.name = name
+        self.metric = metric
+        self.sign = sign
+        self.proba = proba
+
+    def __call__(self, estimator, X, y_true, sample_weight=None):
+        if hasattr(estimator, 'oob_decision_function_'):
+            # Rows which were in the bootstrap sample of every tree have no OOB prediction. Depending on the version,
+            # sklearn gives them NaN or zero probabilities. Skip them.
+            proba = estimator.oob_decision_function_
+            rows = _out_of_bag_counts(estimator, len(proba)) > 0
+            y_true, proba = np.asarray(y_true)[rows], proba[rows]
+            if sample_weight is not None:
+                sample_weight = np.asarray(sample_weight)[rows]
+
+            if self.proba:
+                return self.sign * self.metric(y_true, proba, sample_weight=sample_weight, labels=estimator.classes_)
+            y_pred = estimator.classes_[proba.argmax(axis=1)]
+        elif hasattr(estimator, 'oob_prediction_'):
+            if self.proba:
+                raise ValueError('{} needs a classifier.'.format(self.name))
+            # sklearn predicts 0 for the rows without OOB prediction. Skip them, like for classifiers.
+            y_pred = estimator.oob_prediction_
+            rows = _out_of_bag_counts(estimator, len(y_pred)) > 0
+            y_true, y_pred = np.asarray(y_true)[rows], y_pred[rows]
+            if sample_weight is not None:
+                sample_weight = np.asarray(sample_weight)[rows]
+        else:
+            raise ValueError('{} has no out-of-bag predictions. Fit it with oob_score=True.'.format(estimator))
+
+        return self.sign * self.metric(y_true, y_pred, sample_weight=sample_weight)
+
+    def __repr__(self):
+        return 'make_oob_scorer({!r})'.format(self.name)
+
+
+OOB_METRICS = {
+    'r2': (r2_score, 1, False),
+    'neg_mean_squared_error': (mean_squared_error, -1, False),
+    'neg_mean_absolute_error': (mean_absolute_error, -1, False),
+    'accuracy': (accuracy_score, 1, False),
+    'neg_log_loss': (log_loss, -1, True)
+}
+
+
+def make_oob_scorer(metric='r2'):
+    """
+    Make a scorer which scores the out-of-bag predictions of fit forests (oob_prediction_ or
+    oob_decision_function_), rather than predicting the data it is passed. Like sklearn's scorers, greater is better.
+    :param metric: One of 'r2', 'neg_mean_squared_error', 'neg_mean_absolute_error', 'accuracy' or 'neg_log_loss'.
+           Default: 'r2'.
+    :return: A scorer, for the scoring parameter of the OOB searches.
+    """
+    if metric not in OOB_METRICS:
+        raise ValueError('Invalid metric. Must be one of: {}. Passed: {}'.format(list(OOB_METRICS), metric))
+
+    return _OOBScorer(metric, *OOB_METRICS[metric])
+
+
+def _check_scorers(estimator, scoring):
+    """
+    Resolve the scoring parameter of an OOB search. Metric names are scored on the out-of-bag predictions, and None
+    means r2 for regressors and accuracy for classifiers, like oob_score_. Callables are used as they are.
+    :return: A tuple (scorers, multimetric), where scorers is a dictionary of scorers. A single metric is called
+             'score', like in sklearn.
+    """
+    def check(scorer):
+        return make_oob_scorer(scorer) if isinstance(scorer, str) else scorer
+
+    if scoring is None:
+        return {'score': make_oob_scorer('accuracy' if is_classifier(estimator) else 'r2')}, False
+
+    if isinstance(scoring, str) or callable(scoring):
+        return {'score': check(scoring)}, False
+
+    if isinstance(scoring, dict):
+        return {name: check(scorer) for name, scorer in scoring.items()}, True
+
+    return {name: make_oob_scorer(name) for name in scoring}, True
+
+
+def _qualified_name(function):
+    return '{}.{}'.format(function.__module__, getattr(function, '__qualname__', type(function).__qualname__))
+
+
+def _scorer_key(scorer):
+    """
+    :return: A name of the scorer for the cache keys, which is the same in every process. The repr of a function
+             includes its memory address.
+    """
+    if isinstance(scorer, _OOBScorer):
+        return repr(scorer)
+
+    # Made by sklearn's make_scorer.
+    if hasattr(scorer, '_score_func'):
+        return _qualified_name(scorer._score_func), scorer._sign, repr(sorted(scorer._kwargs.items()))
+
+    return _qualified_name(scorer)
+
+
+# Estimator parameters which change how a candidate is fit, but not its scores. They are left out of the cache keys.
+_EXECUTION_PARAMS = ['n_jobs', 'verbose']
+
+
+def _warm_start_groups(candidate_params, estimator):
+    """
+    Group candidates which only differ in n_estimators, so that one forest can be grown through all their sizes.
+    :param candidate_params: List of parameter dictionaries.
+    :param estimator: The estimator the parameters are set on.
+    :return: List of lists of candidate indexes, each sorted by n_estimators.
+    """
+    params = estimator.get_params()
+    can_warm_start = 'warm_start' in params and 'n_estimators' in params
+
+    groups = {}
+    for i, candidate in enumerate(candidate_params):
+        if not can_warm_start or 'warm_start' in candidate:
+            key = i
+        else:
+            # Parameter values needn't be hashable, so compare them by repr.
+            key = tuple(sorted((name, repr(value)) for name, value in candidate.items() if name != 'n_estimators'))
+        groups.setdefault(key, []).append(i)
+
+    def n_estimators(i):
+        return candidate_params[i].get('n_estimators', params.get('n_estimators'))
+
+    return [sorted(group, key=n_estimators) for group in groups.values()]
+
+
+def _fit_and_score_group(estimator, X, y, scorers, candidate_params, fit_params, error_score, warm_start_from=None,
+                         return_estimator=False):
+    """
+    Fit and score candidates which only differ in n_estimators, growing one forest with warm_start.
+    :param warm_start_from: Optional forest fit on X before, with the parameters of the candidates and fewer trees. It
+           is grown rather than a new forest, and changed in place.
+    :param return_estimator: If true, also return the forest of the last candidate.
+    :return: A tuple (out, estimator). out is a list with a tuple ((scores, n_test_samples, fit_time, score_time),
+             failed) for every candidate. The first element is like the result of sklearn's _fit_and_score. fit_time
+             is the total time spent growing the forest up to the size of the candidate. failed is whether the fit
+             raised an error. estimator is the fit forest with return_estimator, if the fits didn't fail, else None.
+    """
+    if warm_start_from is not None:
+        estimator = warm_start_from
+        estimator.set_params(warm_start=True)
+    else:
+        estimator = clone(estimator)
+        if len(candidate_params) > 1:
+            estimator.set_params(warm_start=True)
+
+    out = []
+    fit_time = 0.
+    failed = False
+
+    for parameters in candidate_params:
+        n_estimators = getattr(estimator, 'n_estimators', None)
+        estimator.set_params(**parameters)
+
+        if out and not failed and estimator.n_estimators == n_estimators:
+            # Same forest as the previous candidate.
+            out.append(out[-1])
+            continue
+
+        score_time = 0.
+        if not failed:
+            start_time = time.time()
+            try:
+                estimator.fit(X, y, **fit_params)
+            except Exception as e:
+                if error_score == 'raise' or not isinstance(error_score, numbers.Number):
+                    raise
+                warnings.warn('Estimator fit failed. The score on this train-test partition for these parameters '
+                              'will be set to {}. Details: \n{!r}'.format(error_score, e), FitFailedWarning)
+                failed = True
+            fit_time += time.time() - start_time
+
+        if failed:
+            scores = {name: error_score for name in scorers}
+        else:
+            start_time = time.time()
+            scores = {name: scorer(estimator, X, y) for name, scorer in scorers.items()}
+            score_time = time.time() - start_time
+
+        out.append(((scores, _num_samples(X), fit_time, score_time), failed))
+
+    return out, estimator if return_estimator and not failed else None
+
+
+class SearchResultCache:
+    """
+    An on-disk cache of the results of OOB search candidates, so reruns of a search, or searches over overlapping
+    parameter spaces, don't refit candidates which were evaluated before.
+
+    Every result is a small JSON file in directory, named by a hash of everything it depends on: the estimator class
+    and all its parameters but n_jobs and verbose, the data (X, y and fit parameters), the rows fit on and the names of
+    the scorers. Files are written to a temporary file and renamed, so concurrent searches on one host never see a
+    partial result. After every batch of candidates, results older than max_age are deleted, and then the least
+    recently used ones until the cache is at most max_bytes. Fits which failed are not cached.
+    """
+
+    def __init__(self, directory, max_bytes=2 ** 30, max_age=30 * 24 * 3600):
+        """
+        :param directory: Directory to keep the results in. It is created if it doesn't exist.
+        :param max_bytes: Maximum total size of the cached results, in bytes. Default: 1 GiB.
+        :param max_age: Maximum age of the cached results since they were last used, in seconds. Default: 30 days.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        """
+        :param key: Key of the result, see OOB search fit.
+        :return: The cached result, a tuple (scores, n_test_samples, fit_time, score_time), or None.
+        """
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                result = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            # Not cached, or evicted by another search meanwhile.
+            return None
+
+        return result['scores'], result['n_test_samples'], result['fit_time'], result['score_time']
+
+    def put(self, key, result):
+        """
+        :param key: Key of the result.
+        :param result: A tuple (scores, n_test_samples, fit_time, score_time).
+        """
+        scores, n_test_samples, fit_time, score_time = result
+        os.makedirs(self.directory, exist_ok=True)
+
+        f = tempfile.NamedTemporaryFile('w', dir=self.directory, suffix='.tmp', delete=False)
+        try:
+            with f:
+                json.dump({'scores': {name: float(score) for name, score in scores.items()},
+                           'n_test_samples': int(n_test_samples), 'fit_time': fit_time, 'score_time': score_time}, f)
+            os.replace(f.name, self._path(key))
+        except BaseException:
+            os.remove(f.name)
+            raise
+
+    def evict(self):
+        """
+        Delete results (and temporary files left by interrupted writes) older than max_age, then the least recently
+        used results until the cache is at most max_bytes.
+        """
+        files = []
+        now = time.time()
+
+        for name in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+            if not name.endswith(('.json', '.tmp')):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+                if now - stat.st_mtime > self.max_age:
+                    os.remove(path)
+                elif name.endswith('.json'):
+                    files.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                continue
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+def _check_cache(cache):
+    if cache is None or isinstance(cache, SearchResultCache):
+        return cache
+
+    return SearchResultCache(cache)
+
+
+class _OOBSearchMixin:
+    """
+    The fit of the OOB searches. Every candidate is fit once on all of the data, and candidates which only differ in
+    n_estimators share one forest, grown with warm_start from the smallest to the largest size. So a grid over
+    n_estimators in [100, 200, ..., 1000] costs a single 1000 tree fit per configuration.
+
+    It replaces the fit of sklearn's searches, and builds cv_results_ itself, so it doesn't depend on their private
+    methods, which differ between versions of sklearn.
+
+    Candidates are scored on their out-of-bag predictions (see make_oob_scorer), so nothing is predicted, and fit on
+    X as passed rather than on a copy per candidate.
+
+    With a cache (see SearchResultCache), candidates evaluated before on the same data are read from it instead of
+    refit, and cv_results_ has a 'cache_hit' column.
+    """
+
+    def fit(self, X, y=None, groups=None, **fit_params):
+        """
+        Run fit with all sets of parameters.
+        :param X: Training data, array like of shape (n_samples, n_features).
+        :param y: Target values.
+        :param groups: Not used, included as a parameter for compatibility w/ sklearn.
+        :param fit_params: Passed to the fit method of the estimator.
+        :return: self
+        """
+        scorers, self.multimetric_ = _check_scorers(self.estimator, self.scoring)
+
+        if self.multimetric_ and self.refit is not False and self.refit not in scorers:
+            raise ValueError('For multi-metric scoring, refit must be set to a scorer key or False. '
+                             'Passed: {}'.format(self.refit))
+        refit_metric = self.refit if self.multimetric_ else 'score'
+
+        X, y = indexable(X, y)
+        base_estimator = clone(self.estimator)
+
+        # Forests convert X to float32 (CSC if sparse) when they are fit, which copies it. Do that once here, so that
+        # every candidate is fit on the same array without copying it.
+        if isinstance(base_estimator, BaseForest):
+            X = check_array(X, accept_sparse='csc', dtype=np.float32)
+
+        cache = _check_cache(self.cache)
+        if cache is not None:
+            data_key = joblib_hash((X, y, fit_params))
+            scorers_key = sorted((name, _scorer_key(scorer)) for name, scorer in scorers.items())
+
+        all_candidate_params = []
+        all_out = []
+        all_cache_hits = []
+        results_container = [{}]
+
+        def evaluate_candidates(candidate_params, rows=None, estimators=None):
+            """
+            :param candidate_params: Iterable of parameter dictionaries.
+            :param rows: Optional array with the indexes of the rows to fit on, instead of all of them.
+            :param estimators: Optional list with an element for every candidate: a forest fit on the same rows with
+                   the same parameters but fewer trees, to grow with warm_start, or None. The elements are replaced by
+                   the forests fit for the candidates (None for cache hits and failed fits).
+            :return: The cv_results_ of all candidates evaluated so far.
+            """
+            candidate_params = list(candidate_params)
+            out = [None] * len(candidate_params)
+
+            if cache is not None:
+                rows_key = None if rows is None else joblib_hash(rows)
+                keys = [joblib_hash((type(base_estimator).__name__,
+                                     sorted([(name, value) for name, value in
+                                             clone(base_estimator).set_params(**params).get_params(deep=False).items()
+                                             if name not in _EXECUTION_PARAMS], key=lambda item: item[0]),
+                                     data_key, rows_key, scorers_key))
+                        for params in candidate_params]
+                out = [cache.get(key) for key in keys]
+
+            cache_hits = [result is not None for result in out]
+            to_fit = [i for i, hit in enumerate(cache_hits) if not hit]
+            groups = [[to_fit[i] for i in group]
+                      for group in _warm_start_groups([candidate_params[i] for i in to_fit], base_estimator)]
+
+            X_fit, y_fit, fit_params_fit = X, y, fit_params
+            if rows is not None and groups:
+                X_fit, y_fit, fit_params_fit = _take_rows(X, y, fit_params, rows)
+
+            if self.verbose > 0:
+                print('Fitting {} candidates in {} warm started groups, {} read from the cache'.format(
+                    len(to_fit), len(groups), len(candidate_params) - len(to_fit)))
+
+            def warm_start_from(group):
+                # The candidates of a group only differ in n_estimators, so any of their forests can be grown.
+                if estimators is not None:
+                    return next((estimators[i] for i in group if estimators[i] is not None), None)
+
+            group_out = Parallel(n_jobs=self.n_jobs, verbose=self.verbose, pre_dispatch=self.pre_dispatch)(
+                delayed(_fit_and_score_group)(base_estimator, X_fit, y_fit, scorers,
+                                              [candidate_params[i] for i in group], fit_params_fit, self.error_score,
+                                              warm_start_from(group), estimators is not None)
+                for group in groups)
+
+            if estimators is not None:
+                estimators[:] = [None] * len(candidate_params)
+
+            for group, (group_results, estimator) in zip(groups, group_out):
+                for i, (result, failed) in zip(group, group_results):
+                    out[i] = result
+                    if cache is not None and not failed:
+                        cache.put(keys[i], result)
+
+                if estimators is not None:
+                    # The forest has the size of the last candidate of the group.
+                    estimators[group[-1]] = estimator
+
+            if cache is not None:
+                cache.evict()
+
+            all_candidate_params.extend(candidate_params)
+            all_out.extend(out)
+            all_cache_hits.extend(cache_hits)
+
+            results_container[0] = self._format_results(all_candidate_params, scorers, all_out)
+            if cache is not None:
+                results_container[0]['cache_hit'] = np.array(all_cache_hits)
+            return results_container[0]
+
+        self._run_search(evaluate_candidates)
+        results = results_container[0]
+
+        if self.refit or not self.multimetric_:
+            self.best_index_ = self._select_best_index(results, refit_metric)
+            self.best_params_ = results['params'][self.best_index_]
+            self.best_score_ = results['mean_test_{}'.format(refit_metric)][self.best_index_]
+
+        if self.refit:
+            self.best_estimator_ = clone(base_estimator).set_params(**self.best_params_)
+            start_time = time.time()
+            self.best_estimator_.fit(X, y, **fit_params)
+            self.refit_time_ = time.time() - start_time
+
+        self.scorer_ = scorers if self.multimetric_ else scorers['score']
+        self.cv_results_ = results
+        self.n_splits_ = 1
+
+        return self
+
+    def _format_results(self, candidate_params, scorers, out):
+        """
+        Build cv_results_ the way sklearn's searches do, for the single fold of the OOB searches.
+        :param candidate_params: List of parameter dictionaries.
+        :param scorers: Dictionary of scorers.
+        :param out: List with a tuple (scores, n_test_samples, fit_time, score_time) for every candidate.
+        :return: Dictionary of arrays, with an element for every candidate.
+        """
+        results = {}
+
+        for name, times in [('fit_time', [result[2] for result in out]),
+                            ('score_time', [result[3] for result in out])]:
+            results['mean_' + name] = np.array(times, dtype=float)
+            results['std_' + name] = np.zeros(len(out))
+
+        # Like in sklearn, a parameter column is masked for candidates which don't set it.
+        for name in sorted({name for params in candidate_params for name in params}):
+            column = np.ma.masked_all(len(candidate_params), dtype=object)
+            for i, params in enumerate(candidate_params):
+                if name in params:
+                    column[i] = params[name]
+            results['param_' + name] = column
+
+        results['params'] = candidate_params
+
+        for scorer_name in scorers:
+            scores = np.array([result[0][scorer_name] for result in out], dtype=float)
+            results['split0_test_' + scorer_name] = scores
+            results['mean_test_' + scorer_name] = scores
+            results['std_test_' + scorer_name] = np.zeros(len(out))
+
+            # Rank 1 is the best, tied candidates share the best of their ranks, and failed (NaN) fits come last.
+            negated = np.where(np.isnan(scores), np.inf, -scores)
+            results['rank_test_' + scorer_name] = np.searchsorted(np.sort(negated), negated).astype(np.int32) + 1
+
+        return results
+
+    def _select_best_index(self, results, refit_metric):
+        return results['rank_test_{}'.format(refit_metric)].argmin()
+
+
+def _take_rows(X, y, fit_params, rows):
+    """
+    :return: A tuple (X, y, fit_params) with only the given rows. Fit parameters with a value per row (e.g.
+             sample_weight) are subset as well.
+    """
+    n_samples = _num_samples(X)
+    fit_params = {name: _safe_indexing(value, rows) if hasattr(value, '__len__') and len(value) == n_samples
+                  else value for name, value in fit_params.items()}
+
+    return _safe_indexing(X, rows), None if y is None else _safe_indexing(y, rows), fit_params
+
+
+class GridSearchOOB(_OOBSearchMixin, GridSearchCV):
+    """
+    Perform a hyper-parameter grid search. Instead of cross validating the results using a hold-out set,
+    validate using an out-of-bag prediction. This is only possible with estimators that have such sets, e.g.
+    random forests.
+
+    Pass a directory or a SearchResultCache as cache to keep the results of candidates between searches.
+    """
 
     def __init__(self,
                  estimator,
                  param_grid,
                  scoring=None,
-                 fit_params=None,
                  n_jobs=1,
-                 iid=True,
                  refit=True,
                  verbose=0,
                  pre_dispatch='2*n_jobs',
-                 error_score='raise'):
+                 error_score='raise',
+                 cache=None):
 
         if not hasattr(estimator, 'oob_score'):
             raise ValueError("GridSearchOOB requires the ability to use out-of-bag predictions. "
@@ -49,9 +566,7 @@ class GridSearchOOB(GridSearchCV):
         super(GridSearchOOB, self).__init__(estimator=estimator,
                                             param_grid=param_grid,
                                             scoring=scoring,
-                                            fit_params=fit_params,
                                             n_jobs=n_jobs,
-                                            iid=iid,
                                             refit=refit,
                                             cv=cv,
                                             verbose=verbose,
@@ -59,12 +574,19 @@ class GridSearchOOB(GridSearchCV):
                                             error_score=error_score,
                                             return_train_score=return_train_score)
 
+        self.cache = cache
+
+    def _run_search(self, evaluate_candidates):
+        evaluate_candidates(ParameterGrid(self.param_grid))
+
 
-class RandomizedSearchOOB(RandomizedSearchCV):
+class RandomizedSearchOOB(_OOBSearchMixin, RandomizedSearchCV):
     """
     Perform a random hyper-parameter search. Instead of cross validating the results using a hold-out set,
     validate using an out-of-bag prediction. This is only possible with estimators that have such sets, e.g.
     random forests.
+
+    Pass a directory or a SearchResultCache as cache to keep the results of candidates between searches.
     """
 
     def __init__(self,
@@ -72,14 +594,13 @@ class RandomizedSearchOOB(RandomizedSearchCV):
                  param_distributions,
                  n_iter=10,
                  scoring=None,
-                 fit_params=None,
                  n_jobs=1,
-                 iid=True,
                  refit=True,
                  verbose=0,
                  pre_dispatch='2*n_jobs',
                  random_state=None,
-                 error_score='raise'):
+                 error_score='raise',
+                 cache=None):
 
         if not hasattr(estimator, 'oob_score'):
             raise ValueError("RandomizedSearchOOB requires the ability to use out-of-bag predictions. "
@@ -98,9 +619,7 @@ class RandomizedSearchOOB(RandomizedSearchCV):
                                                   param_distributions=param_distributions,
                                                   n_iter=n_iter,
                                                   scoring=scoring,
-                                                  fit_params=fit_params,
                                                   n_jobs=n_jobs,
-                                                  iid=iid,
                                                   refit=refit,
                                                   cv=cv,
                                                   verbose=verbose,
@@ -108,3 +627,198 @@ class RandomizedSearchOOB(RandomizedSearchCV):
                                                   random_state=random_state,
                                                   error_score=error_score,
                                                   return_train_score=return_train_score)
+
+        self.cache = cache
+
+    def _run_search(self, evaluate_candidates):
+        evaluate_candidates(ParameterSampler(self.param_distributions, self.n_iter, random_state=self.random_state))
+
+
+class HalvingRandomSearchOOB(RandomizedSearchOOB):
+    """
+    Perform a random hyper-parameter search by successive halving, validating with out-of-bag predictions.
+
+    All n_candidates sampled candidates are first fit with few resources: few trees (resource='n_estimators') or a
+    random subsample of the rows (resource='n_samples'). Only the best 1 / factor of them by OOB score are kept, and fit
+    again with factor times the resources, and so on, until the last round fits the survivors with max_resources. So
+    many more candidates can be explored for the cost of a few full size fits. With resource='n_estimators' the
+    survivors' forests are grown with warm_start rather than fit again, so every round only fits the trees it adds.
+
+    cv_results_ has a row for every candidate in every round, with the round in 'iter' and the number of trees or rows
+    in 'n_resources'. best_params_ is the best candidate of the last round, which is refit on all of the data.
+
+    A row only has an OOB prediction if it was left out of the bootstrap sample of some tree, and with t trees about
+    0.632 ** t of the rows never are (a quarter with 3 trees). So rounds are fit with at least MIN_TREES trees by
+    default, which can mean fewer rounds, and several candidates left in the last one.
+    """
+
+    VALID_RESOURCES = ['n_estimators', 'n_samples']
+
+    # With 10 trees, about 1% of the rows have no OOB prediction.
+    MIN_TREES = 10
+
+    def __init__(self,
+                 estimator,
+                 param_distributions,
+                 n_candidates=27,
+                 factor=3,
+                 resource='n_estimators',
+                 min_resources=None,
+                 max_resources=None,
+                 scoring=None,
+                 n_jobs=1,
+                 refit=True,
+                 verbose=0,
+                 pre_dispatch='2*n_jobs',
+                 random_state=None,
+                 error_score='raise',
+                 cache=None):
+        """
+        Takes the parameters of RandomizedSearchOOB except n_iter, and:
+        :param n_candidates: Number of candidates to sample for the first round. Default: 27.
+        :param factor: The share of candidates kept after every round is 1 / factor, and the resources grow by a
+               factor of factor. Default: 3.
+        :param resource: 'n_estimators' to grow the number of trees, or 'n_samples' to grow the number of rows.
+               Default: 'n_estimators'.
+        :param min_resources: Trees or rows of the first round. If None, max_resources shrunk by factor for every
+               round, but at least MIN_TREES trees. Default: None.
+        :param max_resources: Trees or rows of the last round. If None, the n_estimators of the estimator, or all
+               rows. Default: None.
+        """
+        if resource not in self.VALID_RESOURCES:
+            raise ValueError('Invalid resource. Must be one of: {}. Passed: {}'.format(self.VALID_RESOURCES, resource))
+
+        if factor <= 1:
+            raise ValueError('factor should be greater than 1. Passed: {}'.format(factor))
+
+        super(HalvingRandomSearchOOB, self).__init__(estimator=estimator,
+                                                     param_distributions=param_distributions,
+                                                     n_iter=n_candidates,
+                                                     scoring=scoring,
+                                                     n_jobs=n_jobs,
+                                                     refit=refit,
+                                                     verbose=verbose,
+                                                     pre_dispatch=pre_dispatch,
+                                                     random_state=random_state,
+                                                     error_score=error_score,
+                                                     cache=cache)
+
+        self.n_candidates = n_candidates
+        self.factor = factor
+        self.resource = resource
+        self.min_resources = min_resources
+        self.max_resources = max_resources
+
+    def _schedule(self, n_candidates):
+        """
+        :return: List with a tuple (n_candidates, n_resources) for every round.
+        """
+        if self.max_resources is not None:
+            max_resources = self.max_resources
+        elif self.resource == 'n_estimators':
+            max_resources = self.estimator.n_estimators
+        else:
+            max_resources = self._n_samples
+
+        # Enough rounds to get down to a single candidate, as far as min_resources allows.
+        n_rounds = 1 + int(math.floor(math.log(n_candidates) / math.log(self.factor) + 1e-9))
+        if self.min_resources is None:
+            min_resources = max(1, max_resources // self.factor ** (n_rounds - 1))
+            if self.resource == 'n_estimators':
+                min_resources = max(min_resources, min(self.MIN_TREES, max_resources))
+        else:
+            min_resources = self.min_resources
+
+        if not 1 <= min_resources <= max_resources:
+            raise ValueError('min_resources should be between 1 and max_resources ({}). Passed: {}'.format(
+                max_resources, min_resources))
+
+        n_trees = min_resources if self.resource == 'n_estimators' else self.estimator.n_estimators
+        if n_trees < self.MIN_TREES:
+            warnings.warn('Fitting forests of {} trees, where about {:.0%} of the rows have no out-of-bag prediction. '
+                          'Their scores are unreliable, use at least {} trees.'.format(n_trees, 0.632 ** n_trees,
+                                                                                       self.MIN_TREES))
+
+        n_rounds = min(n_rounds, 1 + int(math.floor(math.log(max_resources / min_resources) /
+                                                    math.log(self.factor) + 1e-9)))
+
+        schedule = []
+        for i in range(n_rounds):
+            n_resources = max_resources if i == n_rounds - 1 else int(min_resources * self.factor ** i)
+            schedule.append((n_candidates, n_resources))
+            n_candidates = int(math.ceil(n_candidates / self.factor))
+
+        return schedule
+
+    def fit(self, X, y=None, groups=None, **fit_params):
+        """
+        Run the successive halving search. See RandomizedSearchOOB.fit.
+        """
+        self._n_samples = _num_samples(X)
+
+        return super(HalvingRandomSearchOOB, self).fit(X, y, groups=groups, **fit_params)
+
+    def _run_search(self, evaluate_candidates):
+        if self.resource == 'n_estimators' and any('n_estimators' in distributions for distributions in
+                                                   _as_list(self.param_distributions)):
+            raise ValueError("n_estimators can't be searched over with resource='n_estimators'.")
+
+        if self.multimetric_ and not isinstance(self.refit, str):
+            raise ValueError('With multi-metric scoring, refit must name the scorer to select candidates by.')
+
+        random_state = check_random_state(self.random_state)
+        candidates = list(ParameterSampler(self.param_distributions, self.n_candidates, random_state=random_state))
+        rows = random_state.permutation(self._n_samples)
+
+        self._rounds = []
+        self._round_resources = []
+        self.n_candidates_ = []
+        self.n_resources_ = []
+
+        # The forest of every candidate, to grow in the next round.
+        estimators = [None] * len(candidates)
+
+        for i, (n_candidates, n_resources) in enumerate(self._schedule(len(candidates))):
+            candidates = candidates[:n_candidates]
+            estimators = estimators[:n_candidates]
+
+            if self.verbose > 0:
+                print('Round {}: {} candidates with {} {}'.format(i, len(candidates), n_resources, self.resource))
+
+            self._rounds.extend([i] * len(candidates))
+            self._round_resources.extend([n_resources] * len(candidates))
+            self.n_candidates_.append(len(candidates))
+            self.n_resources_.append(n_resources)
+
+            if self.resource == 'n_estimators':
+                results = evaluate_candidates([dict(candidate, n_estimators=n_resources) for candidate in candidates],
+                                              estimators=estimators)
+            else:
+                results = evaluate_candidates(candidates, rows=np.sort(rows[:n_resources]))
+
+            # Keep the candidates of this round in order of their score, best first.
+            scores = results['mean_test_{}'.format(self._refit_metric())][-len(candidates):]
+            order = np.argsort(-scores, kind='mergesort')
+            candidates = [candidates[j] for j in order]
+            estimators = [estimators[j] for j in order]
+
+    def _refit_metric(self):
+        return self.refit if isinstance(self.refit, str) else 'score'
+
+    def _format_results(self, candidate_params, scorers, out):
+        results = super(HalvingRandomSearchOOB, self)._format_results(candidate_params, scorers, out)
+        results['iter'] = np.array(self._rounds[:len(candidate_params)])
+        results['n_resources'] = np.array(self._round_resources[:len(candidate_params)])
+
+        return results
+
+    def _select_best_index(self, results, refit_metric):
+        # Only the last round is fit with all resources.
+        last_round = np.flatnonzero(results['iter'] == results['iter'].max())
+        scores = results['mean_test_{}'.format(refit_metric)][last_round]
+
+        return last_round[np.argmax(scores)]
+
+
+def _as_list(param_distributions):
+    return param_distributions if isinstance(param_distributions, list) else [param_distributions]
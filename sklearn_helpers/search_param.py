@@ -3,21 +3,60 @@
 
 
 from sklearn.model_selection import ParameterGrid as grid
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import inspect
+import os
 import random
 import numpy as np
 
 
-def fl_search(fun, params: dict, n_iter: int=10)->dict:
+VALID_DIRECTIONS = ['exhaustive', 'coordinate', 'random']
+
+def fl_search(fun, params: dict, n_iter: int=10, n_jobs: int=1, executor=None, max_evals: int=None,
+              return_trace: bool=False, direction: str='exhaustive', n_probe: int=None)->dict:
     """
     This function is to actively search best parameters for one model, should be better than grid search.
     parameter space should be discrete and monotonic.
     :param fun: the self defined function, input of fun should be a dictionary, return is one numeric
-                value, and the lower the better.
+                value, and the lower the better. It can also be a coroutine function (async def), e.g. one which
+                waits for a remote evaluator, then the corners of each iteration are awaited concurrently. If an
+                event loop is already running (e.g. in Jupyter), they are awaited on a new loop in a worker thread.
     :param params: The parameters space to search, with keys as parameters and values are list of candidate values
     :param n_iter: this is the total number of iteration, default is 10, the function will early stop if the
                    local minimum is found
-    :return: A tuple with first one is the dictionary for the best parameters, and second one is a list as the best score tracking
+    :param n_jobs: Number of threads to evaluate the corners of each iteration with, -1 for one per CPU.
+                   Default is 1, which evaluates them one at a time. Ignored if executor is passed.
+    :param executor: Optional concurrent.futures executor to evaluate the corners with, e.g. a ProcessPoolExecutor
+                     (then fun has to be picklable). It is not shut down. Default is None.
+    :param max_evals: Optional maximum number of times to call fun. Every point is only evaluated once, however
+                      many iterations it is a corner of. The search stops when the budget is used up, the last
+                      iteration only evaluating the corners it still can. Default is None, no maximum.
+    :param return_trace: If true, also return the trace of all evaluations. Default is False.
+    :param direction: How to find the move direction of each iteration. Default is 'exhaustive'.
+                      'exhaustive' evaluates all 2^k corners of the lower/upper window of the k parameters.
+                      'coordinate' starts at the corner of the best point so far, evaluates the k corners which differ
+                      from it in one parameter, and then the corner which takes the better side of every parameter,
+                      k + 1 new points at most.
+                      'random' does the same for n_probe of the parameters per iteration, n_probe + 1 new points at
+                      most, keeping the others where they are. It goes through the parameters in a random order,
+                      and stops once none of them improved the score for a whole round.
+                      Use one of the last two with more than about 8 parameters.
+    :param n_probe: Number of parameters to probe per iteration with direction='random'. Default is None, half of
+                    them (at least one).
+    :return: A tuple with first one is the dictionary for the best parameters, and second one is a list as the best score tracking.
+             If return_trace, a third one is a list with a tuple (parameters, score) for every evaluation, in order.
     """
+    if max_evals is not None and max_evals < 1:
+        raise ValueError('max_evals should be at least 1. Passed: {}'.format(max_evals))
+
+    if direction not in VALID_DIRECTIONS:
+        raise ValueError('Invalid direction. Must be one of: {}. Passed: {}'.format(VALID_DIRECTIONS, direction))
+
+    if executor is None and n_jobs != 1 and not inspect.iscoroutinefunction(fun):
+        with ThreadPoolExecutor(max_workers=os.cpu_count() if n_jobs == -1 else n_jobs) as executor:
+            return fl_search(fun, params=params, n_iter=n_iter, executor=executor, max_evals=max_evals,
+                             return_trace=return_trace, direction=direction, n_probe=n_probe)
 
 
     keys=list(params.keys())
@@ -29,37 +68,68 @@ def fl_search(fun, params: dict, n_iter: int=10)->dict:
 
     lower_point, upper_point=_init_upper_lower_points(keys=keys,num_points=num_points)
     move_up={}
+    current={}
     tracking=[]
+    memo={}
+    trace=[]
+
+    # For direction='random', the parameters are probed n_probe at a time, round and round in a random order
+    order=random.sample(keys, len(keys)) if direction == 'random' else keys
+    n_probe=max(1, len(keys) // 2) if n_probe is None else min(n_probe, len(keys))
+    n_probed=0
+    n_unimproved=0
 
 
     for _ in range(n_iter):
-        # find the move direction for next round
+        probe=None
+        if direction == 'random':
+            probe=[order[(n_probed + i) % len(keys)] for i in range(n_probe)]
+            n_probed+=n_probe
+
+        # find the move direction for next round, only evaluating the corners which weren't evaluated before
+        remaining = None if max_evals is None else max_evals - len(trace)
         score,move_up= _find_move_direction(fun=fun,keys=keys,params=params,upper_point=upper_point,
-                                          lower_point=lower_point,move_up=move_up)
+                                          lower_point=lower_point,move_up=move_up,executor=executor,
+                                          memo=memo,trace=trace,max_evals=remaining,direction=direction,
+                                          probe=probe,current=current)
 
         # Track the score for the optimization
         if len(tracking) >= 1 and score == tracking[-1]:
-            break
+            n_unimproved+=len(probe) if probe else len(keys)
+            if n_unimproved >= len(keys):
+                break
         else:
+            n_unimproved=0
             tracking.append(score)
         param = {}
+        best_point = {}
         for key in keys:
             if move_up[key]:
-                param[key] = params[key][upper_point[key]]
+                best_point[key] = upper_point[key]
             else:
-                param[key] = params[key][lower_point[key]]
+                best_point[key] = lower_point[key]
+            param[key] = params[key][best_point[key]]
 
-        # Reset the lower_point and upper_point based move direction
-        lower_point, upper_point = _reset_upper_lower_points(keys=keys, move_up=move_up,
+        # Reset the lower_point and upper_point based move direction, only of the probed parameters if not all are
+        lower_point, upper_point = _reset_upper_lower_points(keys=probe or keys, move_up=move_up,
                                                              num_points=num_points,
                                                              upper_point=upper_point,
                                                              lower_point=lower_point)
 
+        # The corner of the new window at the best point so far, which the partial directions probe around
+        current = {key: best_point[key] == upper_point[key] for key in keys}
 
+        if max_evals is not None and len(trace) >= max_evals:
+            break
 
+
+    if return_trace:
+        return (param, tracking, trace)
     return (param, tracking)
 
-def _find_move_direction(fun,keys:list,params:dict,upper_point:dict,lower_point:dict,move_up:dict)->tuple:
+def _find_move_direction(fun,keys:list,params:dict,upper_point:dict,lower_point:dict,move_up:dict,executor=None,
+                         memo:dict=None,trace:list=None,max_evals:int=None,direction:str='exhaustive',
+                         probe:list=None,current:dict=None)->tuple:
     """
     This function is to calculate the best combination of upper_point and lower_point. The best one decide the moving
     direction for each parameter. The best score should be also stored.
@@ -69,24 +139,92 @@ def _find_move_direction(fun,keys:list,params:dict,upper_point:dict,lower_point:
     :param upper_point: A dictionary with keyse from params, values containing upper point index for each parameter
     :param lower_point: A dictionary with keyse from params, values containing lower point index for each parameter
     :param move_up: A dictionary with keyse from params, values are logic ones describing move up or down.
+    :param executor: Optional concurrent.futures executor to evaluate the corners concurrently with.
+    :param memo: Optional dictionary from the tuple of parameter indexes of a point to its score. Corners in it are
+                 not evaluated again, and new ones are added.
+    :param trace: Optional list, a tuple (parameters, score) is appended for every evaluation.
+    :param max_evals: Optional maximum number of new corners to evaluate. Corners beyond it are skipped.
+    :param direction: One of 'exhaustive', 'coordinate' or 'random', see fl_search.
+    :param probe: The keys to probe with direction='random', see fl_search.
+    :param current: Optional corner for direction='coordinate' or 'random' to probe around, a dictionary with a logic
+                    value per key describing up or down. Default is None, all down.
     :return: A tuple, with the first one is best score, and the second one is the moving direction move_up
     """
     best_score = np.Inf
     move_space = {key: [False, True] for key in params.keys()}
+    memo = {} if memo is None else memo
 
-    for move in grid(move_space):
-        param = {}
-        for key in keys:
-            if move[key]:
-                param[key] = params[key][upper_point[key]]
-            else:
-                param[key] = params[key][lower_point[key]]
-        score = fun(param)
-        if score < best_score:
+    def corner(move):
+        return tuple(upper_point[key] if move[key] else lower_point[key] for key in keys)
+
+    def score_moves(moves):
+        # Evaluate the corners of moves which weren't evaluated before, as far as the budget allows.
+        nonlocal max_evals
+        new_indexes = list(dict.fromkeys(corner(move) for move in moves if corner(move) not in memo))
+        if max_evals is not None:
+            new_indexes = new_indexes[:max_evals]
+            max_evals -= len(new_indexes)
+        points = [{key: params[key][i] for key, i in zip(keys, index)} for index in new_indexes]
+
+        for index, param, score in zip(new_indexes, points, _evaluate(fun, points, executor)):
+            memo[index] = score
+            if trace is not None:
+                trace.append((param, score))
+
+    current = {key: False for key in keys} if not current else current
+
+    if direction == 'exhaustive':
+        moves = list(grid(move_space))
+        score_moves(moves)
+    else:
+        probed = keys if direction == 'coordinate' else probe
+
+        moves = [current] + [dict(current, **{key: not current[key]}) for key in probed]
+        score_moves(moves)
+
+        # Take the better side of every probed parameter on its own, then try them all at once.
+        combined = dict(current)
+        for key, flipped in zip(probed, moves[1:]):
+            if corner(flipped) in memo and corner(current) in memo and memo[corner(flipped)] < memo[corner(current)]:
+                combined[key] = flipped[key]
+        moves.append(combined)
+        score_moves([combined])
+
+    # The scores are in the order of the corners however they were computed, so ties always go to the first corner.
+    for move in moves:
+        index = corner(move)
+        if index in memo and memo[index] < best_score:
             move_up = move
-            best_score = score
+            best_score = memo[index]
     return (best_score,move_up)
 
+def _evaluate(fun, points:list, executor=None)->list:
+    """
+    This function is to evaluate fun at several points, concurrently if possible.
+    :param fun: One callable function, or coroutine function, to evaluate.
+    :param points: A list of parameter dictionaries
+    :param executor: Optional concurrent.futures executor to evaluate the points with
+    :return: A list with the score of every point, in the order of points
+    """
+    if inspect.iscoroutinefunction(fun):
+        async def gather():
+            return await asyncio.gather(*[fun(point) for point in points])
+
+        # asyncio.run can't be called while an event loop is running in this thread (e.g. in Jupyter), so then
+        # run the points on a new event loop in a worker thread, blocking until it is done.
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return list(asyncio.run(gather()))
+
+        with ThreadPoolExecutor(max_workers=1) as worker:
+            return list(worker.submit(asyncio.run, gather()).result())
+
+    if executor is not None:
+        return list(executor.map(fun, points))
+
+    return [fun(point) for point in points]
+
 def _init_upper_lower_points(keys:list,num_points:dict)->tuple:
     """
     This function is to randomly initialize the upper_point and lower_point
@@ -1,45 +1,160 @@
 from sklearn.base import TransformerMixin, BaseEstimator
+import scipy.sparse as sp
+import pandas as pd
+import numpy as np
 
 
 __all__ = ['SparseColumnRemover']
 
 
+def _count_sparse_nonzeros(X):
+    """
+    Count the values greater than zero in every column of a scipy.sparse matrix, from its stored entries only.
+    """
+    if X.format != 'csc':
+        X = X.tocsr()
+
+    if not X.has_canonical_format:
+        X = X.copy()
+        X.sum_duplicates()
+
+    positive = X.data > 0
+
+    if X.format == 'csc':
+        # The entries of column j are indptr[j]:indptr[j + 1].
+        cumulative = np.concatenate([[0], np.cumsum(positive)])
+        return cumulative[X.indptr[1:]] - cumulative[X.indptr[:-1]]
+
+    return np.bincount(X.indices[positive], minlength=X.shape[1])
+
+
+def _count_nonzeros(X, block_rows):
+    """
+    Count the values greater than zero in every column of X, a block of rows at a time, so that no temporary the size
+    of X is allocated.
+    :param X: Data frame, 2D array or scipy.sparse matrix.
+    :param block_rows: Number of rows per block.
+    :return: Numpy array with the count of every column.
+    """
+    if sp.issparse(X):
+        return _count_sparse_nonzeros(X)
+
+    counts = np.zeros(X.shape[1], dtype=np.int64)
+    rows = X.iloc if isinstance(X, pd.DataFrame) else X
+
+    for start in range(0, X.shape[0], block_rows):
+        counts += (np.asarray(rows[start:start + block_rows]) > 0).sum(axis=0)
+
+    return counts
+
+
 class SparseColumnRemover(BaseEstimator, TransformerMixin):
     """
     A transformer which removes columns of a dataframe which are made up of too many zeros.
+
+    Besides data frames it takes numpy arrays and scipy.sparse matrices, whose columns are matched by position. The
+    columns which persist are stored as a boolean mask, support_mask_, which works for all of them. Sparse matrices are
+    never densified.
+
+    Data which doesn't fit in memory can be fit in chunks, either by passing an iterable of chunks to fit or by
+    calling partial_fit once per chunk.
     """
 
     # TODO: Allow a parameter other than zero to be bad,
     #       or have the fitter itself determine if the column is mostly constant.
     #       Only do this if the need arises.
-    def __init__(self, tolerance=0.01):
+    def __init__(self, tolerance=0.01, block_rows=10000):
         """
         :param tolerance: We remove all columns which contain fewer than this ratio of nonzero rows.
+        :param block_rows: Number of rows to count nonzeros of at a time. Bounds the memory used by fit.
+               Default: 10000.
         """
         self.tolerance = tolerance
+        self.block_rows = block_rows
 
     def fit(self, X, y=None):
         """
         Fit the transformer. Look at all columns of X and remember which have fewer than tolerance ratio of zeros.
-        :param X: The data frame with inputs.
+        :param X: The data frame, array or sparse matrix with inputs, or an iterable (e.g. a generator) of them with the
+               same columns.
+        :param y: Not used, included as a parameter for compatibility w/ sklearn
+        :return: self
+        """
+        for attribute in ['nonzeros_in_col_count_', 'n_samples_seen_']:
+            if hasattr(self, attribute):
+                delattr(self, attribute)
+
+        chunks = [X] if hasattr(X, 'shape') else X
+
+        for chunk in chunks:
+            self.partial_fit(chunk)
+
+        if not hasattr(self, 'nonzeros_in_col_count_'):
+            raise ValueError('Cannot fit on an empty iterable of chunks.')
+
+        return self
+
+    def partial_fit(self, X, y=None):
+        """
+        Count the nonzeros of one chunk of the data, and update which columns persist.
+        :param X: Data frame, array or sparse matrix with inputs. Every chunk should have the same columns.
         :param y: Not used, included as a parameter for compatibility w/ sklearn
         :return: self
         """
+        columns = X.columns if isinstance(X, pd.DataFrame) else pd.RangeIndex(X.shape[1])
+        counts = pd.Series(_count_nonzeros(X, self.block_rows), index=columns)
+
+        if hasattr(self, 'nonzeros_in_col_count_'):
+            if not counts.index.equals(self.nonzeros_in_col_count_.index):
+                raise ValueError('All chunks should have the same columns as the first one.')
+
+            counts += self.nonzeros_in_col_count_
+            self.n_samples_seen_ += X.shape[0]
+        else:
+            self.n_samples_seen_ = X.shape[0]
 
-        self.nonzeros_in_col_count_ = (X > 0).sum()
-        bad_cols_bool_vec = self.nonzeros_in_col_count_ > X.shape[0] * self.tolerance
+        self.nonzeros_in_col_count_ = counts
+        bad_cols_bool_vec = self.nonzeros_in_col_count_ > self.n_samples_seen_ * self.tolerance
+        self.support_mask_ = bad_cols_bool_vec.values
         self.columns_that_persist_ = (self.nonzeros_in_col_count_[bad_cols_bool_vec]).keys()
-        self.columns_removed_count_ = X.shape[1] - len(self.columns_that_persist_)
+        self.columns_removed_count_ = len(self.nonzeros_in_col_count_) - len(self.columns_that_persist_)
         self.columns_that_persist_count_ = len(self.columns_that_persist_)
 
         return self
 
+    def _column_selector(self):
+        """
+        :return: The positions of the columns which persist, as a slice if they are contiguous and an array if not.
+        """
+        indices = np.flatnonzero(self.support_mask_)
+
+        if len(indices) > 0 and indices[-1] - indices[0] + 1 == len(indices):
+            return slice(indices[0], indices[-1] + 1)
+
+        return indices
+
     # TODO: Good error message if the columns aren't in X
     def transform(self, X, y=None):
         """
         Remove columns from X which are too sparse w/r/t the trained data.
-        :param X: Dataframe containing inputs
+        :param X: Dataframe containing inputs. Arrays and sparse matrices are also accepted, their columns are matched
+               by position.
         :param y: Not used.
-        :return: X with sparse columns removed.
+        :return: X with sparse columns removed. Arrays give a view if the columns which persist are contiguous and a
+                 single copy otherwise. Sparse matrices give a sparse matrix.
         """
-        return X[self.columns_that_persist_]
\ No newline at end of file
+        if isinstance(X, pd.DataFrame):
+            return X[self.columns_that_persist_]
+
+        if X.shape[1] != len(self.support_mask_):
+            raise ValueError('X has {} columns, but the transformer was fit on {}.'.format(
+                X.shape[1], len(self.support_mask_)))
+
+        if sp.issparse(X):
+            # Formats like COO don't support indexing. CSC slices columns the cheapest, but keep CSR as it is.
+            if X.format not in ['csr', 'csc']:
+                X = X.tocsc()
+
+            return X[:, self._column_selector()]
+
+        return np.asarray(X)[:, self._column_selector()]
@@ -0,0 +1,26 @@
+import os
+import subprocess
+import sys
+
+
+# Packages the compiled models must be usable without.
+BLOCKED = ['pandas', 'scipy', 'sklearn', 'joblib']
+
+# A module set to None in sys.modules raises an ImportError when it is imported.
+_BLOCK = 'import sys\nsys.modules.update(dict.fromkeys({!r}))\n'.format(BLOCKED)
+
+
+def run_numpy_only(code):
+    """
+    Run code in a new Python process, in which pandas, scipy, sklearn and joblib can't be imported.
+    :param code: Python source code.
+    :return: What the code printed.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    result = subprocess.run([sys.executable, '-c', _BLOCK + code], cwd=root, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise AssertionError(result.stderr)
+
+    return result.stdout
@@ -1,4 +1,30 @@
-from sklearn_helpers.quantile_calibrator import QuantileCalibrator
+import json
+import warnings
+
+import numpy as np
+import pytest
+from sklearn.isotonic import isotonic_regression
+
+from sklearn_helpers.quantile_calibrator import QuantileCalibrator, smoothed_isotonic_regression
+from sklearn_helpers.compiled_calibrator import CompiledQuantileCalibrator
+from sklearn_helpers.tests.numpy_only import run_numpy_only
+
+
+def _interval_lookup(lookup_table, val):
+    if val >= lookup_table.index[-1].right:
+        return lookup_table.iloc[-1]
+    elif val <= lookup_table.index[0].left:
+        return lookup_table.iloc[0]
+    else:
+        return lookup_table[val]
+
+
+def _make_data(n=2000, seed=0):
+    rng = np.random.RandomState(seed)
+    X = rng.randn(n)
+    y = X + rng.randn(n)
+
+    return X, y
 
 
 # TODO: Real tests.
@@ -6,3 +32,178 @@ def test_quantile_calibrator():
     qc = QuantileCalibrator()
 
     assert qc is not None
+
+
+def test_transform_matches_interval_lookup():
+    X, y = _make_data()
+    qc = QuantileCalibrator(quantiles=20).fit(X, y)
+
+    edges = [iv.right for iv in qc.lookup_table_.index] + [iv.left for iv in qc.lookup_table_.index]
+    X_test = np.concatenate([X[:500], edges, [-100, 100]])
+
+    expected = np.array([_interval_lookup(qc.lookup_table_, a) for a in X_test])
+
+    np.testing.assert_array_equal(qc.transform(X_test), expected)
+    np.testing.assert_array_equal(qc.predict(X_test), expected)
+
+
+def test_export_compiled(tmp_path):
+    X, y = _make_data()
+    qc = QuantileCalibrator(isotonic_fit=False).fit(X, y)
+
+    path = str(tmp_path / 'calibrator.npz')
+    qc.export_compiled().save(path)
+    compiled = CompiledQuantileCalibrator.load(path)
+
+    X_test = np.array([-10., -1., 0., np.nan, 1., 10.])
+    np.testing.assert_array_equal(compiled.transform(X_test), qc.transform(X_test))
+    assert np.isnan(compiled.transform(X_test)[3])
+
+
+def test_compiled_without_dependencies(tmp_path):
+    X, y = _make_data()
+    qc = QuantileCalibrator().fit(X, y)
+    path = str(tmp_path / 'calibrator.npz')
+    qc.export_compiled().save(path)
+
+    X_test = [-10., -1., 0., np.nan, 1., 10.]
+    output = run_numpy_only('import json\n'
+                            'from sklearn_helpers.compiled_calibrator import CompiledQuantileCalibrator\n'
+                            'compiled = CompiledQuantileCalibrator.load({!r})\n'
+                            'print(json.dumps(compiled.transform(json.loads({!r})).tolist()))'.format(
+                                path, json.dumps(X_test)))
+
+    np.testing.assert_array_equal(json.loads(output), qc.transform(X_test))
+
+
+def test_smoothed_isotonic_regression_matches_cobyla():
+    rng = np.random.RandomState(1)
+
+    for n in [4, 7, 10]:
+        y = np.sort(rng.rand(n)) + 0.2 * rng.randn(n)
+
+        for lamb in [0.1, 1, 10]:
+            cobyla = QuantileCalibrator(isotonic_lambda=lamb, solver='cobyla')._isotonic_fit(y)
+            active_set = smoothed_isotonic_regression(y, lamb)
+
+            assert np.all(np.diff(active_set) >= 0)
+            # The active set solution is exact, so it can only improve on what COBYLA finds.
+            assert QuantileCalibrator._ls_min_func(active_set, y, lamb) <= \
+                QuantileCalibrator._ls_min_func(cobyla, y, lamb) + 1e-6
+            if lamb <= 1:
+                np.testing.assert_allclose(active_set, cobyla, atol=1e-2)
+
+
+def test_smoothed_isotonic_regression_many_bins():
+    rng = np.random.RandomState(2)
+    x = np.sort(rng.rand(5000))
+    y = np.sin(3 * x) + 0.3 * rng.randn(5000)
+
+    f = smoothed_isotonic_regression(y, 100)
+
+    assert np.all(np.diff(f) >= 0)
+
+    # Check the KKT conditions: the multipliers of the monotonicity constraints are non-negative and vanish
+    # wherever the constraint is not tight.
+    grad = f - y - 100 * np.diff(np.pad(np.diff(f, 3), 3), 3)
+    mu = -np.cumsum(grad)[:-1]
+    scale = np.abs(y).sum()
+    assert np.all(mu >= -1e-8 * scale)
+    assert np.all(np.abs(mu[np.diff(f) > 1e-12]) <= 1e-8 * scale)
+
+
+def test_smoothed_isotonic_regression_large_lambda():
+    rng = np.random.RandomState(2)
+    x = np.linspace(-2, 2, 1000)
+    y = np.tanh(x) + 0.5 * rng.randn(1000)
+
+    # For these the primal-dual updates cycle, and the solver has to fall back to the primal active set method.
+    for lamb in [2e4, 5e4, 7e4]:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            f = smoothed_isotonic_regression(y, lamb)
+
+        assert np.all(np.diff(f) >= 0)
+        # Smoothed, rather than the plain isotonic regression.
+        assert QuantileCalibrator._ls_min_func(f, y, lamb) < \
+            QuantileCalibrator._ls_min_func(isotonic_regression(y), y, lamb)
+
+        grad = f - y - lamb * np.diff(np.pad(np.diff(f, 3), 3), 3)
+        mu = -np.cumsum(grad)[:-1]
+        scale = np.abs(y).sum()
+        assert np.all(mu >= -1e-8 * scale)
+        assert np.all(np.abs(mu[np.diff(f) > 1e-12]) <= 1e-8 * scale)
+
+
+def test_partial_fit_matches_fit_on_small_data():
+    X, y = _make_data(n=900)
+
+    for method in ['quantile', 'equal']:
+        qc = QuantileCalibrator(method=method).fit(X, y)
+
+        partial = QuantileCalibrator(method=method)
+        for i in range(0, 900, 100):
+            partial.partial_fit(X[i:i + 100], y[i:i + 100])
+
+        assert list(partial.lookup_table_.index) == list(qc.lookup_table_.index)
+        np.testing.assert_allclose(partial.bin_values_, qc.bin_values_)
+
+
+def test_merged_partial_fits_are_close_to_fit():
+    X, y = _make_data(n=100000)
+    qc = QuantileCalibrator(quantiles=50).fit(X, y)
+
+    parts = [QuantileCalibrator(quantiles=50).partial_fit(X[i:i + 10000], y[i:i + 10000])
+             for i in range(0, 100000, 10000)]
+    merged = parts[0]
+    for part in parts[1:]:
+        merged.merge(part)
+
+    assert len(merged.sketch_.means) <= merged.compression + 1
+    np.testing.assert_allclose(merged.bin_edges_, qc.bin_edges_, atol=0.01)
+    np.testing.assert_allclose(merged.bin_values_, qc.bin_values_, atol=0.02)
+
+
+def test_partial_fit_ignores_nan_y():
+    X, y = _make_data(n=900)
+    y_nan = y.copy()
+    y_nan[::7] = np.nan
+
+    qc = QuantileCalibrator().fit(X, y_nan)
+    partial = QuantileCalibrator().partial_fit(X[y == y_nan], y[y == y_nan])
+
+    assert not np.isnan(partial.bin_values_).any()
+    np.testing.assert_allclose(QuantileCalibrator().partial_fit(X, y_nan).bin_values_, partial.bin_values_)
+    np.testing.assert_allclose(partial.bin_values_, qc.bin_values_, atol=0.05)
+
+
+def test_partial_fit_builds_lookup_table_when_used():
+    X, y = _make_data(n=4000)
+    qc = QuantileCalibrator()
+
+    for i in range(0, 4000, 1000):
+        qc.partial_fit(X[i:i + 1000], y[i:i + 1000])
+        assert 'lookup_table_' not in vars(qc)
+
+    assert qc.transform(X).shape == (4000,)
+    assert 'lookup_table_' in vars(qc)
+    np.testing.assert_allclose(qc.bin_values_, QuantileCalibrator().fit(X, y).bin_values_, atol=0.05)
+
+    # Another chunk makes the table stale again.
+    qc.partial_fit(X[:10], y[:10])
+    assert 'lookup_table_' not in vars(qc)
+    assert len(qc.export_compiled().bin_values) == 10
+
+
+def test_merge_into_fit_calibrator():
+    X, y = _make_data()
+    part = QuantileCalibrator().partial_fit(X, y)
+
+    with pytest.raises(ValueError):
+        QuantileCalibrator().fit(X, y).merge(part)
+
+    with pytest.raises(ValueError):
+        part.merge(QuantileCalibrator().fit(X, y))
+
+    merged = QuantileCalibrator().merge(part)
+    np.testing.assert_allclose(merged.bin_values_, part.bin_values_)
@@ -0,0 +1,164 @@
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.metrics import r2_score, mean_squared_error, mean_absolute_error, log_loss, roc_auc_score
+
+from sklearn_helpers.bootstrap_score import bootstrap_scores, gini_score, BootstrapScorer, BATCHED_METRICS, \
+    _resample_counts, _seed_sequences
+
+
+def _data(n=500, seed=0):
+    rng = np.random.RandomState(seed)
+    y_true = (rng.rand(n) < .3).astype(float)
+    # Rounded, so there are ties.
+    y_pred = np.round(np.clip(.3 + .4 * (y_true - .3) + .2 * rng.randn(n), .01, .99), 2)
+    sample_weight = rng.exponential(size=n)
+
+    return y_true, y_pred, sample_weight
+
+
+@pytest.mark.parametrize('score_fun', [r2_score, mean_squared_error, mean_absolute_error, log_loss, roc_auc_score,
+                                       gini_score])
+def test_batched_metrics(score_fun):
+    y_true, y_pred, sample_weight = _data()
+    weights = _resample_counts(len(y_true), _seed_sequences(0, 5)) * sample_weight
+
+    batched = BATCHED_METRICS[score_fun](y_true, y_pred[:, None])(weights)[:, 0]
+    expected = [score_fun(y_true, y_pred, sample_weight=w) for w in weights]
+
+    np.testing.assert_allclose(batched, expected)
+
+
+@pytest.mark.parametrize('score_fun', [r2_score, mean_squared_error, log_loss, roc_auc_score, gini_score])
+@pytest.mark.parametrize('n_models', [1, 4])
+def test_batch_memory(score_fun, n_models):
+    rng = np.random.RandomState(8)
+    y_true = (rng.rand(20000) < .3).astype(float)
+    y_pred = np.clip(.3 + .4 * (y_true[:, None] - .3) + .2 * rng.randn(20000, n_models), .01, .99)
+    batch_memory = 2 ** 24
+
+    tracemalloc.start()
+    try:
+        bootstrap_scores(y_true, y_pred, score_fun, 200, batch_memory=batch_memory, random_state=9,
+                         multiple_models=True)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    # Several resamples per batch, and the peak allocation close to batch_memory.
+    assert .75 * batch_memory < peak < 1.1 * batch_memory
+
+
+def test_resample_counts():
+    counts = _resample_counts(1000, _seed_sequences(1, 3000))
+
+    np.testing.assert_array_equal(counts.sum(axis=1), 1000)
+    # Every row is left out of about 1 / e of the resamples.
+    np.testing.assert_allclose((counts == 0).mean(axis=0).mean(), np.exp(-1), atol=.01)
+
+
+def _r2(y_true, y_pred, sample_weight=None):
+    return r2_score(y_true, y_pred, sample_weight=sample_weight)
+
+
+@pytest.mark.parametrize('score_fun', [r2_score, _r2])
+def test_reproducible(score_fun):
+    y_true, y_pred, sample_weight = _data(seed=4)
+
+    serial = bootstrap_scores(y_true, y_pred, score_fun, 50, sample_weight, batch_memory=2 ** 17, random_state=5)
+    parallel = bootstrap_scores(y_true, y_pred, score_fun, 50, sample_weight, batch_memory=2 ** 17, n_jobs=2,
+                                random_state=5)
+    other = bootstrap_scores(y_true, y_pred, score_fun, 50, sample_weight, batch_memory=2 ** 17, random_state=6)
+
+    np.testing.assert_array_equal(serial, parallel)
+    assert not np.array_equal(serial, other)
+
+    np.random.seed(7)
+    first = bootstrap_scores(y_true, y_pred, score_fun, 10)
+    np.random.seed(7)
+    np.testing.assert_array_equal(bootstrap_scores(y_true, y_pred, score_fun, 10), first)
+
+
+def test_batched_and_generic_use_the_same_resamples():
+    y_true, y_pred, sample_weight = _data(seed=5)
+
+    batched = bootstrap_scores(y_true, y_pred, r2_score, 20, sample_weight, random_state=8)
+    generic = bootstrap_scores(y_true, y_pred, _r2, 20, sample_weight, random_state=8)
+
+    np.testing.assert_allclose(batched, generic)
+
+
+def test_scorer():
+    y_true, y_pred, _ = _data(seed=3)
+    scorer = BootstrapScorer(gini_score, n_samples=200)
+
+    scores = scorer.scores(y_true, y_pred)
+
+    assert scores.shape == (200,)
+    assert scorer.description_['count'] == 200
+    np.testing.assert_allclose(scorer.description_['50%'], gini_score(y_true, y_pred), atol=.05)
+
+
+def test_adaptive_scorer():
+    y_true, y_pred, sample_weight = _data(n=2000, seed=6)
+
+    # With tol=0 it never converges, so it runs all resamples, the same ones as a fixed run.
+    fixed = BootstrapScorer(r2_score, n_samples=250, random_state=9)
+    fixed.scores(y_true, y_pred, sample_weight)
+    capped = BootstrapScorer(r2_score, n_samples=250, random_state=9, tol=0, batch_size=40)
+
+    np.testing.assert_array_equal(capped.scores(y_true, y_pred, sample_weight), fixed.scores_)
+    assert capped.n_samples_used_ == 250
+    pd.testing.assert_index_equal(capped.description_.index, fixed.description_.index)
+    np.testing.assert_allclose(capped.description_.values, fixed.description_.values)
+    np.testing.assert_allclose(capped.interval_, np.percentile(fixed.scores_, [2.5, 97.5]))
+
+    adaptive = BootstrapScorer(r2_score, n_samples=100000, random_state=9, tol=.002, batch_size=200)
+    scores = adaptive.scores(y_true, y_pred, sample_weight)
+
+    assert adaptive.n_samples_used_ < 100000
+    assert len(scores) == adaptive.n_samples_used_
+    np.testing.assert_array_equal(scores, adaptive.scores_)
+    np.testing.assert_array_equal(scores, bootstrap_scores(y_true, y_pred, r2_score, len(scores), sample_weight,
+                                                           random_state=9))
+    assert adaptive.n_samples_used_ % 200 == 0
+    assert len(adaptive.summary_.means) <= adaptive.compression + 1
+    np.testing.assert_allclose(adaptive.interval_, capped.interval_, atol=.01)
+
+
+@pytest.mark.parametrize('score_fun', [roc_auc_score, _r2])
+def test_several_models(score_fun):
+    y_true, y_pred, sample_weight = _data(seed=7)
+    rng = np.random.RandomState(8)
+    models = pd.DataFrame({'champion': y_pred,
+                           'noisy': np.clip(y_pred + .1 * rng.randn(len(y_pred)), 0, 1),
+                           'constant': .5})
+
+    scorer = BootstrapScorer(score_fun, n_samples=30, random_state=10, multiple_models=True, reference='champion')
+    scores = scorer.scores(y_true, models, sample_weight)
+
+    assert scores.shape == (30, 3)
+    for j, name in enumerate(models.columns):
+        single = bootstrap_scores(y_true, models[name], score_fun, 30, sample_weight, random_state=10)
+        np.testing.assert_allclose(scores[:, j], single)
+
+    np.testing.assert_allclose(scorer.differences_, scores - scores[:, [0]])
+    assert list(scorer.description_.columns) == ['champion', 'noisy', 'constant']
+    assert (scorer.difference_description_['champion'] == 0).iloc[1:].all()
+
+    # The paired differences vary less than the scores of the challenger.
+    assert scorer.differences_[:, 1].std() < scores[:, 1].std()
+
+
+def test_probability_matrix():
+    y_true, y_pred, sample_weight = _data(seed=11)
+    proba = np.column_stack([1 - y_pred, y_pred])
+
+    # Without multiple_models a 2D y_pred is one model's predictions, e.g. predict_proba for log_loss.
+    scores = bootstrap_scores(y_true, proba, log_loss, 20, sample_weight, random_state=12)
+    np.testing.assert_allclose(scores, bootstrap_scores(y_true, y_pred, log_loss, 20, sample_weight, random_state=12))
+
+    with pytest.raises(ValueError):
+        bootstrap_scores(y_true, y_pred, log_loss, 20, multiple_models=True)
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from sklearn_helpers.categorical_cross_terms import CategoricalCrossTermTransformer, HashedCrossTermTransformer, \
+    _combine_codes, _split_keys
+
+
+def _frame(n_rows=1000, seed=0):
+    rng = np.random.RandomState(seed)
+
+    return pd.DataFrame({'age': rng.randint(16, 90, n_rows),
+                         'gender': pd.Series(rng.choice(['f', 'm', None], n_rows), dtype=object),
+                         'score': rng.choice([.5, 1.5, np.nan], n_rows)})
+
+
+def test_categorical_matches_string():
+    X = _frame()
+    columns = ['age', 'gender', 'score']
+
+    strings = CategoricalCrossTermTransformer(columns, behavior='series').fit_transform(X)
+    categorical = CategoricalCrossTermTransformer(columns, behavior='series', encoding='categorical').fit_transform(X)
+
+    assert isinstance(categorical.dtype, pd.CategoricalDtype)
+    assert categorical.name == 'age_gender_score'
+    assert (categorical.cat.codes >= 0).all()
+    np.testing.assert_array_equal(categorical.astype(str).values, strings.values)
+
+
+def test_vocabulary():
+    X = _frame(seed=1)
+    transformer = CategoricalCrossTermTransformer(['age', 'gender'], behavior='replace', encoding='categorical')
+    transformer.fit(X)
+
+    # The names of the combinations are only built when they are needed.
+    assert transformer._categories is None
+    fit = transformer.transform(X)
+    assert len(transformer.categories_) == fit['age_gender'].nunique()
+
+    # The codes are stable for data seen in fit, in a different order.
+    other = X.iloc[::-1]
+    np.testing.assert_array_equal(transformer.transform(other)['age_gender'].cat.codes,
+                                  fit['age_gender'].cat.codes.values[::-1])
+    assert list(transformer.transform(other).columns) == ['score', 'age_gender']
+
+    # Unseen values and unseen combinations get the reserved code -1.
+    unseen = pd.DataFrame({'age': [16, 95, X['age'][0]], 'gender': ['x', 'f', X['gender'][0]], 'score': 0})
+    codes = transformer.transform(unseen)['age_gender'].cat.codes.values
+    np.testing.assert_array_equal(codes, [-1, -1, fit['age_gender'].cat.codes[0]])
+
+
+def test_combine_codes_overflow():
+    rng = np.random.RandomState(2)
+    radices = [2 ** 40, 2 ** 40, 3]
+    codes = [rng.randint(0, min(radix, 10), 100) for radix in radices]
+
+    keys, key_indexes = _combine_codes(codes, radices)
+
+    # The keys would overflow, so they were re-factorized before the second column.
+    assert key_indexes[1] is not None
+    rows = list(zip(*codes))
+    assert len(np.unique(keys)) == len(set(rows))
+    assert all((keys[i] == keys[j]) == (rows[i] == rows[j]) for i in range(100) for j in range(100))
+
+    same_keys, _ = _combine_codes(codes, radices, key_indexes)
+    np.testing.assert_array_equal(same_keys, keys)
+
+    for split, column_codes in zip(_split_keys(keys, radices, key_indexes), codes):
+        np.testing.assert_array_equal(split, column_codes)
+
+    codes[0][0] = 11
+    assert _combine_codes(codes, radices, key_indexes)[0][0] == -1
+
+
+def test_hashed_crosses():
+    X = _frame(seed=3)
+    transformer = HashedCrossTermTransformer(n_features=2 ** 24)
+    hashed = transformer.fit_transform(X)
+
+    assert sp.isspmatrix_csr(hashed)
+    assert hashed.shape == (len(X), 2 ** 24)
+    np.testing.assert_array_equal(hashed.sum(axis=1), 3)
+
+    # With this many buckets there are no collisions, so every cross is one-to-one with its string cross term.
+    for i, cross in enumerate([('age', 'gender'), ('age', 'score'), ('gender', 'score')]):
+        buckets = hashed.indices.reshape(len(X), 3)
+        strings = CategoricalCrossTermTransformer(list(cross), behavior='series').transform(X)
+        single = HashedCrossTermTransformer(crosses=[cross], n_features=2 ** 24).transform(X).indices
+
+        assert len(np.unique(single)) == strings.nunique()
+        assert pd.crosstab(single, strings.values).astype(bool).sum().max() == 1
+        assert np.isin(single, buckets).all()
+
+
+def test_hashed_crosses_in_parallel():
+    X = _frame(seed=4)
+    crosses = [('age', 'gender'), ('age', 'gender', 'score'), ('score',)]
+
+    serial = HashedCrossTermTransformer(crosses=crosses, n_features=64).transform(X)
+    parallel = HashedCrossTermTransformer(crosses=crosses, n_features=64, n_jobs=2).transform(X)
+
+    assert serial.max() >= 2
+    np.testing.assert_array_equal(serial.toarray(), parallel.toarray())
+    np.testing.assert_array_equal(serial.sum(axis=1), 3)
+
+
+def test_hashed_cross_names():
+    X = _frame(seed=5)
+    X = pd.DataFrame({'a_b': X['age'], 'c': X['gender'], 'a': X['age'], 'b_c': X['gender']})
+
+    # The same values in crosses of different columns land in different buckets, even if their names join the same.
+    hashed = HashedCrossTermTransformer(crosses=[('a_b', 'c'), ('a', 'b_c')], n_features=2 ** 24).transform(X)
+    buckets = hashed.indices.reshape(len(X), 2)
+    assert not np.isin(buckets[:, 0], buckets[:, 1]).any()
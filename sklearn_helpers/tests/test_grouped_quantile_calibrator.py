@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn_helpers.grouped_quantile_calibrator import GroupedQuantileCalibrator
+from sklearn_helpers.quantile_calibrator import QuantileCalibrator
+
+
+def _make_data(n=20000, seed=0):
+    rng = np.random.RandomState(seed)
+    groups = pd.DataFrame({'state': rng.choice(['OH', 'TX', 'AZ'], n), 'product': rng.randint(0, 5, n)})
+    X = rng.randn(n)
+    y = X * (1 + groups['product'].values) + rng.randn(n)
+
+    return X, y, groups
+
+
+def test_matches_one_calibrator_per_group():
+    X, y, groups = _make_data()
+
+    for isotonic_fit in [False, True]:
+        gqc = GroupedQuantileCalibrator(isotonic_fit=isotonic_fit).fit(X, y, groups)
+        transformed = gqc.transform(X, groups)
+
+        for key, index in groups.groupby(['state', 'product']).indices.items():
+            qc = QuantileCalibrator(isotonic_fit=isotonic_fit).fit(X[index], y[index])
+
+            g = gqc.groups_.get_loc(key)
+            np.testing.assert_allclose(gqc.bin_values_[gqc.value_offsets_[g]:gqc.value_offsets_[g + 1]],
+                                       qc.bin_values_)
+
+            # pandas rounds the interval labels QuantileCalibrator looks up with, so only compare away from edges.
+            far_from_edges = np.abs(X[index][:, None] - qc.bin_edges_[None, :]).min(axis=1) > 0.01
+            np.testing.assert_allclose(transformed[index][far_from_edges], qc.transform(X[index])[far_from_edges])
+
+
+def test_few_distinct_values():
+    X = np.array([1, 1, 1, 2, 3, 5, 5, 5, 5, 0, 10.])
+    y = np.arange(11.)
+    groups = np.array([0, 0, 0, 1, 1, 1, 1, 1, 1, 2, 2])
+
+    gqc = GroupedQuantileCalibrator(quantiles=4, isotonic_fit=False).fit(X, y, groups)
+
+    # Group 0 is constant, so it has a single bin. In group 1 the bin between the duplicate edges is dropped.
+    np.testing.assert_array_equal(gqc.edge_offsets_, [0, 0, 1, 2])
+    np.testing.assert_array_equal(gqc.transform(X, groups), [1, 1, 1, 3.5, 3.5, 6.5, 6.5, 6.5, 6.5, 9, 10])
+    np.testing.assert_array_equal(gqc.transform([-100, 100, np.nan], [1, 1, 1]), [3.5, 6.5, np.nan])
+
+
+def test_nan():
+    X, y, groups = _make_data(n=2000)
+    groups = groups.values[:, 0]
+    clean = GroupedQuantileCalibrator().fit(X, y, groups)
+
+    # A NaN prediction (or group) is ignored, rather than becoming the top edge of its group.
+    X_nan, groups_nan = X.copy(), groups.astype(object)
+    X_nan[0] = np.nan
+    groups_nan[1] = None
+    keep = np.arange(len(X)) > 1
+    gqc = GroupedQuantileCalibrator().fit(X_nan, y, groups_nan)
+    expected = GroupedQuantileCalibrator().fit(X[keep], y[keep], groups[keep])
+
+    np.testing.assert_array_equal(np.diff(gqc.edge_offsets_), [9, 9, 9])
+    np.testing.assert_array_equal(gqc.edge_offsets_, expected.edge_offsets_)
+    np.testing.assert_allclose(gqc.bin_values_, expected.bin_values_)
+    assert list(gqc.groups_) == list(clean.groups_)
+
+
+def test_nan_in_key_columns():
+    X, y, groups = _make_data(n=2000)
+    groups_nan = groups.astype(object)
+    groups_nan.iloc[0, 0] = None
+    groups_nan.iloc[1, 1] = np.nan
+    keep = np.arange(len(X)) > 1
+
+    # A row with a missing value in any key column is ignored, rather than forming a group like ('OH', nan).
+    gqc = GroupedQuantileCalibrator().fit(X, y, groups_nan)
+    expected = GroupedQuantileCalibrator().fit(X[keep], y[keep], groups[keep])
+
+    assert list(gqc.groups_) == list(expected.groups_)
+    np.testing.assert_array_equal(gqc.edge_offsets_, expected.edge_offsets_)
+    np.testing.assert_allclose(gqc.bin_values_, expected.bin_values_)
+
+
+def test_unseen_group():
+    X, y, groups = _make_data(n=1000)
+    gqc = GroupedQuantileCalibrator().fit(X, y, groups)
+
+    with pytest.raises(ValueError):
+        gqc.transform([0.], pd.DataFrame({'state': ['NY'], 'product': [0]}))
+
+
+def test_n_jobs():
+    X, y, groups = _make_data(n=5000)
+
+    serial = GroupedQuantileCalibrator().fit(X, y, groups)
+    parallel = GroupedQuantileCalibrator(n_jobs=2).fit(X, y, groups)
+
+    np.testing.assert_array_equal(serial.bin_values_, parallel.bin_values_)
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+from sklearn_helpers.quantile_scaler import QuantileScaler, create_quantile_lookup_table, round_to_n
+
+
+def _round_to_n_scalar(x, n=8):
+    n = 1 + n - int(np.floor(np.log10(abs(x) + .1)))
+
+    return round(x, n)
+
+
+def _reference_lookup_table(x, n_quantiles):
+    x = pd.Series(x).apply(_round_to_n_scalar)
+    q = x.quantile(q=np.linspace(0, 1, n_quantiles + 1)).drop_duplicates()
+
+    q.iloc[0] = -np.inf
+    q.iloc[-1] = np.inf
+
+    intervals = [pd.Interval(left=a, right=b, closed='right') for a, b in zip(q.iloc[:-1], q.iloc[1:])]
+
+    return pd.Series(data=q.index[:-1], index=pd.IntervalIndex(intervals))
+
+
+def _make_data(n=5000, seed=0):
+    rng = np.random.RandomState(seed)
+
+    return np.concatenate([rng.randn(n) * 1000, rng.randint(0, 5, n)])
+
+
+def test_round_to_n():
+    rng = np.random.RandomState(1)
+    x = rng.randn(10000) * 10. ** rng.randint(-6, 9, 10000)
+
+    np.testing.assert_array_equal(round_to_n(x), [_round_to_n_scalar(a) for a in x])
+    assert round_to_n(-.00897, 1) == _round_to_n_scalar(-.00897, 1)
+
+
+def test_lookup_table_matches_reference():
+    x = _make_data()
+
+    for n_quantiles in [3, 10, 100]:
+        table = create_quantile_lookup_table(x, n_quantiles)
+        reference = _reference_lookup_table(x, n_quantiles)
+
+        np.testing.assert_allclose(table.index.left, reference.index.left, rtol=1e-12)
+        np.testing.assert_allclose(table.index.right, reference.index.right, rtol=1e-12)
+        np.testing.assert_array_equal(table.values, reference.values)
+
+
+def test_transform_matches_interval_lookup():
+    x = _make_data()
+    scaler = QuantileScaler(n_quantiles=20).fit(x)
+
+    table = scaler.lookup_table_
+    X_test = np.concatenate([x[:1000], table.index.right[:-1], [-1e10, 1e10]])
+
+    np.testing.assert_array_equal(scaler.transform(X_test), [table[a] for a in X_test])
+    assert table.index[0].left == -np.inf and table.index[-1].right == np.inf
+
+
+def test_few_unique_values():
+    scaler = QuantileScaler(n_quantiles=10).fit(pd.Series([1., 2., 2., 3.]))
+
+    assert scaler.n_quantiles_[0] == 3
+    np.testing.assert_array_equal(scaler.transform([0., 1., 2., 2.5, 3., 4.]), [0., 0., 0., 1 / 3, 1 / 3, 1 / 3])
+
+    constant = QuantileScaler().fit([5., 5., 5.])
+    np.testing.assert_array_equal(constant.transform([4., 5., 6.]), [0., 0., 0.])
+
+
+def test_multiple_columns():
+    rng = np.random.RandomState(2)
+    X = pd.DataFrame({'a': rng.randn(3000), 'b': rng.randint(0, 4, 3000), 'c': rng.exponential(size=3000)})
+
+    scaler = QuantileScaler(n_quantiles=50, n_jobs=2).fit(X)
+    transformed = scaler.transform(X)
+
+    assert transformed.shape == X.shape
+    np.testing.assert_array_equal(scaler.n_quantiles_, [50, 4, 50])
+
+    for j, column in enumerate(X.columns):
+        single = QuantileScaler(n_quantiles=50).fit(X[column])
+        np.testing.assert_array_equal(transformed[:, j], single.transform(X[column]))
+
+    ordinal = QuantileScaler(n_quantiles=50, encode='ordinal').fit(X).transform(X)
+
+    assert ordinal.dtype == np.uint8
+    np.testing.assert_allclose(ordinal / scaler.n_quantiles_, transformed)
+
+
+def test_partial_fit():
+    rng = np.random.RandomState(3)
+    X = np.column_stack([rng.randn(100000), rng.randint(0, 3, 100000), rng.exponential(size=100000)])
+
+    small = QuantileScaler(n_quantiles=20).fit(X[:1000])
+    partial = QuantileScaler(n_quantiles=20)
+    for chunk in np.split(X[:1000], 10):
+        partial.partial_fit(chunk)
+
+    np.testing.assert_array_equal(partial.n_quantiles_, small.n_quantiles_)
+    np.testing.assert_allclose(partial.bin_edges_, small.bin_edges_)
+    np.testing.assert_array_equal(partial.transform(X), small.transform(X))
+
+    scaler = QuantileScaler(n_quantiles=20).fit(X)
+    parts = [QuantileScaler(n_quantiles=20).partial_fit(chunk) for chunk in np.split(X, 10)]
+    merged = parts[0]
+    for part in parts[1:]:
+        merged.merge(part)
+
+    np.testing.assert_array_equal(merged.n_quantiles_, [20, 3, 20])
+    assert all(len(sketch.means) <= merged.compression + 1 for sketch in merged.sketches_)
+
+    # Only a small share of the rows should land in a different bucket.
+    assert np.mean(merged.transform(X) != scaler.transform(X)) <= 2. / merged.compression
@@ -0,0 +1,66 @@
+import numpy as np
+
+from sklearn_helpers.quantile_sketch import QuantileSketch
+
+
+def test_small_sketch_is_exact():
+    rng = np.random.RandomState(0)
+    x = rng.randn(500)
+    q = np.linspace(0, 1, 11)
+
+    sketch = QuantileSketch(compression=1000).update(x)
+
+    np.testing.assert_allclose(sketch.quantile(q), np.quantile(x, q))
+    assert len(sketch.centroids()[0]) == 500
+
+
+def test_sketch_error_bound():
+    rng = np.random.RandomState(1)
+    x = rng.exponential(size=200000)
+    y = 2 * x
+    q = np.linspace(0, 1, 101)
+    compression = 200
+
+    sketch = QuantileSketch(compression=compression)
+    for chunk_x, chunk_y in zip(np.split(x, 20), np.split(y, 20)):
+        sketch.update(chunk_x, chunk_y)
+
+    means, counts, y_sums = sketch.centroids()
+
+    assert len(means) <= compression + 1
+    assert counts.max() <= 2 * len(x) / compression
+    assert counts.sum() == len(x)
+    np.testing.assert_allclose(y_sums.sum(), y.sum())
+
+    # The rank of each estimated quantile is within 1 / compression of the requested one.
+    ranks = np.searchsorted(np.sort(x), sketch.quantile(q)) / len(x)
+    assert np.abs(ranks - q).max() <= 1. / compression
+
+
+def test_few_distinct_values_are_exact():
+    rng = np.random.RandomState(3)
+    x = rng.randint(0, 3, 100000) / 10.
+    q = np.linspace(0, 1, 21)
+
+    sketch = QuantileSketch(compression=100)
+    for chunk in np.split(x, 10):
+        sketch.update(chunk)
+
+    assert sketch.n_distinct() == 3
+    np.testing.assert_array_equal(sketch.quantile(q), np.quantile(x, q))
+    assert QuantileSketch(compression=100).update(rng.randn(1000)).n_distinct() is None
+
+
+def test_merge():
+    rng = np.random.RandomState(2)
+    x = rng.randn(50000)
+    q = np.linspace(0, 1, 21)
+
+    sketches = [QuantileSketch(compression=500).update(chunk) for chunk in np.split(x, 5)]
+    merged = sketches[0]
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+
+    assert merged.count == len(x)
+    assert merged.min == x.min() and merged.max == x.max()
+    np.testing.assert_allclose(merged.quantile(q), np.quantile(x, q), atol=0.02)
@@ -0,0 +1,171 @@
+import json
+import warnings
+
+import numpy as np
+import pytest
+from sklearn.base import clone
+from sklearn.pipeline import make_pipeline
+
+from sklearn_helpers.random_forest_transformer import RandomForestTransformer, _out_of_bag_counts
+from sklearn_helpers.quantile_calibrator import QuantileCalibrator
+from sklearn_helpers.tests.numpy_only import run_numpy_only
+
+
+def _data(n=300, seed=0):
+    rng = np.random.RandomState(seed)
+    X = rng.rand(n, 4)
+    y = X[:, 0] + .5 * X[:, 1] ** 2 + .1 * rng.randn(n)
+
+    return X, y
+
+
+def test_parameters():
+    forest = RandomForestTransformer(7, max_depth=3, oob_transform=True)
+
+    params = forest.get_params()
+    assert params['n_estimators'] == 7
+    assert params['max_depth'] == 3
+    assert params['oob_transform'] is True
+
+    cloned = clone(forest)
+    assert cloned.get_params() == params
+    assert not RandomForestTransformer().oob_transform
+
+
+def test_oob_fit_transform():
+    X, y = _data()
+    forest = RandomForestTransformer(n_estimators=50, oob_score=True, oob_transform=True, random_state=0)
+
+    transformed = forest.fit_transform(X, y)
+
+    np.testing.assert_array_equal(transformed, forest.oob_prediction_)
+    assert not np.allclose(transformed, forest.predict(X))
+    np.testing.assert_allclose(forest.transform(X), forest.predict(X))
+
+    # Without oob_transform, fit_transform predicts in sample as before.
+    in_sample = RandomForestTransformer(n_estimators=50, oob_score=True, random_state=0).fit_transform(X, y)
+    np.testing.assert_allclose(in_sample, forest.predict(X))
+
+    with pytest.raises(ValueError):
+        RandomForestTransformer(n_estimators=5, oob_transform=True).fit_transform(X, y)
+
+
+def test_rows_never_out_of_bag():
+    X, y = _data(n=100, seed=1)
+    forest = RandomForestTransformer(n_estimators=3, oob_score=True, oob_transform=True, random_state=2)
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        transformed = forest.fit_transform(X, y)
+
+    # Only sklearn's own warning, once.
+    assert len([warning for warning in caught if 'OOB' in str(warning.message)]) == 1
+
+    counts = _out_of_bag_counts(forest, len(X))
+    assert (counts == 0).any()
+    assert (forest.oob_prediction_[counts == 0] == 0).all()
+    np.testing.assert_allclose(transformed[counts == 0], forest.predict(X[counts == 0]))
+    np.testing.assert_array_equal(transformed[counts > 0], forest.oob_prediction_[counts > 0])
+
+
+def test_pipeline():
+    X, y = _data(n=1000, seed=3)
+    pipeline = make_pipeline(RandomForestTransformer(n_estimators=20, oob_score=True, oob_transform=True,
+                                                     random_state=4),
+                             QuantileCalibrator(quantiles=5))
+
+    pipeline.fit(X, y)
+
+    assert pipeline.predict(X).shape == (1000,)
+
+
+@pytest.mark.parametrize('n_outputs', [1, 2])
+def test_compiled_forest(n_outputs):
+    X, y = _data(n=2000, seed=5)
+    if n_outputs == 2:
+        y = np.column_stack([y, -y])
+
+    forest = RandomForestTransformer(n_estimators=30, min_samples_leaf=2, random_state=6).fit(X, y)
+    compiled = forest.export_compiled()
+
+    X_test, _ = _data(n=500, seed=7)
+    np.testing.assert_allclose(compiled.predict(X_test), forest.predict(X_test))
+    np.testing.assert_array_equal(compiled.apply(X_test) - compiled.roots, forest.apply(X_test))
+
+    # Also in batches smaller than the data.
+    compiled.MAX_BATCH_NODES = 100
+    np.testing.assert_allclose(compiled.predict(X_test), forest.predict(X_test))
+    np.testing.assert_allclose(compiled.predict(X_test[:1]), forest.predict(X_test[:1]))
+
+    # The training data hits the thresholds exactly, which float32 has to get right.
+    np.testing.assert_allclose(compiled.predict(X), forest.predict(X))
+
+    # Versions of sklearn which support missing values send them to one side at every node.
+    if compiled.missing_go_to_left is not None:
+        X_test[::3, 0] = np.nan
+        X_test[::5, 1] = np.nan
+        np.testing.assert_allclose(compiled.predict(X_test), forest.predict(X_test))
+
+
+def test_compile():
+    X, y = _data(seed=8)
+    forest = RandomForestTransformer(n_estimators=10, random_state=9).fit(X, y)
+
+    assert forest.compile() is forest
+    np.testing.assert_allclose(forest.transform(X), forest.predict(X))
+
+    with pytest.raises(ValueError):
+        forest.transform(X[:, :3])
+
+    forest.fit(X[:100], y[:100])
+    assert not hasattr(forest, 'compiled_forest_')
+
+
+@pytest.mark.parametrize('mmap_mode', ['r', None])
+def test_save_load(tmpdir, mmap_mode):
+    X, y = _data(n=1000, seed=10)
+    pipeline = make_pipeline(RandomForestTransformer(n_estimators=20, max_depth=6, random_state=11),
+                             QuantileCalibrator(quantiles=5))
+    pipeline.fit(X, y)
+
+    path = str(tmpdir.join('forest.bin'))
+    pipeline.steps[0][1].save(path)
+    loaded = RandomForestTransformer.load(path, mmap_mode=mmap_mode)
+
+    assert not hasattr(loaded, 'estimators_')
+    assert loaded.get_params() == pipeline.steps[0][1].get_params()
+    if mmap_mode == 'r':
+        assert isinstance(loaded.compiled_forest_.threshold, np.memmap)
+        assert not loaded.compiled_forest_.threshold.flags.writeable
+
+    X_test, _ = _data(n=200, seed=12)
+    expected = pipeline.predict(X_test)
+    np.testing.assert_allclose(loaded.predict(X_test), pipeline.steps[0][1].predict(X_test))
+
+    pipeline.steps[0] = (pipeline.steps[0][0], loaded)
+    np.testing.assert_allclose(pipeline.predict(X_test), expected)
+
+
+def test_compiled_without_dependencies(tmpdir):
+    X, y = _data(seed=13)
+    forest = RandomForestTransformer(n_estimators=10, max_depth=5, random_state=14).fit(X, y)
+    path = str(tmpdir.join('forest.bin'))
+    forest.save(path)
+
+    X_test = X[:20].tolist()
+    output = run_numpy_only('import json\n'
+                            'from sklearn_helpers.compiled_forest import CompiledForest\n'
+                            'compiled = CompiledForest.load({!r})\n'
+                            'print(json.dumps(compiled.predict(json.loads({!r})).tolist()))'.format(
+                                path, json.dumps(X_test)))
+
+    np.testing.assert_allclose(json.loads(output), forest.predict(X_test))
+
+
+def test_load_invalid_file(tmpdir):
+    path = str(tmpdir.join('not_a_forest.bin'))
+    with open(path, 'wb') as f:
+        f.write(b'not a forest')
+
+    with pytest.raises(ValueError):
+        RandomForestTransformer.load(path)
@@ -0,0 +1,321 @@
+import os
+import warnings
+
+import numpy as np
+import pytest
+from scipy.stats import spearmanr
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+from sklearn.metrics import log_loss, make_scorer, r2_score
+from sklearn.model_selection import ParameterGrid
+
+from sklearn_helpers.random_forest_transformer import _out_of_bag_counts
+from sklearn_helpers.search_oob import GridSearchOOB, RandomizedSearchOOB, HalvingRandomSearchOOB, make_oob_scorer, \
+    SearchResultCache, _scorer_key
+
+
+def _data(n=300, seed=0):
+    rng = np.random.RandomState(seed)
+    X = rng.rand(n, 4)
+    y = X[:, 0] + .5 * X[:, 1] ** 2 + .1 * rng.randn(n)
+
+    return X, y
+
+
+def _oob_rows(forest, y):
+    """
+    The rows with an out-of-bag prediction, which the OOB scorers score.
+    """
+    return _out_of_bag_counts(forest, len(y)) > 0
+
+
+class CountingForest(RandomForestRegressor):
+    """
+    Counts the trees it grows, over all instances.
+    """
+    n_trees_grown = 0
+
+    def fit(self, X, y, sample_weight=None):
+        before = len(getattr(self, 'estimators_', [])) if self.warm_start else 0
+        super().fit(X, y, sample_weight=sample_weight)
+        CountingForest.n_trees_grown += len(self.estimators_) - before
+
+        return self
+
+
+def test_warm_start_n_estimators():
+    X, y = _data()
+    forest = CountingForest(oob_score=True, random_state=0)
+    param_grid = {'n_estimators': [20, 5, 10], 'max_depth': [2, 4]}
+
+    CountingForest.n_trees_grown = 0
+    search = GridSearchOOB(forest, param_grid, scoring='neg_mean_squared_error', refit=False).fit(X, y)
+
+    # One 20 tree forest per max_depth.
+    assert CountingForest.n_trees_grown == 40
+
+    # The same scores as fitting every candidate from scratch, in the order of the grid.
+    assert search.cv_results_['params'] == list(ParameterGrid(param_grid))
+    for params, score in zip(search.cv_results_['params'], search.cv_results_['mean_test_score']):
+        cold = clone(forest).set_params(**params).fit(X, y)
+        rows = _oob_rows(cold, y)
+        np.testing.assert_allclose(score, -np.mean((cold.oob_prediction_[rows] - y[rows]) ** 2))
+
+    assert search.best_params_ == search.cv_results_['params'][search.best_index_]
+    assert search.best_params_['max_depth'] == 4
+
+
+def test_randomized_search():
+    X, y = _data(seed=1)
+    forest = RandomForestRegressor(n_estimators=5, oob_score=True, random_state=0)
+
+    search = RandomizedSearchOOB(forest, {'max_depth': [2, 3, 4], 'n_estimators': [3, 6]}, n_iter=4,
+                                 random_state=0).fit(X, y)
+
+    assert len(search.cv_results_['params']) == 4
+    assert search.best_estimator_.get_params()['max_depth'] == search.best_params_['max_depth']
+
+    # With a few trees some rows have no OOB prediction. They are skipped, while oob_score_ scores them as 0.
+    best = search.best_estimator_
+    rows = _oob_rows(best, y)
+    assert not rows.all()
+    np.testing.assert_allclose(search.best_score_, r2_score(y[rows], best.oob_prediction_[rows]))
+    assert search.best_score_ > best.oob_score_
+
+
+def test_halving_n_estimators():
+    X, y = _data(seed=2)
+    forest = RandomForestRegressor(n_estimators=90, oob_score=True, random_state=0)
+    param_distributions = {'max_depth': list(range(1, 10)), 'max_features': [1, 2, 3, 4]}
+
+    search = HalvingRandomSearchOOB(forest, param_distributions, n_candidates=9, random_state=0, n_jobs=2).fit(X, y)
+    results = search.cv_results_
+
+    assert search.n_candidates_ == [9, 3, 1]
+    assert search.n_resources_ == [10, 30, 90]
+    np.testing.assert_array_equal(results['iter'], [0] * 9 + [1] * 3 + [2])
+    assert [params['n_estimators'] for params in results['params']] == [10] * 9 + [30] * 3 + [90]
+
+    # The survivors of every round are its best candidates.
+    for i in [0, 1]:
+        scores = results['mean_test_score'][results['iter'] == i]
+        survivors = [{name: value for name, value in params.items() if name != 'n_estimators'}
+                     for params in np.array(results['params'])[results['iter'] == i + 1]]
+        candidates = [{name: value for name, value in params.items() if name != 'n_estimators'}
+                      for params in np.array(results['params'])[results['iter'] == i]]
+        assert survivors == [candidates[j] for j in np.argsort(-scores, kind='mergesort')[:len(survivors)]]
+
+    assert search.best_index_ == 12
+    assert search.best_params_['n_estimators'] == 90
+    assert search.best_estimator_.n_estimators == 90
+
+    with pytest.raises(ValueError):
+        HalvingRandomSearchOOB(forest, {'n_estimators': [3, 9]}, n_candidates=2).fit(X, y)
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_halving_warm_start(n_jobs):
+    X, y = _data(seed=8)
+    forest = CountingForest(n_estimators=90, oob_score=True, random_state=0)
+    param_distributions = {'max_depth': list(range(1, 10)), 'max_features': [1, 2, 3, 4]}
+
+    CountingForest.n_trees_grown = 0
+    search = HalvingRandomSearchOOB(forest, param_distributions, n_candidates=9, refit=False, random_state=0,
+                                    n_jobs=n_jobs).fit(X, y)
+    results = search.cv_results_
+
+    # The survivors grow their forests: 9 * 10 trees, then 3 * 20 more, then 60 more for the last one. Workers
+    # count in their own processes.
+    assert search.n_resources_ == [10, 30, 90]
+    if n_jobs == 1:
+        assert CountingForest.n_trees_grown == 9 * 10 + 3 * 20 + 60
+
+    # The same scores as fitting every candidate from scratch.
+    for params, score in zip(results['params'], results['mean_test_score']):
+        cold = clone(forest).set_params(**params).fit(X, y)
+        np.testing.assert_allclose(score, make_oob_scorer('r2')(cold, X, y))
+
+
+@pytest.mark.parametrize('resource, min_resources', [('n_estimators', 50), ('n_samples', 400), ('n_samples', 0)])
+def test_halving_min_resources(resource, min_resources):
+    X, y = _data()
+    forest = RandomForestRegressor(n_estimators=30, oob_score=True, random_state=0)
+
+    search = HalvingRandomSearchOOB(forest, {'max_depth': [1, 2, 3]}, n_candidates=3, resource=resource,
+                                    min_resources=min_resources)
+    with pytest.raises(ValueError, match='min_resources'):
+        search.fit(X, y)
+
+
+def test_halving_ranking():
+    X, y = _data(seed=7)
+    forest = RandomForestRegressor(n_estimators=100, oob_score=True, random_state=0)
+    param_distributions = {'max_depth': list(range(1, 10)), 'max_features': [1, 2, 3, 4],
+                           'min_samples_leaf': [1, 5, 20, 50]}
+
+    # 27 candidates would start with 3 trees, where a quarter of the rows have no OOB prediction. Rounds are fit
+    # with at least 10 trees instead, so there is one round less.
+    search = HalvingRandomSearchOOB(forest, param_distributions, random_state=0).fit(X, y)
+    results = search.cv_results_
+
+    assert search.n_candidates_ == [27, 9, 3]
+    assert search.n_resources_ == [10, 30, 100]
+
+    # The first round ranks the candidates like their full size forests do, and keeps the best of them.
+    first = results['iter'] == 0
+    full_scores = [make_oob_scorer('r2')(clone(forest).set_params(**dict(params, n_estimators=100)).fit(X, y), X, y)
+                   for params in np.array(results['params'])[first]]
+    assert spearmanr(results['mean_test_score'][first], full_scores)[0] > .9
+
+    survivors = [{name: value for name, value in params.items() if name != 'n_estimators'}
+                 for params in np.array(results['params'])[results['iter'] == 1]]
+    best = {name: value for name, value in results['params'][int(np.argmax(full_scores))].items()
+            if name != 'n_estimators'}
+    assert best in survivors
+
+    with pytest.warns(UserWarning, match='no out-of-bag prediction'):
+        HalvingRandomSearchOOB(forest, param_distributions, min_resources=3, random_state=0).fit(X, y)
+
+
+def test_halving_n_samples():
+    X, y = _data(n=900, seed=3)
+    forest = RandomForestRegressor(n_estimators=10, oob_score=True, random_state=0)
+
+    search = HalvingRandomSearchOOB(forest, {'max_depth': list(range(1, 10))}, n_candidates=9, resource='n_samples',
+                                    min_resources=100, factor=3, random_state=0).fit(X, y)
+
+    assert search.n_candidates_ == [9, 3, 1]
+    assert search.n_resources_ == [100, 300, 900]
+    np.testing.assert_array_equal(search.cv_results_['n_resources'], [100] * 9 + [300] * 3 + [900])
+
+    # The last round uses all rows, so its score is the one of the refit estimator.
+    best = search.best_estimator_
+    rows = _oob_rows(best, y)
+    np.testing.assert_allclose(search.best_score_, r2_score(y[rows], best.oob_prediction_[rows]))
+
+    with pytest.raises(ValueError):
+        HalvingRandomSearchOOB(forest, {'max_depth': [1, 2]}, resource='n_trees')
+
+
+class NoPredictForest(RandomForestRegressor):
+    def predict(self, X):
+        raise AssertionError('The OOB searches should not predict.')
+
+
+def test_oob_scorer_regression():
+    X, y = _data(seed=4)
+    forest = NoPredictForest(n_estimators=30, oob_score=True, random_state=0)
+
+    search = GridSearchOOB(forest, {'max_depth': [2, 4]}, scoring=['r2', 'neg_mean_squared_error'],
+                           refit='r2').fit(X, y)
+
+    for params, r2, mse in zip(search.cv_results_['params'], search.cv_results_['mean_test_r2'],
+                               search.cv_results_['mean_test_neg_mean_squared_error']):
+        fit = clone(forest).set_params(**params).fit(X, y)
+        # With 30 trees every row has an OOB prediction.
+        assert _oob_rows(fit, y).all()
+        np.testing.assert_allclose(r2, fit.oob_score_)
+        np.testing.assert_allclose(mse, -np.mean((fit.oob_prediction_ - y) ** 2))
+
+    # The default is r2, like oob_score_.
+    default = GridSearchOOB(forest, {'max_depth': [2, 4]}).fit(X, y)
+    np.testing.assert_allclose(default.cv_results_['mean_test_score'], search.cv_results_['mean_test_r2'])
+
+    with pytest.raises(ValueError):
+        make_oob_scorer('neg_log_loss')(search.best_estimator_, X, y)
+    with pytest.raises(ValueError):
+        make_oob_scorer('roc_auc')
+
+
+def test_oob_scorer_classification():
+    X, y = _data(seed=5)
+    y = np.where(y > np.median(y), 'high', 'low')
+    forest = RandomForestClassifier(n_estimators=5, oob_score=True, random_state=0)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        fit = forest.fit(X, y)
+
+    # With 5 trees some rows have no OOB prediction, which are skipped.
+    rows = _oob_rows(fit, y)
+    assert not rows.all()
+
+    y_pred = fit.classes_[fit.oob_decision_function_[rows].argmax(axis=1)]
+    np.testing.assert_allclose(make_oob_scorer('accuracy')(fit, X, y), np.mean(y_pred == y[rows]))
+    np.testing.assert_allclose(make_oob_scorer('neg_log_loss')(fit, X, y),
+                               -log_loss(y[rows], fit.oob_decision_function_[rows], labels=fit.classes_))
+
+    search = RandomizedSearchOOB(forest, {'max_depth': [2, 3, 4]}, n_iter=3, scoring='neg_log_loss',
+                                 random_state=0).fit(X, y)
+    assert np.isfinite(search.cv_results_['mean_test_score']).all()
+
+
+def test_cache(tmpdir):
+    X, y = _data(seed=6)
+    forest = CountingForest(n_estimators=10, oob_score=True, random_state=0)
+    directory = str(tmpdir.join('cache'))
+
+    CountingForest.n_trees_grown = 0
+    first = GridSearchOOB(forest, {'max_depth': [2, 3]}, cache=directory).fit(X, y)
+    assert CountingForest.n_trees_grown == 20 + 10
+    assert not first.cv_results_['cache_hit'].any()
+    assert len(os.listdir(directory)) == 2
+
+    # A rerun over an overlapping grid only fits the new candidate (and the refit).
+    CountingForest.n_trees_grown = 0
+    second = GridSearchOOB(forest, {'max_depth': [2, 3, 4]}, cache=directory).fit(X, y)
+    assert CountingForest.n_trees_grown == 10 + 10
+    np.testing.assert_array_equal(second.cv_results_['cache_hit'], [True, True, False])
+    np.testing.assert_allclose(second.cv_results_['mean_test_score'][:2], first.cv_results_['mean_test_score'])
+
+    # Other data, scoring or estimator parameters are not cache hits.
+    for X_other, scoring, other in [(X + 1, None, forest), (X, 'neg_mean_squared_error', forest),
+                                    (X, None, clone(forest).set_params(random_state=1))]:
+        search = GridSearchOOB(other, {'max_depth': [2]}, scoring=scoring, refit=False, cache=directory)
+        assert not search.fit(X_other, y).cv_results_['cache_hit'].any()
+
+    # n_jobs and verbose don't change the results, so they are still cache hits.
+    other = clone(forest).set_params(n_jobs=2, verbose=1)
+    search = GridSearchOOB(other, {'max_depth': [2, 3]}, refit=False, cache=directory).fit(X, y)
+    assert search.cv_results_['cache_hit'].all()
+
+    assert not [name for name in os.listdir(directory) if not name.endswith('.json')]
+    assert 'cache_hit' not in GridSearchOOB(forest, {'max_depth': [2]}).fit(X, y).cv_results_
+
+
+def _mse(y_true, y_pred):
+    return np.mean((y_true - y_pred) ** 2)
+
+
+def test_scorer_key():
+    # Plain functions are named by module and qualified name, not their repr, which has their memory address.
+    assert _scorer_key(_mse) == __name__ + '._mse'
+    assert _scorer_key(make_oob_scorer('r2')) == "make_oob_scorer('r2')"
+    assert _scorer_key(make_scorer(_mse, greater_is_better=False)) == (__name__ + '._mse', -1, '[]')
+
+
+def test_cache_eviction(tmpdir):
+    X, y = _data(seed=7)
+    forest = RandomForestRegressor(n_estimators=5, oob_score=True, random_state=0)
+    directory = str(tmpdir.join('cache'))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+
+        GridSearchOOB(forest, {'max_depth': [1, 2, 3]}, refit=False, cache=directory).fit(X, y)
+        sizes = [os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)]
+        assert len(sizes) == 3
+
+        # Only the most recently used results which fit in max_bytes are kept.
+        cache = SearchResultCache(directory, max_bytes=sum(sizes) - 1)
+        search = GridSearchOOB(forest, {'max_depth': [1]}, refit=False, cache=cache).fit(X, y)
+        assert search.cv_results_['cache_hit'].all()
+        assert len(os.listdir(directory)) == 2
+
+        SearchResultCache(directory, max_age=-1).evict()
+        assert os.listdir(directory) == []
+
+
+def test_requires_oob_score():
+    with pytest.raises(ValueError):
+        GridSearchOOB(RandomForestRegressor(), {'max_depth': [2, 3]})
@@ -1,8 +1,13 @@
 from sklearn_helpers import search_param
 
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import asyncio
 import math
+import random
+import time
 import numpy as np
 import pandas as pd
+import pytest
 
 def f(param):
 
@@ -53,3 +58,113 @@ def test_reset_upper_lower_points():
     params = {'x': range(-10, 10), 'y': range(-10, 10)}
     keys=list(params.keys())
     num_points=[20,20]
+
+
+def f_ties(param):
+    # Sleep a random time, so that the corners finish in a random order, and give many corners the same score.
+    time.sleep(random.random() / 1000)
+    return abs(param['x']) // 4 + abs(param['y']) // 4
+
+async def f_async(param):
+    # A local stand-in for a remote evaluator.
+    await asyncio.sleep(random.random() / 1000)
+    return f(param)
+
+def _search(fun, **kwargs):
+    random.seed(0)
+    params = {'x': list(range(-10, 10)), 'y': list(range(-10, 10)), 'z': list(range(-3, 3))}
+    return search_param.fl_search(fun, params=params, n_iter=30, **kwargs)
+
+def test_fl_search_parallel():
+    expected = _search(f)
+    assert _search(f, n_jobs=4) == expected
+    assert _search(f_async) == expected
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        assert _search(f, executor=executor) == expected
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        assert _search(f, executor=executor) == expected
+
+    expected_ties = _search(f_ties)
+    for _ in range(3):
+        assert _search(f_ties, n_jobs=8) == expected_ties
+
+class Counting:
+    def __init__(self, fun):
+        self.fun = fun
+        self.calls = 0
+
+    def __call__(self, param):
+        self.calls += 1
+        return self.fun(param)
+
+def test_fl_search_in_running_loop():
+    # Like in Jupyter, where an event loop is already running.
+    async def search_in_loop():
+        return _search(f_async)
+
+    assert asyncio.run(search_in_loop()) == _search(f)
+
+def test_fl_search_memo_and_trace():
+    counting = Counting(f)
+    random.seed(1)
+    params = {'x': list(range(-10, 10)), 'y': list(range(-10, 10))}
+    best, tracking, trace = search_param.fl_search(counting, params=params, n_iter=30, return_trace=True)
+
+    assert best == {'x': 0, 'y': 0}
+    assert tracking[-1] == 0
+    assert counting.calls == len(trace)
+    assert all(score == f(param) for param, score in trace)
+
+    # Every point is only evaluated once, so iterations after the first cost fewer than the 4 corners.
+    points = [tuple(sorted(param.items())) for param, _ in trace]
+    assert len(set(points)) == len(points)
+    assert len(trace) < 4 * (len(tracking) + 1)
+
+def test_fl_search_max_evals():
+    for max_evals in [1, 3, 6, 10]:
+        counting = Counting(f)
+        random.seed(2)
+        params = {'x': list(range(-10, 10)), 'y': list(range(-10, 10))}
+        best, tracking, trace = search_param.fl_search(counting, params=params, n_iter=30, max_evals=max_evals,
+                                                        return_trace=True)
+
+        assert counting.calls == len(trace) == max_evals
+        assert tracking[-1] == min(score for _, score in trace)
+        assert f(best) == tracking[-1]
+
+    with pytest.raises(ValueError):
+        search_param.fl_search(f, params=params, max_evals=0)
+
+@pytest.mark.parametrize('direction', ['coordinate', 'random'])
+def test_fl_search_partial_directions(direction):
+    # 12 parameters would be 4096 corners per iteration for the exhaustive search.
+    random.seed(3)
+    params = {'x{}'.format(i): list(range(-5, 5)) for i in range(12)}
+    counting = Counting(f)
+
+    best, tracking, trace = search_param.fl_search(counting, params=params, n_iter=100, direction=direction,
+                                                    return_trace=True)
+
+    assert best == {key: 0 for key in params}
+    assert tracking[-1] == 0
+    assert all(later < earlier for earlier, later in zip(tracking, tracking[1:]))
+    assert counting.calls == len(trace) < 500
+
+    # The same return format without the trace.
+    random.seed(3)
+    assert search_param.fl_search(f, params=params, n_iter=100, direction=direction) == (best, tracking)
+
+def test_fl_search_random_n_probe():
+    random.seed(4)
+    params = {'x{}'.format(i): list(range(-5, 5)) for i in range(6)}
+    counting = Counting(f)
+
+    best, tracking = search_param.fl_search(counting, params=params, n_iter=100, direction='random', n_probe=1)
+
+    assert best == {key: 0 for key in params}
+    # Every iteration evaluates at most the probed corner and the combined one, which is the same corner.
+    assert counting.calls <= 2 * 100
+
+    with pytest.raises(ValueError):
+        search_param.fl_search(f, params=params, direction='diagonal')
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from sklearn_helpers.sparse_column_remover import SparseColumnRemover
+
+
+def _sparse_frame(n_rows=1000, seed=0):
+    rng = np.random.RandomState(seed)
+    densities = [0, .001, .005, .02, .5, 1]
+
+    return pd.DataFrame({'c{}'.format(i): rng.exponential(size=n_rows) * (rng.rand(n_rows) < density)
+                         for i, density in enumerate(densities)})
+
+
+def test_fit():
+    X = _sparse_frame()
+    remover = SparseColumnRemover(tolerance=.01, block_rows=64).fit(X)
+
+    # Same as counting on the whole frame at once.
+    counts = (X > 0).sum()
+    pd.testing.assert_series_equal(remover.nonzeros_in_col_count_, counts)
+    assert list(remover.columns_that_persist_) == list(counts[counts > len(X) * .01].keys())
+    assert list(remover.columns_that_persist_) == ['c3', 'c4', 'c5']
+    assert remover.columns_removed_count_ == 3
+    pd.testing.assert_frame_equal(remover.transform(X), X[['c3', 'c4', 'c5']])
+
+
+def test_chunked_fit():
+    X = _sparse_frame(n_rows=5000, seed=1)
+    fit = SparseColumnRemover(tolerance=.003).fit(X)
+
+    chunked = SparseColumnRemover(tolerance=.003).fit(X.iloc[start:start + 700] for start in range(0, len(X), 700))
+
+    partial = SparseColumnRemover(tolerance=.003)
+    for rows in np.array_split(np.arange(len(X)), 3):
+        partial.partial_fit(X.iloc[rows])
+
+    for remover in [chunked, partial]:
+        assert remover.n_samples_seen_ == len(X)
+        pd.testing.assert_series_equal(remover.nonzeros_in_col_count_, fit.nonzeros_in_col_count_)
+        assert remover.columns_that_persist_.equals(fit.columns_that_persist_)
+
+
+def test_arrays_and_sparse_matrices():
+    X = _sparse_frame(seed=2)
+    X['c3'] *= -1
+    frame = SparseColumnRemover(tolerance=.01).fit(X)
+    expected = frame.transform(X).values
+
+    np.testing.assert_array_equal(frame.support_mask_, [False, False, False, False, True, True])
+
+    values = X.to_numpy()
+    array = SparseColumnRemover(tolerance=.01).fit(values)
+    np.testing.assert_array_equal(array.support_mask_, frame.support_mask_)
+    assert list(array.columns_that_persist_) == [4, 5]
+
+    # The persisting columns are contiguous, so transform gives a view.
+    transformed = array.transform(values)
+    np.testing.assert_array_equal(transformed, expected)
+    assert np.shares_memory(transformed, values)
+
+    for to_sparse in [sp.csr_matrix, sp.csc_matrix, sp.coo_matrix]:
+        remover = SparseColumnRemover(tolerance=.01).fit(to_sparse(values))
+        np.testing.assert_array_equal(remover.support_mask_, frame.support_mask_)
+        pd.testing.assert_series_equal(remover.nonzeros_in_col_count_, array.nonzeros_in_col_count_)
+
+        transformed = remover.transform(to_sparse(values))
+        assert sp.issparse(transformed)
+        np.testing.assert_array_equal(transformed.toarray(), expected)
+
+
+def test_non_contiguous_columns():
+    X = _sparse_frame(seed=3)[['c5', 'c0', 'c4']].values
+    remover = SparseColumnRemover().fit(sp.csr_matrix(X))
+
+    np.testing.assert_array_equal(remover.support_mask_, [True, False, True])
+    np.testing.assert_array_equal(remover.transform(X), X[:, [0, 2]])
+    np.testing.assert_array_equal(remover.transform(sp.csc_matrix(X)).toarray(), X[:, [0, 2]])